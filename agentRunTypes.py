@@ -3,18 +3,23 @@ from algo_qtable import QTableParamsExplorationDecay
 from algo_dqn import DQN_PARAMS
 from algo_a2c import A2C_PARAMS
 from algo_a3c import A3C_PARAMS
+from algo_mcts import MCTS_PARAMS
 
 # possible types of decision maker
 QTABLE = 'qtable'
 DQN = 'dqn'
 A2C = 'A2C'
 A3C = 'A3C'
+MCTS = 'mcts'
 HEURISTIC = 'heuristic' 
 USER_PLAY = 'play'
 
 # layers num options
 TWO_LAYERS = '2l'
 
+# dqn options
+PRIORITIZED_REPLAY = 'PER'
+
 # A2C options
 ACCUMULATE_HISTORY = 'Exp'
 ADJUSTED_MODEL_2_ACCUMULATION = 'Adjusted'
@@ -102,11 +107,23 @@ def GetRunType(agentName, configDict):
         runType[DECISION_MAKER_TYPE] = "DecisionMakerExperienceReplay"
         numTrials2Save = numTrials2Save=AGENTS_PARAMS[agentName]['numTrials2Save']
 
-        if runArg.find(DQN) >= 0:
+        if runArg.find(MCTS) >= 0:
+            # uct search over transition model learned from history with dqn leaf values
+            runType[DECISION_MAKER_TYPE] = "DecisionMakerMCTS"
+            runType[ALGO_TYPE] = "MCTS"
+            typeStr = MCTS
+            runType[PARAMS] = MCTS_PARAMS(0, 0, layersNum=layersNum, numTrials2Save=numTrials2Save, numTrials2CmpResults=AGENTS_PARAMS[agentName]['numTrials4Cmp'])
+            runType[PARAMS].learning_rate = runType[PARAMS].learning_rate if learningRate == None else learningRate
+
+        elif runArg.find(DQN) >= 0:
             runType[ALGO_TYPE] = "DQN_WithTarget"
             typeStr = DQN
             runType[PARAMS] = DQN_PARAMS(0, 0, layersNum=layersNum, numTrials2Save=numTrials2Save, numTrials2CmpResults=AGENTS_PARAMS[agentName]['numTrials4Cmp'])
             runType[PARAMS].learning_rate = runType[PARAMS].learning_rate if learningRate == None else learningRate
+            if runArg.find(PRIORITIZED_REPLAY) >= 0:
+                # prioritized replay replaces repeating terminal transitions
+                runType[PARAMS].prioritizedReplay = True
+                runType[PARAMS].numRepeatsTerminalLearning = 0
 
         elif runArg.find(A2C) >= 0:
             typeStr = A2C
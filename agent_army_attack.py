@@ -32,7 +32,6 @@ from utils_results import PlotResults
 
 from utils import SwapPnt
 from utils import DistForCmp
-from utils import CenterPoints
 
 AGENT_NAME = "army_attack"
 
@@ -255,17 +254,10 @@ class ArmyAttack(BaseAgent):
         self.current_scaled_state[:] = self.current_state
 
     def GetSelfLoc(self, obs):
-        playerType = obs.observation["feature_screen"][SC2_Params.PLAYER_RELATIVE]
-        unitType = obs.observation["feature_screen"][SC2_Params.UNIT_TYPE]
+        screenUnits = self.sharedData.obsFeatures.ScreenUnits()
 
-        allArmy_y = []
-        allArmy_x = [] 
         for key, spec in TerranUnit.ARMY_SPEC.items():
-            s_y, s_x = ((playerType == SC2_Params.PLAYER_SELF) &(unitType == key)).nonzero()
-            allArmy_y += list(s_y)
-            allArmy_x += list(s_x)
-            
-            selfPoints, selfPower = CenterPoints(s_y, s_x)
+            selfPoints, selfPower = screenUnits.CenterPoints(SC2_Params.PLAYER_SELF, key)
 
 
             for i in range(len(selfPoints)):
@@ -273,25 +265,23 @@ class ArmyAttack(BaseAgent):
                 power = math.ceil(selfPower[i] / spec.numScreenPixels)
                 self.current_state[ArmyAttackState.START_SELF_MAT + idx] += power
 
-        if len(allArmy_y) > 0:
-            self.selfLocCoord = [int(sum(allArmy_y) / len(allArmy_y)), int(sum(allArmy_x) / len(allArmy_x))]
+        selfLocCoord = screenUnits.UnitsCenter(SC2_Params.PLAYER_SELF, TerranUnit.ARMY_SPEC.keys())
+        if selfLocCoord != None:
+            self.selfLocCoord = selfLocCoord
 
     def GetEnemyArmyLoc(self, obs):
-        playerType = obs.observation["feature_screen"][SC2_Params.PLAYER_RELATIVE]
-        unitType = obs.observation["feature_screen"][SC2_Params.UNIT_TYPE]
+        screenUnits = self.sharedData.obsFeatures.ScreenUnits()
 
         enemyPoints = []
         enemyPower = []
         for unit in TerranUnit.ARMY:
-            enemyArmy_y, enemyArmy_x = ((unitType == unit) & (playerType == SC2_Params.PLAYER_HOSTILE)).nonzero()
-            
-            if len(enemyArmy_y) > 0:
+            if screenUnits.NumPixels(SC2_Params.PLAYER_HOSTILE, unit) > 0:
                 if unit in TerranUnit.ARMY_SPEC.keys():
                     numScreenPixels = TerranUnit.ARMY_SPEC[unit].numScreenPixels
                 else:
                     numScreenPixels = TerranUnit.DEFAULT_UNIT_NUM_SCREEN_PIXELS
 
-                unitPoints, unitPower = CenterPoints(enemyArmy_y, enemyArmy_x, numScreenPixels)
+                unitPoints, unitPower = screenUnits.CenterPoints(SC2_Params.PLAYER_HOSTILE, unit, numScreenPixels)
                 enemyPoints += unitPoints
                 enemyPower += unitPower
             
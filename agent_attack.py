@@ -113,7 +113,7 @@ class AttackAgent(BaseAgent):
 
 
     def UpdateEnemyMat(self, obs):
-        miniMapEnemy = obs.observation['feature_minimap'][SC2_Params.PLAYER_RELATIVE_MINIMAP] == SC2_Params.PLAYER_HOSTILE
+        miniMapEnemy = self.sharedData.obsFeatures.MinimapMask(SC2_Params.PLAYER_RELATIVE_MINIMAP, SC2_Params.PLAYER_HOSTILE)
 
         for y in range(SC2_Params.MINIMAP_SIZE):
             for x in range(SC2_Params.MINIMAP_SIZE):                
@@ -238,7 +238,7 @@ class AttackAgent(BaseAgent):
         coordEnd = self.action2End[action]
         coord2Go = np.add(coordStart, coordEnd) / 2
         
-        enemyMat = obs.observation["feature_minimap"][SC2_Params.PLAYER_RELATIVE_MINIMAP] == SC2_Params.PLAYER_HOSTILE
+        enemyMat = self.sharedData.obsFeatures.MinimapMask(SC2_Params.PLAYER_RELATIVE_MINIMAP, SC2_Params.PLAYER_HOSTILE)
         if enemyMat.any():
             miniMapCoordRange = np.zeros((SC2_Params.MINIMAP_SIZE, SC2_Params.MINIMAP_SIZE), bool)
             miniMapCoordRange[coordStart[SC2_Params.Y_IDX]:coordEnd[SC2_Params.Y_IDX], coordStart[SC2_Params.X_IDX]:coordEnd[SC2_Params.X_IDX]] = True
@@ -257,7 +257,7 @@ class AttackAgent(BaseAgent):
 
     def InBattle(self, obs):
         s_y, s_x = obs.observation['feature_minimap'][SC2_Params.SELECTED_IN_MINIMAP].nonzero()
-        e_y, e_x = (obs.observation['feature_minimap'][SC2_Params.PLAYER_RELATIVE_MINIMAP] == SC2_Params.PLAYER_HOSTILE).nonzero()
+        e_y, e_x = self.sharedData.obsFeatures.MinimapNonzero(SC2_Params.PLAYER_RELATIVE_MINIMAP, SC2_Params.PLAYER_HOSTILE)
 
         
         minDist = 1000
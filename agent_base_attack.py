@@ -26,7 +26,6 @@ from algo_decisionMaker import CreateDecisionMaker
 
 from utils import SwapPnt
 from utils import DistForCmp
-from utils import CenterPoints
 
 
 AGENT_DIR = "BaseAttack/"
@@ -241,36 +240,28 @@ class BaseAttack(BaseAgent):
         self.current_scaled_state[:] = self.current_state[:]
 
     def GetSelfLoc(self, obs):
-        playerType = obs.observation["feature_screen"][SC2_Params.PLAYER_RELATIVE]
-        unitType = obs.observation["feature_screen"][SC2_Params.UNIT_TYPE]
+        screenUnits = self.sharedData.obsFeatures.ScreenUnits()
 
-        allArmy_y = []
-        allArmy_x = [] 
         for key, spec in TerranUnit.ARMY_SPEC.items():
-            s_y, s_x = ((playerType == SC2_Params.PLAYER_SELF) &(unitType == key)).nonzero()
-            allArmy_y += list(s_y)
-            allArmy_x += list(s_x)
-            
-            selfPoints, selfPower = CenterPoints(s_y, s_x)
+            selfPoints, selfPower = screenUnits.CenterPoints(SC2_Params.PLAYER_SELF, key)
             
             for i in range(len(selfPoints)):
                 idx = self.GetScaledIdx(selfPoints[i])
                 power = math.ceil(selfPower[i] / spec.numScreenPixels)
                 self.current_state[BaseAttackState.START_SELF_MAT + idx] += power
 
-        if len(allArmy_y) > 0:
-            self.selfLocCoord = [int(sum(allArmy_y) / len(allArmy_y)), int(sum(allArmy_x) / len(allArmy_x))]
+        selfLocCoord = screenUnits.UnitsCenter(SC2_Params.PLAYER_SELF, TerranUnit.ARMY_SPEC.keys())
+        if selfLocCoord != None:
+            self.selfLocCoord = selfLocCoord
 
     def GetEnemyBuildingLoc(self, obs):
-        playerType = obs.observation["feature_screen"][SC2_Params.PLAYER_RELATIVE]
-        unitType = obs.observation["feature_screen"][SC2_Params.UNIT_TYPE]
+        screenUnits = self.sharedData.obsFeatures.ScreenUnits()
 
         enemyBuildingPoints = []
         enemyBuildingPower = []
         for unit , spec in self.buildingDetails.items():
-            enemyArmy_y, enemyArmy_x = ((unitType == unit) & (playerType == SC2_Params.PLAYER_HOSTILE)).nonzero()
-            if len(enemyArmy_y) > 0:
-                buildingPoints, buildingPower = CenterPoints(enemyArmy_y, enemyArmy_x, spec.numScreenPixels)
+            if screenUnits.NumPixels(SC2_Params.PLAYER_HOSTILE, unit) > 0:
+                buildingPoints, buildingPower = screenUnits.CenterPoints(SC2_Params.PLAYER_HOSTILE, unit, spec.numScreenPixels)
                 enemyBuildingPoints += buildingPoints
                 enemyBuildingPower += buildingPower * spec.value
         
@@ -42,7 +42,6 @@ from algo_qtable import QTableParamsExplorationDecay
 
 from utils import SwapPnt
 from utils import DistForCmp
-from utils import CenterPoints
 
 STEP_DURATION = 0
 
@@ -288,17 +287,10 @@ class BattleMngr(BaseAgent):
         self.current_scaled_state[:] = self.current_state[:]
 
     def GetSelfLoc(self, obs):
-        playerType = obs.observation["feature_screen"][SC2_Params.PLAYER_RELATIVE]
-        unitType = obs.observation["feature_screen"][SC2_Params.UNIT_TYPE]
+        screenUnits = self.sharedData.obsFeatures.ScreenUnits()
 
-        allArmy_y = []
-        allArmy_x = [] 
         for key, spec in TerranUnit.ARMY_SPEC.items():
-            s_y, s_x = ((playerType == SC2_Params.PLAYER_SELF) &(unitType == key)).nonzero()
-            allArmy_y += list(s_y)
-            allArmy_x += list(s_x)
-            
-            selfPoints, selfPower = CenterPoints(s_y, s_x)
+            selfPoints, selfPower = screenUnits.CenterPoints(SC2_Params.PLAYER_SELF, key)
 
 
             for i in range(len(selfPoints)):
@@ -306,18 +298,17 @@ class BattleMngr(BaseAgent):
                 power = math.ceil(selfPower[i] / spec.numScreenPixels)
                 self.current_state[BattleMngrState.START_SELF_MAT + idx] += power
 
-        if len(allArmy_y) > 0:
-            self.selfLocCoord = [int(sum(allArmy_y) / len(allArmy_y)), int(sum(allArmy_x) / len(allArmy_x))]
+        selfLocCoord = screenUnits.UnitsCenter(SC2_Params.PLAYER_SELF, TerranUnit.ARMY_SPEC.keys())
+        if selfLocCoord != None:
+            self.selfLocCoord = selfLocCoord
 
     def GetEnemyArmyLoc(self, obs):
-        playerType = obs.observation["feature_screen"][SC2_Params.PLAYER_RELATIVE]
-        unitType = obs.observation["feature_screen"][SC2_Params.UNIT_TYPE]
+        screenUnits = self.sharedData.obsFeatures.ScreenUnits()
 
         enemyPoints = []
         enemyPower = []
         for unit, spec in TerranUnit.ARMY_SPEC.items():
-            enemyArmy_y, enemyArmy_x = ((unitType == unit) & (playerType == SC2_Params.PLAYER_HOSTILE)).nonzero()
-            unitPoints, unitPower = CenterPoints(enemyArmy_y, enemyArmy_x, spec.numScreenPixels)
+            unitPoints, unitPower = screenUnits.CenterPoints(SC2_Params.PLAYER_HOSTILE, unit, spec.numScreenPixels)
             enemyPoints += unitPoints
             enemyPower += unitPower
         
@@ -328,14 +319,12 @@ class BattleMngr(BaseAgent):
             self.current_state[self.state_startEnemyMat + idx] += enemyPower[i]
 
     def GetEnemyBuildingLoc(self, obs):
-        playerType = obs.observation["feature_screen"][SC2_Params.PLAYER_RELATIVE]
-        unitType = obs.observation["feature_screen"][SC2_Params.UNIT_TYPE]
+        screenUnits = self.sharedData.obsFeatures.ScreenUnits()
 
         enemyBuildingPoints = []
         enemyBuildingPower = []
         for unit, spec in TerranUnit.BUILDING_SPEC.items():
-            enemyArmy_y, enemyArmy_x = ((unitType == unit) & (playerType == SC2_Params.PLAYER_HOSTILE)).nonzero()
-            buildingPoints, buildingPower = CenterPoints(enemyArmy_y, enemyArmy_x, spec.numScreenPixels)
+            buildingPoints, buildingPower = screenUnits.CenterPoints(SC2_Params.PLAYER_HOSTILE, unit, spec.numScreenPixels)
             enemyBuildingPoints += buildingPoints
             enemyBuildingPower += buildingPower # * self.BuildingValues[spec.name]
         
@@ -387,8 +387,7 @@ class BuildBaseSubAgent(BaseAgent):
             if group2Select != None:
                 return actions.FunctionCall(SC2_Actions.SELECT_CONTROL_GROUP, [SC2_Params.CONTROL_GROUP_RECALL, [group2Select]]), False
             
-            unitType = obs.observation['feature_screen'][SC2_Params.UNIT_TYPE]
-            scv_y, scv_x = SelectUnitValidPoints(unitType == Terran.SCV)
+            scv_y, scv_x = SelectUnitValidPoints(self.sharedData.obsFeatures.ScreenMask(SC2_Params.UNIT_TYPE, Terran.SCV))
             if len(scv_y) > 0:
                 target = [scv_y[0], scv_x[0]]
                 return actions.FunctionCall(SC2_Actions.SELECT_POINT, [SC2_Params.SELECT_ALL, SwapPnt(target)]), False
@@ -241,8 +241,6 @@ class DoNothingSubAgent(BaseAgent):
 
         self.numIdleWorkers = obs.observation['player'][SC2_Params.IDLE_WORKER_COUNT]
 
-        unitType = obs.observation['feature_screen'][SC2_Params.UNIT_TYPE]
-        
         numCompletedRefineries = len(self.sharedData.buildingCompleted[Terran.Refinery])
 
         self.resourceMngrSubAgentAction = self.resourceMngrSubAgent.ChooseAction()
@@ -252,7 +250,7 @@ class DoNothingSubAgent(BaseAgent):
         self.current_state[STATE_NEW_REFINERY] = self.gasGroup2SentScv < numCompletedRefineries
         self.current_state[STATE_FLYING_BUILDING] = False
         self.current_state[STATE_NUM_IDLE_SCV] = self.numIdleWorkers
-        self.current_state[STATE_HAS_RESOURCES] = self.HasResources(unitType)
+        self.current_state[STATE_HAS_RESOURCES] = self.HasResources()
         self.current_state[STATE_ARMY_LVL] = self.HasArmyProductionBuildings()
 
         self.ScaleState()
@@ -317,8 +315,7 @@ class DoNothingSubAgent(BaseAgent):
     def CreateMineralsGroup(self, obs, moveNum):
         if moveNum == 0:
             # select scv
-            unitType = obs.observation['feature_screen'][SC2_Params.UNIT_TYPE]
-            unit_y, unit_x = SelectUnitValidPoints(unitType == Terran.SCV)                    
+            unit_y, unit_x = SelectUnitValidPoints(self.sharedData.obsFeatures.ScreenMask(SC2_Params.UNIT_TYPE, Terran.SCV))
             if len(unit_y) > 0:
                 target = [unit_x[0], unit_y[0]]
                 return actions.FunctionCall(SC2_Actions.SELECT_POINT, [SC2_Params.SELECT_ALL, target]), False
@@ -465,13 +462,9 @@ class DoNothingSubAgent(BaseAgent):
         
         return found
 
-    def HasResources(self, unitType):
+    def HasResources(self):
         resourceList = SC2_Params.NEUTRAL_MINERAL_FIELD + SC2_Params.VESPENE_GAS_FIELD
-        for val in resourceList[:]:
-            if (unitType == val).any():
-                return True
-        
-        return False
+        return self.sharedData.obsFeatures.NumPixels(resourceList) > 0
 
     def HasArmyProductionBuildings(self):
         for productionBuilding in PRODUCTION_BUILDINGS:
@@ -345,15 +345,13 @@ class ResourceMngrSubAgent(BaseAgent):
             if self.gasGatherTarget[GAS_GROUPS[i]] == None:
                 if len(self.sharedData.buildingCompleted[Terran.Refinery]) > i:
                     self.gasGatherTarget[GAS_GROUPS[i]] = self.sharedData.buildingCompleted[Terran.Refinery][i].m_screenLocation
-                    
-        unitType = obs.observation['feature_screen'][SC2_Params.UNIT_TYPE]
 
 
         self.current_state[RESOURCE_STATE.SCV_NUM] = obs.observation['player'][SC2_Params.WORKERS_SUPPLY_OCCUPATION]
         self.current_state[RESOURCE_STATE.MINERALS_IDX] = obs.observation['player'][SC2_Params.MINERALS]
         self.current_state[RESOURCE_STATE.GAS_IDX] = obs.observation['player'][SC2_Params.VESPENE]
 
-        self.current_state[RESOURCE_STATE.MINERALS_FIELDS_COUNT] = self.CountMineralFields(unitType)
+        self.current_state[RESOURCE_STATE.MINERALS_FIELDS_COUNT] = self.CountMineralFields()
         self.current_state[RESOURCE_STATE.GAS_REFINERY_COUNT] = len(self.sharedData.buildingCompleted[Terran.Refinery])
 
         for group, stateIdx in RESOURCE_STATE.GROUP2IDX.items():
@@ -382,12 +380,8 @@ class ResourceMngrSubAgent(BaseAgent):
         self.current_scaled_state[RESOURCE_STATE.GAS_IDX] = int(self.current_scaled_state[RESOURCE_STATE.GAS_IDX] / RESOURCE_STATE.GAS_BUCKETING) * RESOURCE_STATE.GAS_BUCKETING
         self.current_scaled_state[RESOURCE_STATE.GAS_IDX] = min(RESOURCE_STATE.GAS_MAX, self.current_scaled_state[RESOURCE_STATE.GAS_IDX])
 
-    def CountMineralFields(self, unitType):
-        count = 0
-        for res in SC2_Params.NEUTRAL_MINERAL_FIELD:
-            count += np.count_nonzero(unitType == res)
-
-        return count
+    def CountMineralFields(self):
+        return self.sharedData.obsFeatures.NumPixels(SC2_Params.NEUTRAL_MINERAL_FIELD)
 
     def Action2Str(self, a, onlyAgent=False):
         return ACTIONS.ACTION2STR[a]
@@ -105,7 +105,7 @@ class ScoutAgent(BaseAgent):
         self.fogCounterMatFull = np.zeros((SC2_Params.MINIMAP_SIZE, SC2_Params.MINIMAP_SIZE), int)
         self.enemyMatObservationFull = np.zeros((SC2_Params.MINIMAP_SIZE,SC2_Params.MINIMAP_SIZE), bool)
 
-        nonVal_y, nonVal_x = (obs.observation['feature_minimap'][SC2_Params.HEIGHT_MAP] == NON_VALID_MINIMAP_HEIGHT).nonzero()
+        nonVal_y, nonVal_x = self.sharedData.obsFeatures.MinimapNonzero(SC2_Params.HEIGHT_MAP, NON_VALID_MINIMAP_HEIGHT)
         self.fogMatFull[nonVal_y,nonVal_x] = -1  
         self.fogCounterMatFull[nonVal_y,nonVal_x] = -1  
                
@@ -143,28 +143,29 @@ class ScoutAgent(BaseAgent):
             self.isScoutGroup = obs.observation['control_groups'][CONTROL_GROUP_ID_SCOUT[0]][SC2_Params.NUM_UNITS_CONTROL_GROUP] > 0
 
 
-        miniMapVisi = obs.observation['feature_minimap'][SC2_Params.VISIBILITY_MINIMAP]
-        miniMapHeights = obs.observation['feature_minimap'][SC2_Params.HEIGHT_MAP] != NON_VALID_MINIMAP_HEIGHT
+        obsFeatures = self.sharedData.obsFeatures
+        miniMapHeights = obsFeatures.MinimapMask(SC2_Params.HEIGHT_MAP, NON_VALID_MINIMAP_HEIGHT, equal=False)
+        miniMapSlightFog = obsFeatures.MinimapMask(SC2_Params.VISIBILITY_MINIMAP, SC2_Params.SLIGHT_FOG)
         
         # counter above threshold are treated as non-visibles
-        self.fogMatFull[(miniMapHeights) & (miniMapVisi == SC2_Params.SLIGHT_FOG) & (self.fogCounterMatFull >= MAX_FOG_COUNTER_2_ZERO)] = SC2_Params.FOG
+        self.fogMatFull[(miniMapHeights) & miniMapSlightFog & (self.fogCounterMatFull >= MAX_FOG_COUNTER_2_ZERO)] = SC2_Params.FOG
 
         # idx for slight fog = (valid & visi=slight & counter < threshold)
-        ySlightFog, xSlightFog = ((miniMapHeights) & (miniMapVisi == SC2_Params.SLIGHT_FOG) & (self.fogCounterMatFull < MAX_FOG_COUNTER_2_ZERO)).nonzero()
+        ySlightFog, xSlightFog = ((miniMapHeights) & miniMapSlightFog & (self.fogCounterMatFull < MAX_FOG_COUNTER_2_ZERO)).nonzero()
         self.fogMatFull[ySlightFog, xSlightFog] = SC2_Params.SLIGHT_FOG
         self.fogCounterMatFull[ySlightFog,xSlightFog] += 1
 
         # treat absolute values (fog or in sight)
-        yInSight, xInSight = ((miniMapHeights) & (miniMapVisi == SC2_Params.IN_SIGHT)).nonzero()
+        yInSight, xInSight = ((miniMapHeights) & obsFeatures.MinimapMask(SC2_Params.VISIBILITY_MINIMAP, SC2_Params.IN_SIGHT)).nonzero()
         self.fogMatFull[yInSight, xInSight] = SC2_Params.IN_SIGHT
         self.fogCounterMatFull[yInSight, xInSight] = 0  
 
-        yFog, xFog = ((miniMapHeights) & (miniMapVisi == SC2_Params.FOG)).nonzero()
+        yFog, xFog = ((miniMapHeights) & obsFeatures.MinimapMask(SC2_Params.VISIBILITY_MINIMAP, SC2_Params.FOG)).nonzero()
         self.fogMatFull[yFog, xFog] = SC2_Params.FOG
         self.fogCounterMatFull[yFog, xFog] = MAX_FOG_COUNTER_2_ZERO 
 
         # calculate enemy mat
-        miniMapEnemy = obs.observation['feature_minimap'][SC2_Params.PLAYER_RELATIVE_MINIMAP] == SC2_Params.PLAYER_HOSTILE   
+        miniMapEnemy = obsFeatures.MinimapMask(SC2_Params.PLAYER_RELATIVE_MINIMAP, SC2_Params.PLAYER_HOSTILE)
         # if enemy and in sight insert enemy
         self.enemyMatObservationFull[((miniMapEnemy) & (self.fogMatFull == SC2_Params.IN_SIGHT)).nonzero()] = True
         # if fog treat as unknown
@@ -206,7 +207,7 @@ class ScoutAgent(BaseAgent):
 
     def SelectScoutingUnit(self, obs):
         unit2Select = Terran.Marine
-        unitMat = obs.observation['feature_screen'][SC2_Params.UNIT_TYPE] == unit2Select
+        unitMat = self.sharedData.obsFeatures.ScreenMask(SC2_Params.UNIT_TYPE, unit2Select)
         p_y, p_x = SelectUnitValidPoints(unitMat)
         if len(p_y) > 0:
             return [p_y[0], p_x[0]]
@@ -218,7 +219,7 @@ class ScoutAgent(BaseAgent):
         return len(unitStatus) > 0
 
     def IsScoutEnd(self, obs):
-        selfMat = obs.observation['feature_minimap'][SC2_Params.PLAYER_RELATIVE_MINIMAP] == SC2_Params.PLAYER_SELF
+        selfMat = self.sharedData.obsFeatures.MinimapMask(SC2_Params.PLAYER_RELATIVE_MINIMAP, SC2_Params.PLAYER_SELF)
         yTarget = self.goToLast[SC2_Params.Y_IDX]
         xTarget = self.goToLast[SC2_Params.X_IDX]
         
@@ -42,6 +42,7 @@ from utils import SwapPnt
 from utils import FindMiddle
 from utils import Scale2MiniMap
 from utils import GetScreenCorners
+from utils import ObservationFeatures
 
 AGENT_NAME = "super_agent"
 
@@ -130,6 +131,8 @@ class SharedDataSuper(SharedDataBase, SharedDataAttack, SharedDataScout, SharedD
         self.superGridSize = GRID_SIZE
         self.numStep = 0
         self.numAgentStep = 0
+        # features of current observation (shared by all agents of the step)
+        self.obsFeatures = None
 
 REWARD_MAX_SUPPLY = 0
 BASE_MNGR_MAX_NAIVE_REWARD = 3.5
@@ -193,6 +196,10 @@ class SuperAgent(BaseAgent):
         self.move_number = 0
         self.discountForLocalReward = 0.999
 
+        self.obsFeatures = None
+        self.stepDuration = 0.0
+        self.featuresDuration = 0.0
+
     def GetAgentByName(self, name):
         if AGENT_NAME == name:
             return self
@@ -222,6 +229,28 @@ class SuperAgent(BaseAgent):
         return -1
 
     def step(self, obs):
+        # features of observation are calculated once for all sub agents
+        start = time.time()
+        self.obsFeatures = ObservationFeatures(obs)
+        self.sharedData.obsFeatures = self.obsFeatures
+
+        sc2Action = self.StepObservation(obs)
+
+        self.stepDuration += time.time() - start
+        self.featuresDuration += self.obsFeatures.duration
+        if obs.last():
+            self.PrintFeaturesDuration()
+
+        return sc2Action
+
+    def PrintFeaturesDuration(self):
+        if self.stepDuration > 0:
+            print("\t", AGENT_NAME, "->step duration =", "%.3f" % self.stepDuration, "sec, feature extraction =", "%.3f" % self.featuresDuration,
+                    "sec (%.1f%%)" % (self.featuresDuration * 100 / self.stepDuration))
+        self.stepDuration = 0.0
+        self.featuresDuration = 0.0
+
+    def StepObservation(self, obs):
         super(SuperAgent, self).step(obs)
 
         self.unit_type = obs.observation['feature_screen'][SC2_Params.UNIT_TYPE]
@@ -264,8 +293,9 @@ class SuperAgent(BaseAgent):
         self.sharedData.numAgentStep = 0
 
         self.sharedData.__init__()
+        self.sharedData.obsFeatures = self.obsFeatures
         
-        cc_y, cc_x = (self.unit_type == Terran.CommandCenter).nonzero()
+        cc_y, cc_x = self.obsFeatures.ScreenNonzero(SC2_Params.UNIT_TYPE, Terran.CommandCenter)
         if len(cc_y) > 0:
             middleCC = FindMiddle(cc_y, cc_x)
             cameraCornerNorthWest , cameraCornerSouthEast = GetScreenCorners(obs)
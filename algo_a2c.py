@@ -9,6 +9,7 @@ import tensorflow as tf
 import os
 
 from utils import ParamsBase
+from utils_checkpoint import CheckpointWriter
 
 from multiprocessing import Lock
 from utils import EmptyLock
@@ -44,6 +45,7 @@ class A2C:
 
         with tf.variable_scope("meta_data"):
             self.numRuns =tf.get_variable("numRuns", shape=(), initializer=tf.zeros_initializer(), dtype=tf.int32)
+            self.incNumRuns = self.numRuns.assign_add(1)
 
         with tf.variable_scope("critic"):
             self.critic = AC_Critic(modelParams)
@@ -54,6 +56,9 @@ class A2C:
         summary_ops = tf.get_collection(tf.GraphKeys.SUMMARIES)
         self.summaries = [s for s in summary_ops if self.directoryName in s.name]
 
+        # checkpoint writer is built on first InitModel (with all variables of graph)
+        self.checkpointWriter = None
+
 
     def InitModel(self, session, resetModel=False):
         self.sess = session
@@ -66,9 +71,11 @@ class A2C:
         self.sess.run(self.init_op)  
 
         self.saver = tf.train.Saver()
-        fnameNNMeta = self.directoryName + ".meta"
-        if os.path.isfile(fnameNNMeta) and not resetModel:
-            self.saver.restore(self.sess, self.directoryName)
+        if self.checkpointWriter == None:
+            self.checkpointWriter = CheckpointWriter(tf.global_variables(), self.directoryName, self.params.numCheckpoints2Keep, self.numRuns)
+        checkpoint = self.checkpointWriter.LatestCheckpoint()
+        if checkpoint != None and not resetModel:
+            self.saver.restore(self.sess, checkpoint)
             loadedDM = True
         else:
             self.Save()
@@ -79,20 +86,18 @@ class A2C:
     def NumRuns(self):
         return self.numRuns.eval(session = self.sess)
 
-    def Save(self, numRuns2Save = None, toPrint = True):
-        
-        if numRuns2Save == None:
-            self.saver.save(self.sess, self.directoryName)
-            numRuns2Save = self.NumRuns()
-        else:
-            currNumRuns = self.NumRuns()
-            assign4Save = self.numRuns.assign(numRuns2Save)
-            self.sess.run(assign4Save)
+    def Close(self):
+        self.CloseCheckpointWriter()
+        self.sess.close()
 
-            self.saver.save(self.sess, self.directoryName)
+    def CloseCheckpointWriter(self):
+        if self.checkpointWriter != None:
+            self.checkpointWriter.Close()
+            self.checkpointWriter = None
 
-            assign4Repeat2Train = self.numRuns.assign(currNumRuns)
-            self.sess.run(assign4Repeat2Train)
+    def Save(self, numRuns2Save = None, toPrint = True):
+        # snapshot is written on background thread (saved numRuns is replaced in snapshot only)
+        numRuns2Save = self.checkpointWriter.Snapshot(self.sess, numRuns2Save)
 
         if toPrint:
             print("\n\t", threading.current_thread().getName(), " : ", self.agentName, "->save dqn with", numRuns2Save, "runs to:", self.directoryName)
@@ -145,8 +150,7 @@ class A2C:
         return False
     
     def end_run(self, reward):
-        assign = self.numRuns.assign_add(1)
-        self.sess.run(assign)
+        self.sess.run(self.incNumRuns)
 
     def Reset(self):
         self.sess.run(self.init_op) 
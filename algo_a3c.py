@@ -11,6 +11,7 @@ import os
 import scipy
 
 from utils import ParamsBase
+from utils_sync import NNSyncOps
 
 from multiprocessing import Lock
 
@@ -40,6 +41,8 @@ class A3C:
         self.agentName = agentName
 
         self.workers = {}
+        # sync ops are built once for each (src, target) scopes
+        self.syncOps = {}
 
         self.updateGlobalLock = Lock()
 
@@ -56,6 +59,7 @@ class A3C:
             worker = A3C_Pair(self.params, trainer=self.trainer, currScope=workerName, globalScope="global_network")
         
         self.workers[workerName] = worker
+        self.syncOps[("global_network", workerName)] = self.CreateSyncOps("global_network", workerName)
         if len(self.workers) == 1:
             self.worker4Summary = workerName
             self.summary_writer = tf.summary.FileWriter(workerName)
@@ -162,19 +166,20 @@ class A3C:
 
         return criticLossBefore, actorLossBefore, varNorms, gradNorms
 
-    def CopyParams2AC(self, srcScope, targetScope):
+    def CreateSyncOps(self, srcScope, targetScope):
         srcParams = [t for t in tf.trainable_variables() if t.name.find(srcScope) >= 0]
         srcParams = sorted(srcParams, key=lambda v: v.name)
 
         targetParams = [t for t in tf.trainable_variables() if t.name.find(targetScope) >= 0]
         targetParams = sorted(targetParams, key=lambda v: v.name)
 
-        update_ops = []
-        for srcVar, targetVar in zip(srcParams, targetParams):
-            op = targetVar.assign(srcVar)
-            update_ops.append(op)
+        return NNSyncOps(srcParams, targetParams, name="sync_" + targetScope)
 
-        self.sess.run(update_ops)        
+    def CopyParams2AC(self, srcScope, targetScope, tau = None):
+        if (srcScope, targetScope) not in self.syncOps:
+            self.syncOps[(srcScope, targetScope)] = self.CreateSyncOps(srcScope, targetScope)
+
+        self.syncOps[(srcScope, targetScope)].Run(self.sess, tau)
 
     def DecisionMakerType(self):
         return "A3C"
@@ -184,8 +189,7 @@ class A3C:
     
     def end_run(self, reward):
         workerName = threading.current_thread().getName()
-        assign = self.workers[workerName].numRuns.assign_add(1)
-        self.sess.run(assign)
+        self.sess.run(self.workers[workerName].incNumRuns)
 
     def Reset(self):
         self.sess.run(self.init_op) 
@@ -204,6 +208,7 @@ class A3C_Pair:
 
         with tf.variable_scope("meta_data"):
             self.numRuns = tf.get_variable("numRuns", shape=(), initializer=tf.zeros_initializer(), dtype=tf.int32, trainable=False)
+            self.incNumRuns = self.numRuns.assign_add(1)
             if globalScope != None:
                 self.numRunsLastCopied = tf.get_variable("numRunsLastCopied", shape=(), initializer=tf.zeros_initializer(), dtype=tf.int32, trainable=False)
 
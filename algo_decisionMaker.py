@@ -23,6 +23,8 @@ from algo_a3c import A3C
 
 from algo_qtable import QLearningTable
 
+from algo_mcts import MCTS
+
 from utils_history import HistoryMngr
 
 # model builders:
@@ -140,6 +142,31 @@ class BaseDecisionMaker:
             if subAgentDm != None:
                 subAgentDm.InitModel(sess, resetModel)
 
+    def Close(self):
+        # release resources of history (planning thread) and model (checkpoint writer) of decision maker and of sub agents decision makers.
+        # session of model is shared and is not closed
+        if self.historyMngr != None:
+            self.historyMngr.Close()
+
+        if self.decisionMaker != None and hasattr(self.decisionMaker, "CloseCheckpointWriter"):
+            self.decisionMaker.CloseCheckpointWriter()
+
+        if self.decisionMaker != None and hasattr(self.decisionMaker, "CloseInferenceServer"):
+            self.decisionMaker.CloseInferenceServer()
+
+        for subDM in self.subAgentsDecisionMakers.values():
+            if subDM != None:
+                subDM.Close()
+
+    def EndThread(self):
+        # current game thread stops using models of decision maker and of sub agents decision makers
+        if self.decisionMaker != None and hasattr(self.decisionMaker, "EndThread"):
+            self.decisionMaker.EndThread()
+
+        for subDM in self.subAgentsDecisionMakers.values():
+            if subDM != None:
+                subDM.EndThread()
+
     def AddSwitch(self, idx, numSwitch, name, resultFile):
         if resultFile != None:
             if idx not in self.switchCount:
@@ -436,6 +463,9 @@ class DecisionMakerExperienceReplay(DecisionMakerAlgoBase):
         
         return save 
 
+    def learnBatch(self, s, a, r, s_, terminal):
+        self.historyMngr.learnBatch(s, a, r, s_, terminal)
+
     def TrainAll(self):
         self.copyTargetLock.acquire()
         if self.CopyTarget2ModelNumRuns > 0:
@@ -455,24 +485,34 @@ class DecisionMakerExperienceReplay(DecisionMakerAlgoBase):
         return numTrial2Learn if numTrial2Learn >= 0 else numTrialsSa
 
     def Train(self):
-        s,a,r,s_, terminal = self.historyMngr.GetHistory()
+        trainMinibatches = self.params.numBatches2Train != None or self.params.prioritizedReplay
+        if trainMinibatches:
+            batches, histSize = self.historyMngr.GetMinibatches(self.params.numBatches2Train, self.params.batchSize)
+        else:
+            s,a,r,s_, terminal = self.historyMngr.GetHistory()
+            histSize = len(a)
+
         numRuns2Learn = -1
        
-        if len(a) > self.params.minReplaySize:
+        if histSize > self.params.minReplaySize:
             start = datetime.datetime.now()
             
-            self.decisionMaker.learn(s, a, r, s_, terminal, self.trial2LearnModel)
-            self.endRunLock.acquire()
+            if trainMinibatches:
+                tdErrors = self.decisionMaker.learnMinibatches(batches, self.trial2LearnModel)
+                self.historyMngr.UpdatePriorities(batches, tdErrors)
+            else:
+                self.decisionMaker.learn(s, a, r, s_, terminal, self.trial2LearnModel)
+            
+            # save does not change live num runs and writes on background thread (no need for end run lock)
             numRuns2Learn = self.trial2LearnModel
-            self.decisionMaker.Save(self.trial2LearnModel)
-            self.endRunLock.release()
+            self.decisionMaker.Save(numRuns2Learn)
 
             diff = datetime.datetime.now() - start
             msDiff = diff.seconds * 1000 + diff.microseconds / 1000
             
-            print("\t", threading.current_thread().getName(), ":", self.agentName,"->ExperienceReplay - training with hist size = ", len(r), ", last", msDiff, "milliseconds")
+            print("\t", threading.current_thread().getName(), ":", self.agentName,"->ExperienceReplay - training with hist size = ", histSize, ", last", msDiff, "milliseconds")
         else:
-            print("\t", threading.current_thread().getName(), ":", self.agentName,"->ExperienceReplay size to small - training with hist size = ", len(r))
+            print("\t", threading.current_thread().getName(), ":", self.agentName,"->ExperienceReplay size to small - training with hist size = ", histSize)
 
         return numRuns2Learn
 
@@ -486,8 +526,8 @@ class DecisionMakerExperienceReplay(DecisionMakerAlgoBase):
         
         np.set_printoptions(precision=2, suppress=True)
         
-        print(self.agentName, "hist size =", len(self.historyMngr.transitions["a"]))
-        print(self.agentName, "old hist size", len(self.historyMngr.oldTransitions["a"]))
+        print(self.agentName, "hist size =", self.historyMngr.Size())
+        print(self.agentName, "old hist size", self.historyMngr.OldHistSize())
         print(self.agentName, "all history size", len(self.historyMngr.GetAllHist()["a"]))
 
         print(self.agentName, "maxVals =", self.historyMngr.transitions["maxStateVals"])
@@ -550,7 +590,7 @@ class DecisionMakerExperienceReplay(DecisionMakerAlgoBase):
         for a in actions2Check:
             actionsPoints[a] = [[], [], [], []]
 
-        sizeHist = len(self.historyMngr.Size())
+        sizeHist = self.historyMngr.Size()
         size2Plot = min(sizeHist, maxSize2Plot)
         for i in range(size2Plot):
             s = self.DrawStateFromHist(realState=False)
@@ -646,6 +686,33 @@ class DecisionMakerExperienceReplay(DecisionMakerAlgoBase):
 
 
 
+class DecisionMakerMCTS(DecisionMakerExperienceReplay):
+    def __init__(self, modelType, modelParams, agentName='', decisionMakerName='', resultFileName='', historyFileName='', directory='', isMultiThreaded = False):
+        super(DecisionMakerMCTS, self).__init__( modelType=modelType, modelParams=modelParams, agentName=agentName, decisionMakerName=decisionMakerName, 
+                                                            resultFileName=resultFileName, historyFileName=historyFileName, directory=directory, 
+                                                            isMultiThreaded=isMultiThreaded)
+
+        # search runs on raw states (transition model), states are normalized only for dqn evaluation
+        if modelParams.normalizeState:
+            self.decisionMaker.SetStateNormalization(self.historyMngr.NormalizeState)
+
+        # idx of next logged transition to insert to transition model
+        self.numObserved = 0
+
+    def choose_action(self, state, validActions, targetValues=False):
+        return self.decisionMaker.choose_action(state, validActions, targetValues)
+
+    def ActionsValues(self, state, validActions, targetValues = False):
+        return self.decisionMaker.ActionsValues(state, validActions, targetValues)
+
+    def Train(self):
+        self.historyMngr.JoinHistoryFromSons()
+        s, a, r, s_, terminal, self.numObserved = self.historyMngr.TransitionsSince(self.numObserved)
+        self.decisionMaker.Observe(s, a, r, s_, terminal)
+
+        return super(DecisionMakerMCTS, self).Train()
+
+
 class DecisionMakerOnlineAsync(DecisionMakerAlgoBase):
     def __init__(self, modelType, modelParams, agentName='', decisionMakerName='', resultFileName='', historyFileName='', directory='', isMultiThreaded = False):        
         super(DecisionMakerOnlineAsync, self).__init__( modelType=modelType, modelParams=modelParams, agentName=agentName, decisionMakerName=decisionMakerName, 
@@ -9,6 +9,11 @@ import tensorflow as tf
 import os
 
 from utils import ParamsBase
+from utils_checkpoint import CheckpointWriter
+from utils_sync import NNSyncOps
+from utils_sync import NNAssignOps
+from utils_inference import BatchInferenceServer
+from utils_cache import ActionValuesCache
 
 from multiprocessing import Lock
 from utils import EmptyLock
@@ -18,7 +23,9 @@ class DQN_PARAMS(ParamsBase):
     def __init__(self, stateSize, numActions, layersNum=1, neuronsInLayerNum=256, numTrials2CmpResults=1000, nn_Func=None, numTrials2Learn=None, numTrials2Save=100,
                 outputGraph=True, discountFactor=0.95, batchSize=32, maxReplaySize=500000, minReplaySize=1000, 
                 explorationProb=0.1, descendingExploration=True, exploreChangeRate=0.001, learning_rate=1e-05, 
-                normalizeRewards=False, normalizeState=True, numRepeatsTerminalLearning=10, accumulateHistory=True):
+                normalizeRewards=False, normalizeState=True, zScoreNormalization=False, numRepeatsTerminalLearning=10, accumulateHistory=True, numBatches2Train=None,
+                prioritizedReplay=False, priorityAlpha=0.6, priorityBeta=0.4, priorityEpsilon=1e-3, priorityBetaSteps=None, targetUpdateTau=None, 
+                batchInference=False, inferenceWindow=0.001, inferenceMaxBatch=64, targetCacheSize=10000):
 
         super(DQN_PARAMS, self).__init__(stateSize=stateSize, numActions=numActions, discountFactor=discountFactor, 
                                         maxReplaySize=maxReplaySize, minReplaySize=minReplaySize, numTrials2Learn=numTrials2Learn, numTrials2Save=numTrials2Save)
@@ -44,9 +51,31 @@ class DQN_PARAMS(ParamsBase):
 
         self.normalizeRewards = normalizeRewards
         self.normalizeState = normalizeState
+        # normalize states by running mean and std instead of max values
+        self.zScoreNormalization = zScoreNormalization
 
         self.noiseOnTerminalRewardsPct = 0.0
         self.numRepeatsTerminalLearning = numRepeatsTerminalLearning
+        self.numBatches2Train = numBatches2Train
+
+        # proportional prioritized replay (p = (|td error| + epsilon) ^ alpha)
+        self.prioritizedReplay = prioritizedReplay
+        self.priorityAlpha = priorityAlpha
+        self.priorityBeta = priorityBeta
+        self.priorityEpsilon = priorityEpsilon
+        # importance sampling beta is annealed linearly to 1 over priorityBetaSteps trained minibatches (None = constant beta)
+        self.priorityBetaSteps = priorityBetaSteps
+
+        # None = copy dqn to target, else soft update (target = tau * dqn + (1 - tau) * target)
+        self.targetUpdateTau = targetUpdateTau
+
+        # choose_action requests of game threads are evaluated in batches (multi threaded only)
+        self.batchInference = batchInference
+        self.inferenceWindow = inferenceWindow
+        self.inferenceMaxBatch = inferenceMaxBatch
+
+        # num of target network outputs cached by state (0 = no cache)
+        self.targetCacheSize = targetCacheSize
 
     def ExploreProb(self, numRuns, resultRatio = 1):
         if self.descendingExploration:
@@ -94,6 +123,7 @@ class DQN:
         self.nnName = nnName
         self.savePath = self.directory + self.nnName
         self.agentName = agentName
+        self.isMultiThreaded = isMultiThreaded
 
         self.dqnScope = "DQNetwork"
      
@@ -101,6 +131,8 @@ class DQN:
         self.actionSelected = tf.placeholder(shape=[None], dtype=tf.int32, name="actions")
 
         self.outputSingle = tf.placeholder(shape=[None], dtype=tf.float32, name="value")
+        # importance sampling weights of prioritized replay (ones for uniform sampling)
+        self.isWeights = tf.placeholder_with_default(tf.ones_like(self.outputSingle), shape=[None], name="is_weights")
         
         with tf.variable_scope(self.dqnScope):
             self.numRuns =tf.get_variable("numRuns", shape=(), initializer=tf.zeros_initializer(), dtype=tf.int32)
@@ -119,11 +151,22 @@ class DQN:
             boundedPrediction = tf.clip_by_value(action_predictions, -1.0, 1.0, name="clipped_action_selected_value")
 
         # Define loss and optimizer
+        self.tdError = tf.subtract(self.outputSingle, boundedPrediction, name="td_error")
         lossFunc = tf.squared_difference(self.outputSingle, boundedPrediction)
-        self.loss_op = tf.reduce_mean(lossFunc + self.RegularizationFactor(), name="loss_func")
+        self.loss_op = tf.reduce_mean(self.isWeights * lossFunc + self.RegularizationFactor(), name="loss_func")
 
         optimizer = tf.train.AdamOptimizer(learning_rate=self.params.learning_rate)
         self.train_op = optimizer.minimize(self.loss_op, name="train_func")
+
+        # counter and assign ops are built once (creating ops on each call grows the graph)
+        self.incNumRuns = self.numRuns.assign_add(1)
+        self.assignAllOps = NNAssignOps(self.ScopeVars(self.dqnScope), name="assign_all_nn_vars")
+
+        self.inferenceServer = None
+        # checkpoint writer is built on first InitModel (with all variables of graph)
+        self.checkpointWriter = None
+        # explore prob changes only with num runs (updated on each change)
+        self.exploreProb = None
         
         
     def InitModel(self, session, resetModel=False):
@@ -137,13 +180,20 @@ class DQN:
         self.sess.run(self.init_op)  
 
         self.saver = tf.train.Saver()
-        fnameNNMeta = self.savePath + ".meta"
-        if os.path.isfile(fnameNNMeta) and not resetModel:
-            self.saver.restore(self.sess, self.savePath)
+        if self.checkpointWriter == None:
+            self.checkpointWriter = CheckpointWriter(tf.global_variables(), self.savePath, self.params.numCheckpoints2Keep, self.numRuns)
+        checkpoint = self.checkpointWriter.LatestCheckpoint()
+        if checkpoint != None and not resetModel:
+            self.saver.restore(self.sess, checkpoint)
             loadedDM = True
         else:
             self.Save()
             loadedDM = False
+
+        if self.params.batchInference and self.isMultiThreaded and self.inferenceServer == None:
+            self.inferenceServer = BatchInferenceServer(self.CalcOutput, self.num_input, self.params.inferenceMaxBatch, self.params.inferenceWindow, self.agentName)
+
+        self.UpdateExploreProb()
         
         return loadedDM
 
@@ -190,15 +240,27 @@ class DQN:
         return 0
 
     def ExploreProb(self):
-        return self.params.ExploreProb(self.numRuns.eval(session = self.sess))
+        return self.exploreProb
+
+    def UpdateExploreProb(self):
+        self.exploreProb = self.params.ExploreProb(self.NumRuns())
 
     def TargetExploreProb(self):
         return self.ExploreProb()    
 
+    def CalcOutput(self, states):
+        return self.sess.run(self.outputLayer, {self.inputLayer: states})
+
+    def StateValues(self, state):
+        if self.inferenceServer != None:
+            return self.inferenceServer.Evaluate(state)
+
+        return self.CalcOutput(state.reshape(1,self.num_input))[0]
+
     def choose_action(self, state, validActions, targetValues=False):
-        vals = self.outputLayer.eval({self.inputLayer: state.reshape(1,self.num_input)}, session=self.sess).squeeze()
+        vals = self.StateValues(state)
         
-        if np.random.uniform() > self.params.ExploreProb(self.numRuns.eval(session = self.sess)):
+        if np.random.uniform() > self.exploreProb:
             maxArgs = np.argwhere(vals == np.amax(vals[validActions]))
             maxArgsValid = np.array([x for x in maxArgs if x in validActions]).squeeze(axis=1)
             a = np.random.choice(maxArgsValid)      
@@ -209,8 +271,7 @@ class DQN:
 
 
     def ActionsValues(self, state, validActions, targetValues = False):
-        allVals = self.outputLayer.eval({self.inputLayer: state.reshape(1,self.num_input)}, session=self.sess)
-        return allVals[0]
+        return self.StateValues(state)
 
     def learn(self, s, a, r, s_, terminal, numRuns2Save = None):          
         size = len(a)
@@ -218,16 +279,34 @@ class DQN:
         if self.params.noiseOnTerminalRewardsPct > 0:
             r = self.NoiseOnTerminalReward(r, terminal)
         
-        # calculate (R = r + d * Q(s_))
-        rNextState = self.outputLayer.eval({self.inputLayer: s_.reshape(size,self.num_input)}, session=self.sess)
-        R = r + np.invert(terminal) * self.params.discountFactor * np.max(rNextState, axis=1)
+        R = self.CalcTargets(r, s_, terminal)
+        isWeights = np.ones(self.params.batchSize, float)
 
         for i in range(int(size  / self.params.batchSize)):
             chosen = np.arange(i * self.params.batchSize, (i + 1) * self.params.batchSize)
-            feedDict = {self.inputLayer: s[chosen].reshape(self.params.batchSize, self.num_input), self.outputSingle: R[chosen], self.actionSelected: a[chosen]}
+            self.TrainBatch(s[chosen], a[chosen], R[chosen], isWeights)
 
-            self.sess.run([self.train_op, self.loss_op], feed_dict=feedDict) 
+    def learnMinibatches(self, batches, numRuns2Save = None):
+        # each minibatch calculates its own targets, return td errors of each minibatch
+        allTdErrors = []
+        for s, a, r, s_, terminal, idx, isWeights, generation in batches:
+            R = self.CalcTargets(r, s_, terminal)
+            allTdErrors.append(self.TrainBatch(s, a, R, isWeights))
 
+        return allTdErrors
+
+    def CalcTargets(self, r, s_, terminal):
+        # calculate (R = r + d * Q(s_))
+        size = len(r)
+        rNextState = self.outputLayer.eval({self.inputLayer: s_.reshape(size,self.num_input)}, session=self.sess)
+        return r + np.invert(terminal) * self.params.discountFactor * np.max(rNextState, axis=1)
+
+    def TrainBatch(self, s, a, R, isWeights):
+        size = len(a)
+        feedDict = {self.inputLayer: s.reshape(size, self.num_input), self.outputSingle: R, self.actionSelected: a, self.isWeights: isWeights}
+        _, _, tdError = self.sess.run([self.train_op, self.loss_op, self.tdError], feed_dict=feedDict) 
+        
+        return tdError
 
     def NoiseOnTerminalReward(self, r, terminal):
         idxTerminal = np.argwhere(terminal).flatten()
@@ -239,22 +318,28 @@ class DQN:
         return r
         
     def Close(self):
+        self.CloseInferenceServer()
+        self.CloseCheckpointWriter()
         self.sess.close()
-        
-    def Save(self, numRuns2Save = None, toPrint = True):
-        
-        if numRuns2Save == None:
-            self.saver.save(self.sess, self.savePath)
-            numRuns2Save = self.NumRuns()
-        else:
-            currNumRuns = self.NumRuns()
-            assign4Save = self.numRuns.assign(numRuns2Save)
-            self.sess.run(assign4Save)
 
-            self.saver.save(self.sess, self.savePath)
+    def CloseCheckpointWriter(self):
+        if self.checkpointWriter != None:
+            self.checkpointWriter.Close()
+            self.checkpointWriter = None
+
+    def CloseInferenceServer(self):
+        if self.inferenceServer != None:
+            self.inferenceServer.Close()
+            self.inferenceServer = None
 
-            assign4Repeat2Train = self.numRuns.assign(currNumRuns)
-            self.sess.run(assign4Repeat2Train)
+    def EndThread(self):
+        # current game thread stops using model
+        if self.inferenceServer != None:
+            self.inferenceServer.Unregister()
+        
+    def Save(self, numRuns2Save = None, toPrint = True):
+        # snapshot is written on background thread (saved numRuns is replaced in snapshot only)
+        numRuns2Save = self.checkpointWriter.Snapshot(self.sess, numRuns2Save)
 
         if toPrint:
             print("\n\t", threading.current_thread().getName(), " : ", self.agentName, "->save dqn with", numRuns2Save, "runs to:", self.savePath)
@@ -263,14 +348,15 @@ class DQN:
         return self.numRuns.eval(session = self.sess)
 
     def end_run(self, reward):
-        assign = self.numRuns.assign_add(1)
-        self.sess.run(assign)
+        self.sess.run(self.incNumRuns)
+        self.UpdateExploreProb()
         
     def DiscountFactor(self):
         return self.params.discountFactor
 
     def Reset(self):
         self.sess.run(self.init_op) 
+        self.UpdateExploreProb()
     
     def DecisionMakerType(self):
         return "DQN"
@@ -296,16 +382,13 @@ class DQN:
 
         return npVars, varName
 
-    def AssignAllNNVars(self, newValues):
-        nnVars = [t for t in tf.trainable_variables() if t.name.startswith(self.dqnScope)]
-        nnVars = sorted(nnVars, key=lambda v: v.name)
-
-        copy_ops = []
-        for v in range(len(nnVars)):
-            op = nnVars[v].assign(newValues[v])
-            copy_ops.append(op)
+    def ScopeVars(self, scope):
+        nnVars = [t for t in tf.trainable_variables() if t.name.startswith(scope)]
+        return sorted(nnVars, key=lambda v: v.name)
 
-        self.sess.run(copy_ops)
+    def AssignAllNNVars(self, newValues):
+        self.assignAllOps.Run(self.sess, newValues)
+        self.UpdateExploreProb()
 
     def actionValuesSpecific(self, state, dmId): # dmId = target, curr
         isTarget = dmId == "target"
@@ -342,33 +425,45 @@ class DQN_WithTarget(DQN):
         else:
             self.rewardHistLock = EmptyLock()
 
-    def CopyNN(self, scopeTo, scopeFrom):
-        fromParams = [t for t in tf.trainable_variables() if t.name.startswith(scopeFrom)]
-        fromParams = sorted(fromParams, key=lambda v: v.name)
+        # sync ops are built once (creating assign ops on each copy grows the graph)
+        self.syncOps = {}
+        self.syncOps[(self.targetScope, self.dqnScope)] = NNSyncOps(self.ScopeVars(self.dqnScope), self.ScopeVars(self.targetScope), name="sync_dqn2target")
+        self.syncOps[(self.dqnScope, self.targetScope)] = NNSyncOps(self.ScopeVars(self.targetScope), self.ScopeVars(self.dqnScope), name="sync_target2dqn")
+        
+        # target outputs are valid until next copy to target
+        self.targetCache = ActionValuesCache(modelParams.targetCacheSize, isMultiThreaded) if modelParams.targetCacheSize > 0 else None
 
-        toParams = [t for t in tf.trainable_variables() if t.name.startswith(scopeTo)]
-        toParams = sorted(toParams, key=lambda v: v.name)
+        self.numRunsValue = tf.placeholder(tf.int32, shape=(), name="num_runs_value")
+        self.assignNumRunsTarget = self.numRunsTarget.assign(self.numRunsValue)
+        self.assignNumRuns = self.numRuns.assign(self.numRunsValue)
+        self.avgRewardValue = tf.placeholder(tf.float32, shape=(), name="avg_reward_value")
+        self.assignValueDqn = self.valueDqn.assign(self.avgRewardValue)
 
-        update_ops = []
-        for fromVar, toVar in zip(fromParams, toParams):
-            op = toVar.assign(fromVar)
-            update_ops.append(op)
+    def CopyNN(self, scopeTo, scopeFrom, tau = None):
+        if (scopeTo, scopeFrom) not in self.syncOps:
+            self.syncOps[(scopeTo, scopeFrom)] = NNSyncOps(self.ScopeVars(scopeFrom), self.ScopeVars(scopeTo))
 
-        self.sess.run(update_ops)
+        self.syncOps[(scopeTo, scopeFrom)].Run(self.sess, tau)
+        if scopeTo == self.targetScope:
+            self.InvalidateTargetCache()
 
 
     def CopyDqn2Target(self, numRuns2Save):
-        self.CopyNN(self.targetScope, self.dqnScope)
+        stats = self.TargetCacheStats()
+        if stats != None and stats["numLookups"] > 0:
+            print("\t", threading.current_thread().getName(), ":", self.agentName, "->target cache hit rate =", "%.3f" % stats["hitRate"], "entries =", stats["numEntries"], "memory =", int(stats["memoryBytes"] / 1024), "KB")
+            self.targetCache.ResetStats()
+
+        self.CopyNN(self.targetScope, self.dqnScope, self.params.targetUpdateTau)
         
         if numRuns2Save != None:
-            assign = self.numRunsTarget.assign(numRuns2Save)
-            self.sess.run(assign)
+            self.sess.run(self.assignNumRunsTarget, {self.numRunsValue: numRuns2Save})
 
     def CopyTarget2Model(self, numRuns):   
         self.CopyNN(self.dqnScope, self.targetScope)
 
-        assign = self.numRuns.assign(numRuns)
-        self.sess.run(assign)
+        self.sess.run(self.assignNumRuns, {self.numRunsValue: numRuns})
+        self.UpdateExploreProb()
         self.Save()
         
         self.rewardHistLock.acquire()
@@ -377,12 +472,36 @@ class DQN_WithTarget(DQN):
 
     def InitModel(self, sess, resetModel):
         loaded = super(DQN_WithTarget, self).InitModel(sess, resetModel)
+        self.InvalidateTargetCache()
         if not loaded:
             self.CopyTarget2Model(0)
 
+    def Reset(self):
+        super(DQN_WithTarget, self).Reset()
+        self.InvalidateTargetCache()
+
+    def InvalidateTargetCache(self):
+        if self.targetCache != None:
+            self.targetCache.Invalidate()
+
+    def TargetCacheStats(self):
+        return self.targetCache.Stats() if self.targetCache != None else None
+
+    def TargetValues(self, state):
+        if self.targetCache == None:
+            return self.targetOutput.eval({self.inputLayer: state.reshape(1,self.num_input)}, session=self.sess)[0]
+
+        vals = self.targetCache.Get(state)
+        if vals is None:
+            generation = self.targetCache.Generation()
+            vals = self.targetOutput.eval({self.inputLayer: state.reshape(1,self.num_input)}, session=self.sess)[0]
+            self.targetCache.Put(state, vals, generation)
+
+        return vals
+
     def choose_action(self, state, validActions, targetValues=False):
         if targetValues:   
-            vals = self.targetOutput.eval({self.inputLayer: state.reshape(1,self.num_input)}, session=self.sess)
+            vals = self.TargetValues(state).reshape(1, self.numActions)
             if np.random.uniform() > self.TargetExploreProb():
 
                 maxArgs = list(np.argwhere(vals[0] == np.amax(vals[0][validActions]))[0])
@@ -398,8 +517,7 @@ class DQN_WithTarget(DQN):
 
     def ActionsValues(self, state, validActions, targetValues = False):
         if targetValues:
-            allVals = self.targetOutput.eval({self.inputLayer: state.reshape(1,self.num_input)}, session=self.sess)
-            return allVals[0]
+            return self.TargetValues(state)
         else:
             return super(DQN_WithTarget, self).ActionsValues(state, targetValues)
 
@@ -424,17 +542,22 @@ class DQN_WithTarget(DQN):
 
         if len(rewardHist) >= self.numTrials2CmpResults:
             avgReward = np.average(np.array(rewardHist))
-            assign = self.valueDqn.assign(avgReward)
-            self.sess.run(assign)
+            self.sess.run(self.assignValueDqn, {self.avgRewardValue: avgReward})
 
-    def learn(self, s, a, r, s_, terminal, numRuns2Save = None): 
+    def UpdateTarget(self, numRuns2Save):
         self.CalcValueDqn()
         if self.ValueDqn() > self.ValueTarget():
             self.CopyDqn2Target(self.lastTrainNumRuns)
 
         self.lastTrainNumRuns = numRuns2Save
 
+    def learn(self, s, a, r, s_, terminal, numRuns2Save = None): 
+        self.UpdateTarget(numRuns2Save)
         super(DQN_WithTarget, self).learn(s, a, r, s_, terminal, numRuns2Save)
+
+    def learnMinibatches(self, batches, numRuns2Save = None):
+        self.UpdateTarget(numRuns2Save)
+        return super(DQN_WithTarget, self).learnMinibatches(batches, numRuns2Save)
     
     def end_run(self, r, toSave = False):
         super(DQN_WithTarget, self).end_run(r)
@@ -468,6 +591,7 @@ class DQN_WithTargetAndDefault(DQN_WithTarget):
         self.initValDflt = 1000.0
         with tf.variable_scope(self.defaultScope):
             self.valueDefaultDm =tf.get_variable("value_dflt", shape=(), initializer=tf.constant_initializer(self.initValDflt), dtype=tf.float32)
+        self.assignValueDefault = self.valueDefaultDm.assign(self.avgRewardValue)
 
         self.init_op = tf.global_variables_initializer()
         self.sess.run(self.init_op)  
@@ -514,8 +638,7 @@ class DQN_WithTargetAndDefault(DQN_WithTarget):
             self.rewardHistDefault.append(r)
             if len(self.rewardHistDefault) >= self.trialsOfDfltRun:
                 avgReward = np.average(np.array(self.rewardHistDefault))
-                assign = self.valueDefaultDm.assign(avgReward)
-                self.sess.run(assign)
+                self.sess.run(self.assignValueDefault, {self.avgRewardValue: avgReward})
                 self.Save()
             
             self.rewardHistDfltLock.release()
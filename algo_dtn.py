@@ -1,5 +1,4 @@
 import numpy as np
-from scipy import sparse
 
 import datetime
 import pandas as pd
@@ -23,6 +22,39 @@ class DTN_PARAMS:
         self.minReplaySize = minReplaySize
         self.maxReplaySize = maxReplaySize
 
+class TrainEpochsInput:
+    def __init__(self, shapes, dtypes, batchSize, numPrefetch = 2):
+        # training data is fed once per learn call. shuffled epochs are batched and prefetched by tf.data pipeline
+        self.placeholders = [tf.placeholder(dtype, [None] + shape) for shape, dtype in zip(shapes, dtypes)]
+        self.numEpochs = tf.placeholder(tf.int64, shape=())
+
+        dataset = tf.data.Dataset.from_tensor_slices(tuple(self.placeholders))
+        dataset = dataset.shuffle(tf.cast(tf.shape(self.placeholders[0])[0], tf.int64), reshuffle_each_iteration=True)
+        dataset = dataset.repeat(self.numEpochs).batch(batchSize).prefetch(numPrefetch)
+
+        self.iterator = dataset.make_initializable_iterator()
+        self.next = self.iterator.get_next()
+    
+    def Init(self, sess, values, numEpochs = 1):
+        feedDict = dict(zip(self.placeholders, values))
+        feedDict[self.numEpochs] = numEpochs
+        sess.run(self.iterator.initializer, feed_dict=feedDict)
+
+    def Train(self, sess, trainOp):
+        # run train op on all batches (returns num of batches)
+        numBatches = 0
+        while True:
+            try:
+                sess.run(trainOp)
+                numBatches += 1
+            except tf.errors.OutOfRangeError:
+                return numBatches
+
+
+def TrainDurationPer10K(durationMs, numSamples):
+    return durationMs * 10000 / max(numSamples, 1)
+
+
 class DTN:
     def __init__(self, modelParams, nnName, directory, loadNN = True, learning_rate = 0.001):
 
@@ -43,12 +75,20 @@ class DTN:
         self.num_output = modelParams.outputEnd - modelParams.outputStart 
 
         self.numRuns =tf.get_variable(nnName + ".numRuns", shape=(), initializer=tf.zeros_initializer())
+        self.numRunsValue = tf.placeholder(tf.float32, shape=())
+        self.addNumRuns = self.numRuns.assign_add(self.numRunsValue)
+        self.resetNumRuns = self.numRuns.assign(0)
         
-        self.inputLayerState = tf.placeholder(tf.float32, [None, modelParams.stateSize], name="state") 
-        self.inputLayerActions = tf.placeholder(tf.float32, [None, modelParams.numActions], name="action") 
+        # inputs are taken from train pipeline unless fed (prediction)
+        self.trainInput = TrainEpochsInput([[modelParams.stateSize], [], [self.num_output]], [tf.float32, tf.int32, tf.float32], modelParams.batchSize)
+        sTrain, aTrain, s_Train = self.trainInput.next
+
+        self.inputLayerState = tf.placeholder_with_default(sTrain, [None, modelParams.stateSize], name="state") 
+        self.inputActions = tf.placeholder_with_default(aTrain, [None], name="action") 
+        self.inputLayerActions = tf.one_hot(self.inputActions, modelParams.numActions, dtype=tf.float32, name="actionOneHot") 
 
         # Construct network
-        self.outputTensor = tf.placeholder(tf.float32, [None, self.num_output], name="nextState")
+        self.outputTensor = tf.placeholder_with_default(s_Train, [None, self.num_output], name="nextState")
         self.outputLayer = self.build_dtn(modelParams.nn_Func, nnName)
 
         # Define loss and optimizer
@@ -74,6 +114,8 @@ class DTN:
 
         
         self.lastLearningTime = 0
+        self.lastLearningTimePer10K = 0
+        self.lastLearningNumSamples = 0
         self.lastSavingTime = 0
 
     # Define the neural network
@@ -96,40 +138,27 @@ class DTN:
       
     def predict(self, observation, action):
         normalizeTo = np.sum(observation[self.params.outputStart:self.params.outputEnd])
-        actionVec = np.zeros((1,self.params.numActions), int)
-        actionVec[0,action] = 1
-        vals = self.outputLayer.eval({self.inputLayerState: observation.reshape(1, self.params.stateSize), self.inputLayerActions: actionVec}, session=self.sess)
+        vals = self.outputLayer.eval({self.inputLayerState: observation.reshape(1, self.params.stateSize), self.inputActions: [action]}, session=self.sess)
 
         return vals * normalizeTo
         
-    def learn(self, s, a, s_):  
+    def learn(self, s, a, s_, numEpochs = 1):  
         start = datetime.datetime.now()           
         size = len(a)
-        # construct sparse repressentation of actions
-        idxArray = np.arange(size)
-        valInSparse = np.ones(size, dtype = int)
-        actionInput=sparse.csc_matrix((valInSparse,(idxArray,a)),shape=(size,self.params.numActions)).toarray()
-        
-        for i in range(int(size  / self.params.batchSize)):
-            chosen = np.random.choice(idxArray, self.params.batchSize)
-            
-            sChosen = s[chosen].reshape(self.params.batchSize, self.params.stateSize)
-            s_Chosen = s_[chosen].reshape(self.params.batchSize, self.params.stateSize)
-            aChosen = actionInput[chosen,:]
-            
-            feedDict = {self.inputLayerState: sChosen, self.inputLayerActions: aChosen, self.outputTensor: s_Chosen}
-            self.sess.run([self.train_op, self.loss_op], feed_dict=feedDict)
+        self.trainInput.Init(self.sess, [s.reshape(size, self.params.stateSize), np.asarray(a, dtype=np.int32), s_.reshape(size, self.num_output)], numEpochs)
+        self.trainInput.Train(self.sess, self.train_op)
 
         diff = datetime.datetime.now() - start
         self.lastLearningTime = diff.seconds * 1000 + diff.microseconds / 1000
+        self.lastLearningNumSamples = size * numEpochs
+        self.lastLearningTimePer10K = TrainDurationPer10K(self.lastLearningTime, self.lastLearningNumSamples)
 
 
     def Reset(self):
         #self.outputLayer = self.build_dtn(self.params.nn_Func, self.nnName)
         # tf.reset_default_graph()
         self.sess.run(self.init_op) 
-        assign_op = self.numRuns.assign(0)
-        self.sess.run(assign_op)
+        self.sess.run(self.resetNumRuns)
 
         self.hist = {}
         self.hist["s"] = []
@@ -169,20 +198,22 @@ class DTN:
         return int(self.numRuns.eval(session = self.sess))
 
     def end_run(self, toLearn = False, toSave = False, numRuns = 1):
-        assign = self.numRuns.assign_add(numRuns)
-        self.sess.run(assign)
+        self.sess.run(self.addNumRuns, {self.numRunsValue: numRuns})
 
         s, a, s_ = self.GetHist()
         if len(a) >= self.params.minReplaySize:
             print("DTN - start training with hist size =", len(a), end = ', ')   
             self.learn(s, a, s_)
-            print("end taining after", self.lastLearningTime, "ms")
+            print("end taining after", self.lastLearningTime, "ms (", "%.1f" % self.lastLearningTimePer10K, "ms per 10k samples)")
 
         if toSave:
             self.save_network()
 
     def LastTrainDuration(self):
-        return self.lastLearningTime
+        # ms per 10k trained samples (samples * epochs), total ms of last learn is lastLearningTime
+        return self.lastLearningTimePer10K
+    def LastTrainNumSamples(self):
+        return self.lastLearningNumSamples
     def LastSaveDuration(self):
         return self.lastSavingTime
 
@@ -209,13 +240,21 @@ class DTN2:
         self.num_output = 1 
 
         self.numRuns =tf.get_variable(nnName + ".numRuns", shape=(), initializer=tf.zeros_initializer())
+        self.numRunsValue = tf.placeholder(tf.float32, shape=())
+        self.addNumRuns = self.numRuns.assign_add(self.numRunsValue)
+        self.resetNumRuns = self.numRuns.assign(0)
         
-        self.inputLayerState = tf.placeholder(tf.float32, [None, modelParams.stateSize]) 
-        self.inputLayerNextState = tf.placeholder(tf.float32, [None, modelParams.stateSize]) 
-        self.inputLayerActions = tf.placeholder(tf.float32, [None, modelParams.numActions]) 
+        # inputs are taken from train pipeline unless fed (prediction)
+        self.trainInput = TrainEpochsInput([[modelParams.stateSize], [], [modelParams.stateSize], [self.num_output]], [tf.float32, tf.int32, tf.float32, tf.float32], modelParams.batchSize)
+        sTrain, aTrain, s_Train, pTrain = self.trainInput.next
+
+        self.inputLayerState = tf.placeholder_with_default(sTrain, [None, modelParams.stateSize]) 
+        self.inputLayerNextState = tf.placeholder_with_default(s_Train, [None, modelParams.stateSize]) 
+        self.inputActions = tf.placeholder_with_default(aTrain, [None]) 
+        self.inputLayerActions = tf.one_hot(self.inputActions, modelParams.numActions, dtype=tf.float32) 
 
         # Construct network
-        self.outputTensor = tf.placeholder(tf.float32, [None, self.num_output])
+        self.outputTensor = tf.placeholder_with_default(pTrain, [None, self.num_output])
         self.outputLayer = self.build_dtn(modelParams.nn_Func, nnName)
 
         # Define loss and optimizer
@@ -241,6 +280,8 @@ class DTN2:
 
         
         self.lastLearningTime = 0
+        self.lastLearningTimePer10K = 0
+        self.lastLearningNumSamples = 0
         self.lastSavingTime = 0
 
     # Define the neural network
@@ -262,10 +303,8 @@ class DTN2:
         return 0
     
     def TransitionProb(self, s, a, s_):
-        actionVec = np.zeros((1,self.params.numActions), int)
-        actionVec[0, a] = 1
         inputDict = {self.inputLayerState: s.reshape(1, self.params.stateSize), self.inputLayerNextState: s_.reshape(1, self.params.stateSize), 
-                        self.inputLayerActions: actionVec}
+                        self.inputActions: [a]}
         
         prob = self.outputLayer.eval(inputDict, session=self.sess)
         
@@ -277,39 +316,24 @@ class DTN2:
         self.hist["s_"].append(s_)
         self.hist["p"].append(p)
     
-    def learn(self, s, a, s_, p):  
+    def learn(self, s, a, s_, p, numEpochs = 1):  
         start = datetime.datetime.now()           
         size = len(a)
-        # construct sparse repressentation of actions
-        idxArray = np.arange(size)
-        valInSparse = np.ones(size, dtype = int)
-        actionInput=sparse.csc_matrix((valInSparse,(idxArray,a)),shape=(size,self.params.numActions)).toarray()
-        
-        for i in range(int(size  / self.params.batchSize)):
-            chosen = np.random.choice(idxArray, self.params.batchSize)
-            
-            sChosen = s[chosen].reshape(self.params.batchSize, self.params.stateSize)
-            s_Chosen = s_[chosen].reshape(self.params.batchSize, self.params.stateSize)
-            aChosen = actionInput[chosen,:]
-            pChosen = p[chosen]
-            
-            feedDict = {self.inputLayerState: sChosen, 
-                        self.inputLayerNextState: s_Chosen, 
-                        self.inputLayerActions: aChosen, 
-                        self.outputTensor: pChosen.reshape(self.params.batchSize, 1)}
-
-            self.sess.run([self.train_op, self.loss_op], feed_dict=feedDict)
+        self.trainInput.Init(self.sess, [s.reshape(size, self.params.stateSize), np.asarray(a, dtype=np.int32), s_.reshape(size, self.params.stateSize), 
+                                        p.reshape(size, self.num_output)], numEpochs)
+        self.trainInput.Train(self.sess, self.train_op)
 
         diff = datetime.datetime.now() - start
         self.lastLearningTime = diff.seconds * 1000 + diff.microseconds / 1000
+        self.lastLearningNumSamples = size * numEpochs
+        self.lastLearningTimePer10K = TrainDurationPer10K(self.lastLearningTime, self.lastLearningNumSamples)
 
 
     def Reset(self):
         #self.outputLayer = self.build_dtn(self.params.nn_Func, self.nnName)
         #tf.reset_default_graph()
         self.sess.run(self.init_op) 
-        assign_op = self.numRuns.assign(0)
-        self.sess.run(assign_op)
+        self.sess.run(self.resetNumRuns)
 
         self.hist = {}
         self.hist["s"] = []
@@ -329,14 +353,13 @@ class DTN2:
         return int(self.numRuns.eval(session = self.sess))
 
     def end_run(self, toLearn = False, toSave = True, numRuns = 1):
-        assign = self.numRuns.assign_add(numRuns)
-        self.sess.run(assign)
+        self.sess.run(self.addNumRuns, {self.numRunsValue: numRuns})
 
         s, a, s_, p = self.GetHist()
         if len(p) >= self.params.minReplaySize:
             print("DTN2 - start training with hist size =", len(p), end = ', ')
             self.learn(s, a, s_, p)
-            print("end taining after", self.lastLearningTime, "ms")
+            print("end taining after", self.lastLearningTime, "ms (", "%.1f" % self.lastLearningTimePer10K, "ms per 10k samples)")
         if toSave:
             self.save_network()
 
@@ -359,66 +382,37 @@ class DTN2:
         return s, a, s_, p
 
     def LastTrainDuration(self):
-        return self.lastLearningTime
+        # ms per 10k trained samples (samples * epochs), total ms of last learn is lastLearningTime
+        return self.lastLearningTimePer10K
+    def LastTrainNumSamples(self):
+        return self.lastLearningNumSamples
     def LastSaveDuration(self):
         return self.lastSavingTime
 
 
 
-from utils_ttable import TransitionTable
+from utils_ttable import TransitionTable, TransitionTargets
 
 class Filtered_DTN(DTN):
     def __init__(self, modelParams, nnName, directory, ttableName, loadNN = True, learning_rate = 0.001, thresholdNumTransitions = 1):
         super(Filtered_DTN, self).__init__(modelParams, nnName, directory, loadNN, learning_rate)
         
         self.ttableName = ttableName
-        self.ttable = TransitionTable(modelParams.numActions, ttableName)
         self.thresholdNumTransitions = thresholdNumTransitions
+        self.NewTTable()
 
     def learn(self, s, a, s_):
-        for i in range(len(a)): 
-            self.ttable.learn(str(s[i]), a[i], str(s_[i]))
-
-        sLearn = []
-        aLearn = []
-        s_Learn = []
-
-        allStates = self.ttable.table.keys()
-        idxActionCount = self.ttable.actionSumIdx
-        idxTable = self.ttable.tableIdx
-        for sT in allStates:
-            if sT == 'TrialsData':
-                continue
-            sStr = sT.replace("[", "").replace("]", "")
-            sArray = np.fromstring(sStr, dtype=int, sep = ' ')
-            actionCountVec = np.array(self.ttable.table[sT][idxActionCount])
-            stateTable = self.ttable.table[sT][idxTable]
-            thresholdActions = np.arange(len(actionCountVec))[actionCountVec > self.thresholdNumTransitions]
-
-            for action in thresholdActions:
-                sLearn.append(sArray)
-                aLearn.append(action)
-                s_Learn.append(self.CalcSPrime(stateTable, action))
-        
+        sIds, s_Ids = self.ttable.learnBatch(s, a, s_)
+        self.targets.Update(sIds, a)
+
+        sIds, aLearn, s_Learn = self.targets.Targets()
         if len(aLearn) >= self.params.batchSize:
-            super(Filtered_DTN, self).learn(np.array(sLearn), np.array(aLearn), np.array(s_Learn))
+            super(Filtered_DTN, self).learn(self.ttable.registry.DecodeBatch(sIds), aLearn, s_Learn)
         else:
             print("\n\nskip learning")
 
-    def CalcSPrime(self, stateTable, a):
-        names = list(stateTable.index)
-
-        sPrime = np.zeros(self.num_output)
-        allCount = 0
-        for sP in names:
-            c = stateTable.ix[sP, a]
-            if c > 0:
-                sPArray = np.fromstring(sP.replace("[", "").replace("]", ""), dtype=int, sep = ' ')
-                sPrime[sPArray > 0] = c
-                allCount += c
-
-        return sPrime / allCount
-
     def NewTTable(self):
         self.ttable = TransitionTable(self.params.numActions, self.ttableName)
+        self.targets = TransitionTargets(self.ttable, self.params.outputStart, self.params.outputEnd, self.thresholdNumTransitions)
+        self.targets.UpdateAll()
             
\ No newline at end of file
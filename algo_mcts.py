@@ -0,0 +1,297 @@
+import numpy as np
+import threading
+import time
+
+import tensorflow as tf
+
+from algo_dqn import DQN_PARAMS
+from algo_dqn import DQN_WithTarget
+
+from utils_ttable import RewardTransitionTable
+from utils_states import StateRegistry
+
+from multiprocessing import Lock
+from utils import EmptyLock
+
+
+class MCTS_PARAMS(DQN_PARAMS):
+    def __init__(self, stateSize, numActions, layersNum=1, neuronsInLayerNum=256, numTrials2CmpResults=1000, numTrials2Learn=None, numTrials2Save=100,
+                discountFactor=0.95, learning_rate=1e-05, explorationProb=0.1, numSimulations=64, explorationConst=1.0, maxDepth=20, leafBatchSize=8, virtualLoss=1.0):
+
+        super(MCTS_PARAMS, self).__init__(stateSize=stateSize, numActions=numActions, layersNum=layersNum, neuronsInLayerNum=neuronsInLayerNum,
+                                        numTrials2CmpResults=numTrials2CmpResults, numTrials2Learn=numTrials2Learn, numTrials2Save=numTrials2Save,
+                                        discountFactor=discountFactor, learning_rate=learning_rate, explorationProb=explorationProb)
+
+        # simulations of uct search for each step (leaves reached by leafBatchSize simulations are evaluated in single dqn run)
+        self.numSimulations = numSimulations
+        self.explorationConst = explorationConst
+        self.maxDepth = maxDepth
+        self.leafBatchSize = leafBatchSize
+        # simulations waiting for leaf evaluation lower the value of their path (to diversify the batch)
+        self.virtualLoss = virtualLoss
+
+
+class MCTSNode():
+    def __init__(self, sId, values, validActions):
+        # values of actions are dqn values until action is visited
+        self.sId = sId
+        self.values = values
+        self.validActions = validActions
+
+        self.visits = np.zeros(len(values), dtype=float)
+        self.valueSum = np.zeros(len(values), dtype=float)
+        self.numVisits = 0
+
+        # next state id -> node
+        self.children = {}
+        # action -> (next states ids, cumulative counts, reward means, terminal probs) snapshot of transition model row
+        self.transitions = {}
+
+    def ActionsValues(self):
+        return np.divide(self.valueSum, self.visits, out=self.values.copy(), where=self.visits > 0)
+
+    def Select(self, explorationConst):
+        actions = self.validActions
+        bonus = explorationConst * np.sqrt(np.log(self.numVisits + 1) / (self.visits[actions] + 1))
+        return actions[np.argmax(self.ActionsValues()[actions] + bonus)]
+
+    def AddVisit(self, a, value):
+        self.visits[a] += 1
+        self.valueSum[a] += value
+        self.numVisits += 1
+
+    def BestAction(self):
+        # most visited action (ties are broken by value)
+        actions = self.validActions
+        order = np.lexsort((self.ActionsValues()[actions], self.visits[actions]))
+        return actions[order[-1]]
+
+
+class MCTS(DQN_WithTarget):
+    def __init__(self, modelParams, nnName, nnDirectory, isMultiThreaded = False, agentName = ""):
+        super(MCTS, self).__init__(modelParams=modelParams, nnName=nnName, nnDirectory=nnDirectory, isMultiThreaded=isMultiThreaded, agentName=agentName)
+
+        # transition model is learned from raw states, dqn is evaluated on normalized states
+        self.registry = StateRegistry()
+        self.ttable = RewardTransitionTable(self.numActions, nnDirectory + nnName + "_ttable", newTable=True, stateRegistry=self.registry)
+        self.normalizeFunc = None
+
+        self.allActions = np.arange(self.numActions)
+
+        # tree of each game thread is kept between steps while model is not changed
+        self.modelLock = Lock() if isMultiThreaded else EmptyLock()
+        self.modelGeneration = 0
+        self.threadTree = threading.local()
+
+        self.searchDuration = 0.0
+        self.numSearches = 0
+
+    def SetStateNormalization(self, normalizeFunc):
+        self.normalizeFunc = normalizeFunc
+
+    def Observe(self, s, a, r, s_, terminal):
+        # insert transitions (raw states) to transition and reward model
+        if len(a) == 0:
+            return
+
+        self.modelLock.acquire()
+        self.ttable.learnTransitions(s, a, r, s_, terminal)
+        self.modelGeneration += 1
+        self.modelLock.release()
+
+    def LeafValues(self, states, targetValues = False):
+        if self.normalizeFunc != None:
+            states = self.normalizeFunc(states)
+
+        output = self.targetOutput if targetValues else self.outputLayer
+        return self.sess.run(output, {self.inputLayer: states.reshape(len(states), self.num_input)})
+
+    def NewNode(self, sId, values, validActions = None):
+        if validActions is None:
+            # actions of non root states are actions with known transitions (all actions if none of them known)
+            validActions = self.allActions
+            self.modelLock.acquire()
+            if sId < self.ttable.NumStates():
+                known = np.nonzero(self.ttable.actionCount[sId])[0]
+                validActions = known if len(known) > 0 else validActions
+            self.modelLock.release()
+
+        return MCTSNode(sId, values, np.asarray(validActions, dtype=int))
+
+    def Transitions(self, node, a):
+        # row of model is copied once for each node and action (model lock is held only while copying)
+        if a not in node.transitions:
+            self.modelLock.acquire()
+            if node.sId < self.ttable.NumStates():
+                entries, s_Ids, counts = self.ttable.NextStates(node.sId, a)
+                rewards, terminalProbs = self.ttable.RewardMean(entries, a), self.ttable.TerminalProb(entries, a)
+            else:
+                s_Ids, counts, rewards, terminalProbs = np.zeros(0, dtype=int), np.zeros(0), np.zeros(0), np.zeros(0)
+            self.modelLock.release()
+
+            node.transitions[a] = (s_Ids, np.cumsum(counts), rewards, terminalProbs)
+
+        return node.transitions[a]
+
+    def Simulate(self, root):
+        # selection from root until a leaf. returns path of (node, action, reward) and the leaf:
+        # (None, value) when value of leaf is known, or (parent, next state id) when leaf should be evaluated
+        path = []
+        node = root
+        virtualLoss = self.params.virtualLoss
+        for depth in range(self.params.maxDepth):
+            a = node.Select(self.params.explorationConst)
+            node.AddVisit(a, -virtualLoss)
+
+            s_Ids, cumCounts, rewards, terminalProbs = self.Transitions(node, a)
+            if len(s_Ids) == 0:
+                # unknown dynamics: value of action is its dqn value
+                path.append((node, a, node.values[a]))
+                return path, (None, 0.0)
+
+            idx = np.searchsorted(cumCounts, np.random.uniform() * cumCounts[-1], side='right')
+            s_Id = s_Ids[idx]
+            path.append((node, a, rewards[idx]))
+            if np.random.uniform() < terminalProbs[idx]:
+                return path, (None, 0.0)
+
+            child = node.children.get(s_Id)
+            if child == None:
+                return path, (node, s_Id)
+
+            node = child
+
+        return path, (None, np.max(node.values[node.validActions]))
+
+    def Backup(self, path, leafValue):
+        g = leafValue
+        virtualLoss = self.params.virtualLoss
+        for node, a, r in reversed(path):
+            g = r + self.params.discountFactor * g
+            # visit was counted on selection with virtual loss
+            node.valueSum[a] += g + virtualLoss
+
+    def Search(self, root, targetValues):
+        simulationsLeft = self.params.numSimulations
+        while simulationsLeft > 0:
+            numSimulations = min(self.params.leafBatchSize, simulationsLeft)
+            simulationsLeft -= numSimulations
+
+            done = []
+            pending = {}
+            for i in range(numSimulations):
+                path, (parent, leaf) = self.Simulate(root)
+                if parent == None:
+                    done.append((path, leaf))
+                else:
+                    pending.setdefault((parent, leaf), []).append(path)
+
+            if len(pending) > 0:
+                # all leaves of batch are evaluated in single run
+                leaves = list(pending.keys())
+                values = self.LeafValues(self.registry.DecodeBatch([s_Id for parent, s_Id in leaves]), targetValues)
+                for (parent, s_Id), vals in zip(leaves, values):
+                    child = self.NewNode(s_Id, vals)
+                    parent.children[s_Id] = child
+                    leafValue = np.max(vals[child.validActions])
+                    for path in pending[(parent, s_Id)]:
+                        done.append((path, leafValue))
+
+            for path, leafValue in done:
+                self.Backup(path, leafValue)
+
+        return root
+
+    def Root(self, state, validActions, targetValues, reuse):
+        # root of last tree is reused if state is a child of last root with the same model
+        tree = self.threadTree
+        sId = self.registry.Encode(state)
+        root = None
+        if reuse and getattr(tree, "root", None) != None and tree.generation == self.modelGeneration and tree.targetValues == targetValues:
+            root = tree.root.children.get(sId)
+
+        if root == None:
+            root = self.NewNode(sId, self.DqnValues(state, targetValues), validActions)
+        else:
+            root.validActions = np.asarray(validActions, dtype=int)
+
+        return root
+
+    def SearchState(self, state, validActions, targetValues, reuse = True):
+        # search runs without model lock. tree is kept with generation of model at start of search (model changes during search prevent reuse)
+        start = time.time()
+        generation = self.modelGeneration
+        root = self.Search(self.Root(state, validActions, targetValues, reuse), targetValues)
+
+        self.searchDuration += time.time() - start
+        self.numSearches += 1
+        return root, generation
+
+    def ModelIsEmpty(self):
+        return self.ttable.numEntries == 0
+
+    def DqnValues(self, state, targetValues):
+        return self.LeafValues(state.reshape(1, self.num_input), targetValues)[0]
+
+    def choose_action(self, state, validActions, targetValues=False):
+        # while model has no transitions search is skipped and action is chosen by dqn values of state.
+        # in search, states not in model are leaves with dqn values and actions with no known transitions keep their dqn value
+        if self.ModelIsEmpty():
+            values = self.DqnValues(state, targetValues)
+            validActions = np.asarray(validActions, dtype=int)
+            bestAction = validActions[np.argmax(values[validActions])]
+        else:
+            root, generation = self.SearchState(state, validActions, targetValues)
+
+            tree = self.threadTree
+            tree.root = root
+            tree.generation = generation
+            tree.targetValues = targetValues
+
+            values = root.ActionsValues()
+            bestAction = root.BestAction()
+
+        explore = self.TargetExploreProb() if targetValues else self.ExploreProb()
+        if np.random.uniform() > explore:
+            a = bestAction
+        else:
+            a = np.random.choice(validActions)
+
+        return a, values
+
+    def ActionsValues(self, state, validActions, targetValues = False):
+        # values of search from a new tree (tree of thread is not changed), dqn values while model is empty
+        if self.ModelIsEmpty():
+            return self.DqnValues(state, targetValues)
+
+        root, _ = self.SearchState(state, validActions, targetValues, reuse=False)
+        return root.ActionsValues()
+
+    def learn(self, s, a, r, s_, terminal, numRuns2Save = None):
+        super(MCTS, self).learn(s, a, r, s_, terminal, numRuns2Save)
+        self.modelGeneration += 1
+
+    def learnMinibatches(self, batches, numRuns2Save = None):
+        tdErrors = super(MCTS, self).learnMinibatches(batches, numRuns2Save)
+        self.modelGeneration += 1
+        return tdErrors
+
+    def CopyTarget2Model(self, numRuns):
+        super(MCTS, self).CopyTarget2Model(numRuns)
+        self.modelGeneration += 1
+
+    def end_run(self, r, toSave = False):
+        super(MCTS, self).end_run(r, toSave)
+        self.threadTree.root = None
+
+        if self.numSearches > 0:
+            print("\t", threading.current_thread().getName(), ":", self.agentName, "->mcts avg search duration =", "%.3f" % (self.searchDuration * 1000 / self.numSearches), "ms")
+            self.searchDuration = 0.0
+            self.numSearches = 0
+
+    def Reset(self):
+        super(MCTS, self).Reset()
+        self.modelGeneration += 1
+
+    def DecisionMakerType(self):
+        return "MCTS"
@@ -15,21 +15,28 @@ from utils import EmptyLock
 
 from utils import ParamsBase
 
+from utils_states import StateRegistry
+
 #qtable params
 class QTableParams(ParamsBase):
-    def __init__(self, stateSize, numActions, learning_rate=0.01, discountFactor=0.95, explorationProb=0.1, maxReplaySize=500000, minReplaySize=1000, numTrials2Learn=None, numTrials2Save=100):
+    def __init__(self, stateSize, numActions, learning_rate=0.01, discountFactor=0.95, explorationProb=0.1, maxReplaySize=500000, minReplaySize=1000, numTrials2Learn=None, numTrials2Save=100, 
+                aggregateUpdate=False):
         super(QTableParams, self).__init__(stateSize, numActions, discountFactor, maxReplaySize, minReplaySize, numTrials2Learn=numTrials2Learn, numTrials2Save=numTrials2Save)    
         self.learningRate = learning_rate
         self.explorationProb = explorationProb        
+        # learn batch in a single update from values before batch (instead of in order updates)
+        self.aggregateUpdate = aggregateUpdate
 
     def ExploreProb(self, numRuns):
         return self.explorationProb
 
 class QTableParamsExplorationDecay(ParamsBase):
-    def __init__(self, stateSize, numActions, learning_rate=0.01, discountFactor=0.95, exploreRate = 0.001, exploreStop = 0.1, maxReplaySize = 50000, minReplaySize = 1000, numTrials2Learn=None, numTrials2Save=100):
+    def __init__(self, stateSize, numActions, learning_rate=0.01, discountFactor=0.95, exploreRate = 0.001, exploreStop = 0.1, maxReplaySize = 50000, minReplaySize = 1000, numTrials2Learn=None, numTrials2Save=100, 
+                aggregateUpdate=False):
         super(QTableParamsExplorationDecay, self).__init__(stateSize, numActions, discountFactor, maxReplaySize, minReplaySize, numTrials2Learn=numTrials2Learn, numTrials2Save=numTrials2Save) 
 
         self.learningRate = learning_rate        
+        self.aggregateUpdate = aggregateUpdate
         self.exploreStart = 1
         self.exploreStop = exploreStop
         self.exploreRate = exploreRate
@@ -38,8 +45,10 @@ class QTableParamsExplorationDecay(ParamsBase):
         return self.exploreStop + (self.exploreStart - self.exploreStop) * np.exp(-self.exploreRate * numRuns)
 
 class QLearningTable:
-    def __init__(self, modelParams, qTableName, qTableDirectory, loadTable = True, isMultiThreaded = False, agentName=""):
+    def __init__(self, modelParams, qTableName, qTableDirectory, loadTable = True, isMultiThreaded = False, agentName="", stateRegistry = None):
         self.qTableFullName = qTableDirectory + qTableName
+        # ids of states vectors (registry can be shared with other tables)
+        self.registry = stateRegistry if stateRegistry != None else StateRegistry()
         
         if isMultiThreaded:
             self.checkStateLoc = Lock()
@@ -55,24 +64,40 @@ class QLearningTable:
         slotsInTable = max(4, modelParams.numActions)
         self.actions = list(range(modelParams.numActions))
         self.slots = list(range(slotsInTable))  # a list
-        self.table = pd.DataFrame(columns=self.slots, dtype=np.float)
 
         self.params = modelParams
 
+        self.initialCapacity = 1024
+        self.ResetTable()
+
+    def ResetTable(self):
+        # dense values table (grows geometrically). 
+        # rows of states vectors are found by registry id (rowOfId), rows of str states by name (name is saved to file).
+        # rows of states vectors are named only when needed (unnamedStates), rows loaded from file are found by name until their id is known (unkeyedRows)
+        self.values = np.zeros((self.initialCapacity, len(self.slots)), dtype=float)
+        self.size = 0
+        self.stateNames = []
+        self.nameIdx = {}
+        self.rowOfId = np.full(self.initialCapacity, -1, dtype=int)
+        self.unnamedStates = {}
+        self.unkeyedRows = set()
 
     def InitModel(self, session, resetModel=False):
         if os.path.isfile(self.qTableFullName + '.gz') and not resetModel:
             self.ReadTable()
         
-        self.check_state_exist(self.TrialsData)
+        self.InitTrialsData()
+
+    def InitTrialsData(self):
+        self.trialsIdx = self.StateIdx(self.TrialsData)
 
-        self.numTotRuns = self.table.ix[self.TrialsData, self.NumRunsTotalSlot]
-        self.avgTotReward = self.table.ix[self.TrialsData, self.AvgRewardSlot]
+        self.numTotRuns = self.values[self.trialsIdx, self.NumRunsTotalSlot]
+        self.avgTotReward = self.values[self.trialsIdx, self.AvgRewardSlot]
         self.numExpRuns = 0
         self.avgExpReward = 0
 
-        self.table.ix[self.TrialsData, self.AvgRewardExperimentSlot] = 0
-        self.table.ix[self.TrialsData, self.NumRunsExperimentSlot] = 0
+        self.values[self.trialsIdx, self.AvgRewardExperimentSlot] = 0
+        self.values[self.trialsIdx, self.NumRunsExperimentSlot] = 0
     
     def TakeDfltValues(self):
         return False
@@ -84,27 +109,40 @@ class QLearningTable:
         self.timeoutPropogation = 10
 
     def ReadTable(self):
-        self.table = pd.read_pickle(self.qTableFullName + '.gz', compression='gzip')
+        table = pd.read_pickle(self.qTableFullName + '.gz', compression='gzip')
+        
+        self.ResetTable()
+        self.Grow(len(table.index))
+        self.values[:len(table.index)] = table.values.astype(float)
+        self.size = len(table.index)
+        self.stateNames = list(table.index)
+        self.nameIdx = {name: idx for idx, name in enumerate(self.stateNames)}
+        self.unkeyedRows = set(range(self.size))
 
     def SaveTable(self):
-        self.table.to_pickle(self.qTableFullName + '.gz', 'gzip') 
+        self.Table().to_pickle(self.qTableFullName + '.gz', 'gzip') 
+
+    def Table(self):
+        # q table as data frame (same as saved table)
+        self.checkStateLoc.acquire()
+        self.NameStates()
+        table = pd.DataFrame(self.values[:self.size], index=self.stateNames[:self.size], columns=self.slots)
+        self.checkStateLoc.release()
+        return table
     
     def choose_absolute_action(self, observation):
-        state = str(observation)
-        self.check_state_exist(state)
-        state_action = self.table.ix[state, self.actions]
+        vals = self.values[self.StateIdx(observation), self.actions]
         
-        state_actionReindex = state_action.reindex(np.random.permutation(state_action.index))
-        action = state_actionReindex.idxmax()
+        # random choice between actions with max value
+        permutation = np.random.permutation(len(self.actions))
+        action = permutation[np.argmax(vals[permutation])]
 
-        return action, state_action[action]
+        return action, vals[action]
 
     def ExploreProb(self):
         return self.params.ExploreProb(self.numTotRuns)
 
     def choose_action(self, state, validActions, targetValues=False):
-        state = str(state)
-        
         exploreProb = self.params.ExploreProb(self.numTotRuns)
         actionVals = self.ActionsValues(state, validActions, targetValues)
 
@@ -125,33 +163,87 @@ class QLearningTable:
 
 
     def ActionsValues(self, state, validActions, targetValues = False):
-        s = str(state)
-        self.check_state_exist(s)
-        vals = self.table.ix[s, :]
-
-        return vals
+        return self.values[self.StateIdx(state)].copy()
 
     def NumRuns(self):
         return self.numTotRuns
 
     def learn(self, statesVec, actionsVec, rewardsVec, nextStateVec, terminal):
-        for i in range(len(rewardsVec)):
-            s = str(statesVec[i])
-            s_ = str(nextStateVec[i])
-            self.check_state_exist(s)
-            self.check_state_exist(s_)
-            self.learnIMP(s, actionsVec[i], rewardsVec[i], s_, terminal[i])
+        if len(rewardsVec) == 0:
+            return
+
+        numSamples = len(rewardsVec)
+        allIdx = self.StatesIdx(np.concatenate((np.asarray(statesVec), np.asarray(nextStateVec))))
+        s, s_ = allIdx[:numSamples], allIdx[numSamples:]
+        a = np.asarray(actionsVec, dtype=int)
+        r = np.asarray(rewardsVec, dtype=float)
+        terminal = np.asarray(terminal, dtype=bool)
+
+        if getattr(self.params, "aggregateUpdate", False):
+            self.learnBatch(s, a, r, s_, terminal, aggregate=True)
+            return
+
+        # in order learning: batch is splitted to chunks in which no update reads value written before it in the chunk
+        start = 0
+        for end in self.InOrderChunks(s, a, s_) + [numSamples]:
+            self.learnBatch(s[start:end], a[start:end], r[start:end], s_[start:end], terminal[start:end])
+            start = end
+
+    def InOrderChunks(self, s, a, s_):
+        # conflict of update i: last earlier update writing to the same cell or to row of next state of i
+        numSamples = len(s)
+        samplesIdx = np.arange(numSamples)
+        cells = s * len(self.slots) + a
+        prevCellWrite = self.LastPrevOccurence(cells, cells, samplesIdx)
+        prevRowWrite = self.LastPrevOccurence(s, s_, samplesIdx)
+        prevConflict = np.maximum(prevCellWrite, prevRowWrite).tolist()
+
+        chunks = []
+        start = 0
+        for i in range(numSamples):
+            if prevConflict[i] >= start:
+                chunks.append(i)
+                start = i
+        
+        return chunks
+
+    def LastPrevOccurence(self, written, read, samplesIdx):
+        # for each i last j < i in which written[j] == read[i] (-1 if not exist).
+        # writes and reads are sorted together by (value, idx) with read of i placed before write of i
+        numKeys = 2 * len(samplesIdx)
+        keys = np.sort(np.concatenate((written * numKeys + 2 * samplesIdx + 1, read * numKeys + 2 * samplesIdx)))
+        values = keys // numKeys
+        isWrite = (keys & 1) == 1
+        
+        lastWrite = np.maximum.accumulate(np.where(isWrite, np.arange(len(keys)), -1))
+        found = (lastWrite >= 0) & (values[np.maximum(lastWrite, 0)] == values)
+        prevIdx = np.where(found, (keys[np.maximum(lastWrite, 0)] % numKeys) // 2, -1)
+
+        prevOccurence = np.empty(len(samplesIdx), dtype=int)
+        readKeys = np.invert(isWrite)
+        prevOccurence[(keys[readKeys] % numKeys) // 2] = prevIdx[readKeys]
+        return prevOccurence
+
+    def learnBatch(self, s, a, r, s_, terminal, aggregate = False):
+        # q learning update of rows idx s (in aggregate updates of same (s, a) are summed)
+        q_predict = self.values[s, a]
+        q_target = r + self.params.discountFactor * self.values[s_].max(axis=1) * np.invert(terminal)
+        
+        if aggregate:
+            np.add.at(self.values, (s, a), self.params.learningRate * (q_target - q_predict))
+        else:
+            self.values[s, a] += self.params.learningRate * (q_target - q_predict)
 
     def learnIMP(self, s, a, r, s_, terminal):
-        q_predict = self.table.ix[s, a]
+        q_predict = self.values[s, a]
         
         if not terminal:
-            q_target = r + self.params.discountFactor * self.table.ix[s_, :].max()
+            q_target = r + self.params.discountFactor * self.values[s_].max()
         else:
             q_target = r  # next state is terminal
         
         # update
-        self.table.ix[s, a] += self.params.learningRate * (q_target - q_predict)
+        self.values[s, a] += self.params.learningRate * (q_target - q_predict)
 
     def end_run(self, r, saveTable = False):
         self.avgTotReward = (self.numTotRuns * self.avgTotReward + r) / (self.numTotRuns + 1)
@@ -160,12 +252,12 @@ class QLearningTable:
         self.numTotRuns += 1
         self.numExpRuns += 1
 
-        self.table.ix[self.TrialsData, self.AvgRewardSlot] = self.avgTotReward
-        self.table.ix[self.TrialsData, self.AvgRewardExperimentSlot] = self.avgExpReward
+        self.values[self.trialsIdx, self.AvgRewardSlot] = self.avgTotReward
+        self.values[self.trialsIdx, self.AvgRewardExperimentSlot] = self.avgExpReward
 
         
-        self.table.ix[self.TrialsData, self.NumRunsTotalSlot] = self.numTotRuns
-        self.table.ix[self.TrialsData, self.NumRunsExperimentSlot] = self.numExpRuns
+        self.values[self.trialsIdx, self.NumRunsTotalSlot] = self.numTotRuns
+        self.values[self.trialsIdx, self.NumRunsExperimentSlot] = self.numExpRuns
 
         # print("num total runs = ", self.numTotRuns, "avg total = ", self.avgTotReward)
         # print("num experiment runs = ", self.numExpRuns, "avg experiment = ", self.avgExpReward)
@@ -174,27 +266,157 @@ class QLearningTable:
             self.SaveTable()
 
     def Reset(self):
-        self.table = pd.DataFrame(columns=self.slots, dtype=np.float)
-        self.check_state_exist(self.TrialsData)
+        self.ResetTable()
+        self.InitTrialsData()
+
+    def StateIdx(self, state, stateToInitValues = None):
+        if isinstance(state, str):
+            idx = self.nameIdx.get(state)
+            return idx if idx != None else self.AddState(None, state, stateToInitValues)
+
+        sId = self.registry.Encode(state)
+        idx = self.rowOfId[sId] if sId < len(self.rowOfId) else -1
+        if idx < 0:
+            idx = self.AddState(sId, state, stateToInitValues)
+
+        return idx
+
+    def StatesIdx(self, states):
+        # rows idx of states vec (new states are added to table)
+        states = np.asarray(states)
+        if states.dtype == object or states.ndim == 1:
+            return np.array([self.StateIdx(state) for state in states], dtype=int)
+
+        ids = self.registry.EncodeBatch(states)
+        if len(ids) > 0 and ids.max() >= len(self.rowOfId):
+            self.checkStateLoc.acquire()
+            self.GrowIds(ids.max() + 1)
+            self.checkStateLoc.release()
+
+        rows = self.rowOfId[ids]
+        newStates = np.nonzero(rows < 0)[0]
+        if len(newStates) > 0:
+            _, firstIdx = np.unique(ids[newStates], return_index=True)
+            for i in np.sort(newStates[firstIdx]):
+                self.AddState(ids[i], states[i])
+            rows = self.rowOfId[ids]
+
+        return rows
+
+    def AddState(self, sId, state, stateToInitValues = None):
+        # row of state is not known: find row by name (str state or row loaded from file) or append new row
+        self.checkStateLoc.acquire()
+        idx = None
+        name = None
+        if sId != None:
+            self.GrowIds(sId + 1)
+            idx = self.rowOfId[sId] if self.rowOfId[sId] >= 0 else None
+
+        if isinstance(state, str):
+            name = state
+            idx = self.nameIdx.get(name)
+        elif idx == None and len(self.unkeyedRows) > 0:
+            name = str(state)
+            idx = self.nameIdx.get(name)
+            self.unkeyedRows.discard(idx)
+
+        if idx == None:
+            self.Grow(self.size + 1)
+            idx = self.size
+            self.values[idx] = 0
+            if stateToInitValues != None:
+                initIdx = self.FindState(stateToInitValues)
+                if initIdx != None:
+                    self.values[idx] = self.values[initIdx]
+
+            self.stateNames.append(name)
+            if name != None:
+                self.nameIdx[name] = idx
+            else:
+                self.unnamedStates[idx] = sId
+            self.size += 1
+
+        if sId != None:
+            self.rowOfId[sId] = idx
+        self.checkStateLoc.release()
+        
+        return idx
 
-        self.numTotRuns = self.table.ix[self.TrialsData, self.NumRunsTotalSlot]
-        self.avgTotReward = self.table.ix[self.TrialsData, self.AvgRewardSlot]
-        self.numExpRuns = 0
-        self.avgExpReward = 0
+    def FindState(self, state):
+        if isinstance(state, str):
+            return self.nameIdx.get(state)
 
-        self.table.ix[self.TrialsData, self.AvgRewardExperimentSlot] = 0
-        self.table.ix[self.TrialsData, self.NumRunsExperimentSlot] = 0
+        sId = self.registry.Id(state)
+        if sId != None and sId < len(self.rowOfId) and self.rowOfId[sId] >= 0:
+            return self.rowOfId[sId]
 
-    def check_state_exist(self, state, stateToInitValues = None):
-        self.checkStateLoc.acquire()
-        newState = False
-        if state not in self.table.index:
-            # append new state to q table
-            self.table = self.table.append(pd.Series([0] * len(self.slots), index=self.table.columns, name=state))
-            
-            if stateToInitValues in self.table.index:
-                self.table.ix[state,:] = self.table.ix[stateToInitValues, :]
-            newState = True
+        self.NameStates()
+        return self.nameIdx.get(str(state))
 
-        self.checkStateLoc.release()
-        return newState
\ No newline at end of file
+    def NameStates(self):
+        for idx, sId in self.unnamedStates.items():
+            name = str(self.registry.Decode(sId))
+            self.stateNames[idx] = name
+            self.nameIdx.setdefault(name, idx)
+
+        self.unnamedStates = {}
+
+    def GrowIds(self, size):
+        if size <= len(self.rowOfId):
+            return
+
+        rowOfId = np.full(max(size, 2 * len(self.rowOfId)), -1, dtype=int)
+        rowOfId[:len(self.rowOfId)] = self.rowOfId
+        self.rowOfId = rowOfId
+
+    def Grow(self, size):
+        if size <= len(self.values):
+            return
+
+        capacity = len(self.values)
+        while capacity < size:
+            capacity *= 2
+
+        values = np.zeros((capacity, len(self.slots)), dtype=float)
+        values[:self.size] = self.values[:self.size]
+        self.values = values
+
+    def check_state_exist(self, state, stateToInitValues = None):
+        size = self.size
+        self.StateIdx(state, stateToInitValues)
+        return self.size > size
+
+
+def BenchmarkLearn(numTransitions = 500000, stateSize = 4, stateVals = 10, numActions = 5):
+    # in order batch learning vs. learning each transition separately
+    params = QTableParams(stateSize, numActions)
+    s = np.random.randint(0, stateVals, (numTransitions, stateSize))
+    a = np.random.randint(0, numActions, numTransitions)
+    r = np.random.uniform(size=numTransitions)
+    s_ = np.random.randint(0, stateVals, (numTransitions, stateSize))
+    terminal = np.random.uniform(size=numTransitions) < 0.05
+
+    tableLoop = QLearningTable(params, "", "")
+    tableLoop.Reset()
+    start = time.time()
+    for i in range(numTransitions):
+        tableLoop.learnIMP(tableLoop.StateIdx(s[i]), a[i], r[i], tableLoop.StateIdx(s_[i]), terminal[i])
+    loopDuration = time.time() - start
+
+    allStates = np.concatenate((s, s_))
+    results = [tableLoop.values[tableLoop.StatesIdx(allStates)]]
+    for aggregate in [False, True]:
+        params.aggregateUpdate = aggregate
+        table = QLearningTable(params, "", "")
+        table.Reset()
+        start = time.time()
+        table.learn(s, a, r, s_, terminal)
+        duration = time.time() - start
+        results.append(table.values[table.StatesIdx(allStates)])
+        print("aggregate =", aggregate, "batch learn duration =", "%.3f" % duration, "sec, loop duration =", "%.3f" % loopDuration, "sec, speedup =", "%.1f" % (loopDuration / duration))
+
+    print("in order batch learning equal to loop learning:", np.allclose(results[0], results[1]))
+
+
+if __name__ == "__main__":
+    BenchmarkLearn()
@@ -43,7 +43,8 @@ def FullTrain(decisionMaker, newLearning, saveLearning):
         episodes2Train = int(episodes2Train)
 
     print("get history")
-    allHist = decisionMaker.historyMngr.GetAllHist().copy()
+    # episodes are read as memory mapped slices of history store
+    episodes = decisionMaker.historyMngr.IterEpisodes()
     
     print("reset data")
     if newLearning:
@@ -52,15 +53,15 @@ def FullTrain(decisionMaker, newLearning, saveLearning):
     # init history mngr and resultFile without saving to files
     print("start learning...\n\n")
 
+    decisionMaker.historyMngr.Close()
     decisionMaker.historyMngr.__init__(decisionMaker.params)
     decisionMaker.resultFile = None
-    history = decisionMaker.AddHistory()
 
     startTrainEpisodeNums = list(map(int, flags.FLAGS.trainStart.split(',')))
 
     episodeNum = 0
     
-    idxHist = 0
+    historyEnded = False
     rTerminal = []
     rTerminalSum = []
 
@@ -69,20 +70,18 @@ def FullTrain(decisionMaker, newLearning, saveLearning):
 
     for startEpisodeNum in startTrainEpisodeNums:
         episodeInTrain = 0
-        cotinueTrain = True
+        cotinueTrain = not historyEnded
         while cotinueTrain:
-            terminal = False
-            steps = 0
-            while not terminal:
-                s = allHist["s"][idxHist]
-                a = allHist["a"][idxHist]
-                r = allHist["r"][idxHist]
-                s_ = allHist["s_"][idxHist]
-                terminal = allHist["terminal"][idxHist]
-                
-                history.learn(s, a, r, s_, terminal)
-                steps += 1
-                idxHist += 1
+            episode = next(episodes, None)
+            if episode == None:
+                print("end of history in episode num =", episodeNum)
+                historyEnded = True
+                break
+
+            s, a, r, s_, terminal = episode
+            decisionMaker.learnBatch(s, a, r, s_, terminal)
+            steps = len(a)
+            r = r[-1]
             
             rTerminal.append(r)
             decisionMaker.end_run(r, 0, steps)
@@ -155,6 +154,7 @@ if __name__ == "__main__":
     if decisionMaker != None:  
         print("start training...\n\n")
         FullTrain(decisionMaker, newLearning, saveLearning)
+        decisionMaker.Close()
     else:
         print("error in loading the nn")
 
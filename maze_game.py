@@ -1,12 +1,13 @@
 import tensorflow as tf
 import numpy as np
 import random
+import time
 import matplotlib.pyplot as plt
 
 from algo_qtable import QTableParams
 from algo_dqn import DQN_PARAMS
 from algo_decisionMaker import DecisionMakerExperienceReplay
-from utils_ttable import TransitionTable
+from utils_ttable import TransitionTable, TransitionTargets
 
 from algo_dtn import DTN
 from algo_dtn import Filtered_DTN
@@ -279,4 +280,288 @@ class MazeGame(Maze):
             for x in range(self.gridSize):
                 print(s[x + y * self.gridSize], end = ', ')
             print("|")
-        print(s[self.penaltyIdx])
\ No newline at end of file
+        print(s[self.penaltyIdx])
+
+
+class BatchMazeGame(MazeGame):
+    def __init__(self, numGames, gridSize = 5, holesCoord = None, seed = None):
+        # numGames independent games stepped together. each game is kept as its location, transitions of (loc, a) are tabled from MazeGame
+        super(BatchMazeGame, self).__init__(gridSize=gridSize, holesCoord=holesCoord)
+        self.numGames = numGames
+        self.rng = np.random.RandomState(seed)
+
+        numLocs = self.stateSize
+        self.moveLoc = np.tile(np.arange(numLocs)[:, None], (1, self.numActions))
+        self.illigalMove = np.zeros((numLocs, self.numActions), dtype=bool)
+        for loc in range(self.gridSize * self.gridSize):
+            coord = self.idx2Coord(loc)
+            for a, move in self.moves.items():
+                newCoord = [coord[i] + move[i] for i in range(2)]
+                self.illigalMove[loc, a] = not all(0 <= c < self.gridSize for c in newCoord)
+                self.moveLoc[loc, a] = self.coord2Idx([min(max(c, 0), self.gridSize - 1) for c in newCoord])
+
+        self.isHole = np.zeros(numLocs, dtype=bool)
+        self.isHole[self.holesIdx] = True
+
+        self.validActionsMask = np.zeros((numLocs, self.numActions), dtype=bool)
+        self.realDistribution = np.zeros((numLocs, self.numActions, numLocs), dtype=float)
+        for loc in range(numLocs):
+            s = np.zeros(numLocs, dtype=int)
+            s[loc] = 1
+            self.validActionsMask[loc, MazeGame.ValidActions(self, s)] = True
+            for a in range(self.numActions):
+                self.realDistribution[loc, a] = MazeGame.RealDistribution(self, s, a)
+
+        # valid actions of each location are first numValid[loc] of validActionsTable[loc]
+        self.numValid = self.validActionsMask.sum(axis=1)
+        self.validActionsTable = np.argsort(~self.validActionsMask, axis=1, kind='stable')
+
+        self.oneHot = np.eye(numLocs, dtype=int)
+        self.newGame()
+
+    def newGame(self, games = None):
+        # new game for all games (or for games idx/mask). returns states of all games
+        if games is None:
+            games = np.arange(self.numGames)
+            self.locs = np.full(self.numGames, self.startingPntIdx, dtype=int)
+            self.counterPenalty = np.full(self.numGames, 5, dtype=int)
+            self.numSteps = np.zeros(self.numGames, dtype=int)
+        else:
+            self.locs[games] = self.startingPntIdx
+            self.counterPenalty[games] = 5
+            self.numSteps[games] = 0
+
+        return self.States(self.locs)
+
+    def Locs(self, s):
+        return s.argmax(axis=1)
+
+    def States(self, locs):
+        return self.oneHot[locs]
+
+    def step(self, s, a):
+        s_Locs, r, terminal = self.StepLocs(self.Locs(s), a)
+        return self.States(s_Locs), r, terminal
+
+    def StepLocs(self, locs, a):
+        # vectorized MazeGame.step on locations of all games
+        a = np.asarray(a, dtype=int)
+        self.numSteps += 1
+        r = np.zeros(self.numGames, dtype=float)
+
+        atTarget = locs == self.targetIdx
+        inPenalty = locs == self.penaltyIdx
+        timeOut = ~atTarget & (self.numSteps == self.maxSteps)
+        penaltyEnd = ~atTarget & ~timeOut & inPenalty & (self.counterPenalty == 0)
+        terminal = atTarget | timeOut | penaltyEnd
+        r[atTarget] = 1.0
+        r[timeOut | penaltyEnd] = -1.0
+
+        active = ~terminal
+        penaltyStep = active & inPenalty
+        r[penaltyStep] = self.reward_InPenaltyLoc
+        self.counterPenalty[penaltyStep] -= 1
+
+        success = self.rng.uniform(size=self.numGames) < self.successInMove
+        move = active & ~inPenalty & (a > self.action_doNothing) & (a < self.action_outFromPenalty) & success
+        outFromPenalty = active & inPenalty & (a == self.action_outFromPenalty) & success
+        r[move & self.illigalMove[locs, a]] = self.reward_IlligalMove
+
+        s_Locs = locs.copy()
+        s_Locs[move] = self.moveLoc[locs[move], a[move]]
+        s_Locs[outFromPenalty] = self.startingPntIdx
+
+        intoHole = active & (a != self.action_doNothing) & self.isHole[locs] & (self.rng.uniform(size=self.numGames) < self.intoWormHole)
+        s_Locs[intoHole] = self.penaltyIdx
+
+        self.locs = s_Locs
+        return s_Locs, r, terminal
+
+    def ValidActions(self, s):
+        # mask of valid actions for each game
+        return self.validActionsMask[self.Locs(s)]
+
+    def RandomValidActions(self, locs):
+        choice = (self.rng.uniform(size=len(locs)) * self.numValid[locs]).astype(int)
+        return self.validActionsTable[locs, choice]
+
+    def RealDistribution(self, s, a):
+        return self.realDistribution[self.Locs(s), a]
+
+
+def RunBatchGames(env, numSteps, ChooseActions = None, Learn = None):
+    # steps all games of env numSteps times (terminated games are restarted). actions are chosen by ChooseActions(s, validMask) (random valid if None),
+    # transitions of each step are passed to Learn(s, a, r, s_, terminal). states are created only when passed on.
+    # returns num of env steps and num of finished games
+    env.newGame()
+    numFinished = 0
+    statesNeeded = ChooseActions != None or Learn != None
+    for step in range(numSteps):
+        locs = env.locs
+        s = env.States(locs) if statesNeeded else None
+        if ChooseActions != None:
+            a = ChooseActions(s, env.validActionsMask[locs])
+        else:
+            a = env.RandomValidActions(locs)
+
+        s_Locs, r, terminal = env.StepLocs(locs, a)
+        if Learn != None:
+            Learn(s, a, r, env.States(s_Locs), terminal)
+
+        if terminal.any():
+            numFinished += np.count_nonzero(terminal)
+            env.newGame(terminal)
+
+    return numSteps * env.numGames, numFinished
+
+
+def BatchMazeGameEquals(numGames = 64, numSteps = 300, gridSize = 5, maxSteps = 100, seed = 0):
+    # BatchMazeGame.step vs. MazeGame.step of each game on the same random action sequences (invalid actions included, terminated games are restarted).
+    # success of moves and worm holes is made deterministic (probabilities 0 or 1) so both games take the same branches
+    rng = np.random.RandomState(seed)
+    for successInMove in [1.0, 0.0]:
+        for intoWormHole in [1.0, 0.0]:
+            batchEnv = BatchMazeGame(numGames, gridSize=gridSize, seed=seed)
+            envs = [MazeGame(gridSize=gridSize) for i in range(numGames)]
+            for env in [batchEnv] + envs:
+                env.successInMove = successInMove
+                env.intoWormHole = intoWormHole
+                env.maxSteps = maxSteps
+
+            s = batchEnv.newGame()
+            states = [env.newGame() for env in envs]
+            for step in range(numSteps):
+                a = rng.randint(0, batchEnv.numActions, numGames)
+                s_, r, terminal = batchEnv.step(s, a)
+                for i in range(numGames):
+                    s_Game, rGame, terminalGame = envs[i].step(states[i], a[i])
+                    if not (np.array_equal(s_[i], s_Game) and r[i] == rGame and terminal[i] == terminalGame):
+                        print("batch maze game differs from MazeGame: success in move =", successInMove, "into worm hole =", intoWormHole, "step =", step, "game =", i)
+                        return False
+
+                    states[i] = envs[i].newGame() if terminalGame else s_Game
+
+                if terminal.any():
+                    batchEnv.newGame(terminal)
+                s = batchEnv.States(batchEnv.locs)
+
+    return True
+
+
+def BenchmarkBatchMazeGame(numGames = 10000, numSteps = 200, gridSize = 10, numQTableSteps = 20):
+    # env steps per second of batch game vs. MazeGame, and QLearningTable learning throughput on batch game transitions
+    print("batch maze game equals MazeGame:", BatchMazeGameEquals(gridSize=gridSize))
+
+    env = MazeGame(gridSize=gridSize)
+    s = env.newGame()
+    start = time.time()
+    numSerialSteps = 20000
+    for i in range(numSerialSteps):
+        s, r, terminal = env.step(s, random.choice(env.ValidActions(s)))
+        if terminal:
+            s = env.newGame()
+    serialRate = numSerialSteps / (time.time() - start)
+
+    batchEnv = BatchMazeGame(numGames, gridSize=gridSize, seed=0)
+    start = time.time()
+    numEnvSteps, numFinished = RunBatchGames(batchEnv, numSteps)
+    batchRate = numEnvSteps / (time.time() - start)
+    print("serial steps/sec =", int(serialRate), "batch steps/sec =", int(batchRate), "(games =", numGames, ", finished games =", numFinished, ")")
+
+    from algo_qtable import QLearningTable
+    table = QLearningTable(QTableParams(batchEnv.stateSize, batchEnv.numActions), "", "", loadTable=False)
+    table.Reset()
+    learnDuration = [0.0]
+    def Learn(s, a, r, s_, terminal):
+        start = time.time()
+        table.learn(s, a, r, s_, terminal)
+        learnDuration[0] += time.time() - start
+
+    numEnvSteps, _ = RunBatchGames(batchEnv, numQTableSteps, Learn=Learn)
+    print("qtable learn transitions/sec =", int(numEnvSteps / learnDuration[0]))
+
+
+def CalcSPrimeTargets(ttable, numOutput, thresholdNumTransitions = 1):
+    # targets of all pairs as built by Filtered_DTN before incremental targets (CalcSPrime of each pair with more than threshold transitions)
+    numStates = ttable.NumStates()
+    sIds, aLearn = np.nonzero(ttable.actionCount[:numStates] > thresholdNumTransitions)
+    targets = {}
+    for sId, a in zip(sIds, aLearn):
+        row = ttable.TransitionMatrix(a).getrow(sId)
+
+        sPrime = np.zeros(numOutput)
+        allCount = 0
+        for s_Id, c in zip(row.indices, row.data):
+            if c > 0:
+                sPArray = ttable.registry.Decode(s_Id)
+                sPrime[sPArray > 0] = c
+                allCount += c
+
+        targets[(sId, a)] = sPrime / allCount
+
+    return targets
+
+
+def BenchmarkFilteredDTNTargets(numGames = 100, batchSize = 32, gridSize = 10, thresholdNumTransitions = 1):
+    # Filtered_DTN targets after each batch (maze of test2.Simulator) on the same table:
+    # update of touched pairs vs. regenerating all pairs vs. CalcSPrime of all pairs (targets before incremental update)
+    env = MazeGame(gridSize=gridSize, holesCoord=[])
+    ttable = TransitionTable(env.numActions, "", newTable=True)
+    incremental = TransitionTargets(ttable, 0, env.stateSize, thresholdNumTransitions)
+    full = TransitionTargets(ttable, 0, env.stateSize, thresholdNumTransitions)
+
+    incrementalDuration = 0.0
+    fullDuration = 0.0
+    calcSPrimeDuration = 0.0
+    numTransitions = 0
+    numBatches = 0
+    numEqualBatches = 0
+    for game in range(numGames):
+        sVec, aVec, s_Vec = [], [], []
+        s = env.newGame()
+        terminal = False
+        while not terminal:
+            a = random.choice(env.ValidActions(s))
+            s_, r, terminal = env.step(s, a)
+            sVec.append(s)
+            aVec.append(a)
+            s_Vec.append(s_)
+            s = s_
+
+        for i in range(0, len(aVec), batchSize):
+            sIds, s_Ids = ttable.learnBatch(np.array(sVec[i:i + batchSize]), aVec[i:i + batchSize], np.array(s_Vec[i:i + batchSize]))
+            numTransitions += len(sIds)
+
+            start = time.time()
+            incremental.Update(sIds, aVec[i:i + batchSize])
+            incrementalDuration += time.time() - start
+
+            start = time.time()
+            full.UpdateAll()
+            fullDuration += time.time() - start
+
+            start = time.time()
+            calcSPrimeTargets = CalcSPrimeTargets(ttable, env.stateSize, thresholdNumTransitions)
+            calcSPrimeDuration += time.time() - start
+
+            # incremental targets of pairs are compared after each batch with targets of CalcSPrime
+            sIdsLearn, aLearn, s_Learn = incremental.Targets()
+            equal = len(aLearn) == len(calcSPrimeTargets)
+            equal = equal and all((sId, a) in calcSPrimeTargets and np.allclose(calcSPrimeTargets[(sId, a)], target) for sId, a, target in zip(sIdsLearn, aLearn, s_Learn))
+            numBatches += 1
+            numEqualBatches += int(equal)
+
+    targets = {}
+    for sId, a, target in zip(*incremental.Targets()):
+        targets[(sId, a)] = target
+    equalFull = all(np.allclose(targets[(sId, a)], target) for sId, a, target in zip(*full.Targets())) and incremental.size == full.size
+
+    print("games =", numGames, "batch size =", batchSize, "transitions =", numTransitions, "pairs =", full.size)
+    print("targets equal to CalcSPrime in", numEqualBatches, "/", numBatches, "batches, equal to regenerate all:", equalFull)
+    print("incremental update =", "%.3f" % incrementalDuration, "sec, regenerate all =", "%.3f" % fullDuration, "sec, CalcSPrime of all pairs =", "%.3f" % calcSPrimeDuration, "sec")
+    return numEqualBatches == numBatches and equalFull
+
+
+if __name__ == "__main__":
+    BenchmarkBatchMazeGame()
+    BenchmarkFilteredDTNTargets()
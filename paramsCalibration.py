@@ -13,6 +13,7 @@ from utils_results import AvgResults
 from utils_results import ChangeName2NextResultFile
 
 from utils_history import GetHistoryFromFile
+from utils_history import HistoryFileExist
 from utils_history import JoinTransitions
 
 CURRENT_POPULATION_FILE_NAME = "gp_population.txt"
@@ -264,7 +265,7 @@ def ReadAllHistFile(configDict, agentName, runType, numEpisodesLoad):
     while numEpisodesLoad > currNumEpisodes and idxHistFile < maxHistFile:
         currFName = path + "_" + str(idxHistFile) + "/" + runType["history"] 
 
-        if os.path.isfile(currFName + ".gz"):
+        if HistoryFileExist(currFName):
             transitions = GetHistoryFromFile(currFName)
             if transitions != None:
                 currNumEpisodes += np.sum(transitions["terminal"])
@@ -275,7 +276,7 @@ def ReadAllHistFile(configDict, agentName, runType, numEpisodesLoad):
     idxHistFile = 0
     while numEpisodesLoad > currNumEpisodes and idxHistFile < maxHistFile:
         currFName = path + "_" + str(idxHistFile) + "/" + runType["history"] + "_last"
-        if os.path.isfile(currFName + ".gz"):
+        if HistoryFileExist(currFName):
             transitions = GetHistoryFromFile(currFName)
             if transitions != None:
                 currNumEpisodes += np.sum(transitions["terminal"])
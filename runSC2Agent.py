@@ -247,6 +247,9 @@ def start_agent(configDict=None, copy2Run=None, threadName="Thread"):
 
                     contRun = False
 
+        for dm in allDecisionMakers:
+            dm.Close()
+
 def run_assignment(gpActArg, populationIdx, instanceIdx):     
     cmd = ' '.join(sys.argv)
     cmd.replace(".\\", "")                                                        
@@ -440,28 +443,32 @@ def run_thread(agent, sess, display, players, numSteps):
 
     with sess.as_default(), sess.graph.as_default():
 
-        while RUN:
-            try:
+        try:
+            while RUN:
+                try:
 
-                agent_interface_format=sc2_env.AgentInterfaceFormat(feature_dimensions=sc2_env.Dimensions(screen=SCREEN_SIZE,minimap=MINIMAP_SIZE))
+                    agent_interface_format=sc2_env.AgentInterfaceFormat(feature_dimensions=sc2_env.Dimensions(screen=SCREEN_SIZE,minimap=MINIMAP_SIZE))
 
-                with sc2_env.SC2Env(map_name=flags.FLAGS.map,
-                                    players=players,
-                                    game_steps_per_episode=numSteps,
-                                    agent_interface_format=agent_interface_format,
-                                    visualize=display) as env:
-                    run_loop.run_loop([agent], env)
+                    with sc2_env.SC2Env(map_name=flags.FLAGS.map,
+                                        players=players,
+                                        game_steps_per_episode=numSteps,
+                                        agent_interface_format=agent_interface_format,
+                                        visualize=display) as env:
+                        run_loop.run_loop([agent], env)
 
             
-            except Exception as e:
-                print(e)
-                print(traceback.format_exc())
-                logging.error(traceback.format_exc())
+                except Exception as e:
+                    print(e)
+                    print(traceback.format_exc())
+                    logging.error(traceback.format_exc())
             
-            # remove crahsed terminal history
-            # agent.RemoveNonTerminalHistory()
-            global NUM_CRASHES
-            NUM_CRASHES += 1
+                # remove crahsed terminal history
+                # agent.RemoveNonTerminalHistory()
+                global NUM_CRASHES
+                NUM_CRASHES += 1
+        finally:
+            # thread stops using decision makers (inference server does not wait for its requests)
+            agent.GetDecisionMaker().EndThread()
 
 def plot_thread(agent, agent2Train, dir2Save, numTrials2Learn):
     statesIdx = flags.FLAGS.stateIdx2Check.split(",")
@@ -2,6 +2,7 @@ import tensorflow as tf
 import numpy as np
 import random
 import matplotlib.pyplot as plt
+from scipy import sparse
 
 from algo_qtable import QTableParams
 from algo_dqn import DQN_PARAMS
@@ -12,6 +13,7 @@ from algo_dtn import DTN_PARAMS
 from algo_dtn import DTN2
 from algo_dtn import DTN
 from algo_dtn import Filtered_DTN
+from algo_dtn import TrainDurationPer10K
 
 from maze_game import SimpleMazeGame
 from maze_game import MazeGame
@@ -257,7 +259,7 @@ class Simulator:
                 s_, r, t = self.env.step(s,a)
                 
                 self.dqn.learn(s, a, r, s_, t)
-                self.transitionTable.learn(str(s), a, str(s_))
+                self.transitionTable.learn(s, a, s_)
                 sumR += r
                 numSteps += 1
                 s = s_
@@ -270,8 +272,10 @@ class Simulator:
         for dtn in self.allDTN:
             dtn.end_run(toLearn, False, numRuns)
         
+        # durations are summed in ms with num of trained samples (rate per 10k samples is derived in GetDTNDuration)
         for i in range(len(self.allDTN)):
-            self.trainDuration[i] += self.allDTN[i].LastTrainDuration()
+            self.trainDuration[i] += self.allDTN[i].lastLearningTime
+            self.trainNumSamples[i] += self.allDTN[i].LastTrainNumSamples()
 
     def TestTransition(self, numTests, num2Print = 1, fTest = None):
         
@@ -313,23 +317,13 @@ class Simulator:
         outTransitionTable = np.zeros(self.env.stateSize, dtype = float)
 
         validTTable = False
-        sStr = str(s)
-        if sStr in self.transitionTable.table:
-            transition = self.transitionTable.table[sStr][0]
-            actionCount = self.transitionTable.table[sStr][1]
-            if actionCount[a] > 0:
-                validTTable = True
-
-                sumTransitionCount = actionCount[a]
-                states = list(transition.index)
-                for s_ in states:
-                    currStateCount = transition.ix[s_,a]
-                    if currStateCount > 0:
-                        modS_ = s_.replace("[", "")
-                        modS_ = modS_.replace("]", "")
-                        s_Array = np.fromstring(modS_, dtype=int, sep=' ')
-                        loc = (s_Array == 1).nonzero()[0][0] 
-                        outTransitionTable[loc] = currStateCount / sumTransitionCount
+        s_Ids, probs = self.transitionTable.TransitionProb(s, a)
+        if len(probs) > 0:
+            validTTable = True
+
+            s_Array = self.transitionTable.registry.DecodeBatch(s_Ids)
+            loc = (s_Array == 1).argmax(axis=1)
+            outTransitionTable[loc] = probs
         
         if not validTTable:
             outTransitionTable += 1.0 / self.env.stateSize
@@ -337,28 +331,27 @@ class Simulator:
         return outTransitionTable
 
     def TrainAccording2TTable(self):
-        states = list(self.transitionTable.table.keys())
+        registry = self.transitionTable.registry
         
 
-        for sStr in states:
-            if sStr != "TrialsData":
-                s = np.fromstring(sStr.replace("[", "").replace("]", ""), dtype=int, sep=' ')
-                actionCount = self.transitionTable.table[sStr][1]
-                for a in range(self.env.numActions):
-                    if actionCount[a] > 0:
-                        label = self.CalcDistTTable(s,a)
-                        
-                        for dtn in self.allDTN:
-                            if type(dtn) is DTN:
-                                dtn.NewExperience(s, a, label)
-                            else:
-                                for loc in range(len(label)):
-                                    s_ = np.zeros(len(label), int)
-                                    s_[loc] = 1
-                                    p = label[loc]
-
-                                    dtn.NewExperience(s, a, s_, p)
-                                
+        for sId in range(self.transitionTable.NumStates()):
+            s = registry.Decode(sId)
+            actionCount = self.transitionTable.actionCount[sId]
+            for a in range(self.env.numActions):
+                if actionCount[a] > 0:
+                    label = self.CalcDistTTable(s,a)
+                    
+                    for dtn in self.allDTN:
+                        if type(dtn) is DTN:
+                            dtn.NewExperience(s, a, label)
+                        else:
+                            for loc in range(len(label)):
+                                s_ = np.zeros(len(label), int)
+                                s_[loc] = 1
+                                p = label[loc]
+
+                                dtn.NewExperience(s, a, s_, p)
+                            
     
     def Reset(self):
         self.dqn.ResetAllData()
@@ -368,13 +361,17 @@ class Simulator:
         self.transitionTable.Reset()
 
         self.trainDuration = []
+        self.trainNumSamples = []
         self.saveDuration = []
         for i in range(len(self.allDTN)):
             self.trainDuration.append(0.0)
+            self.trainNumSamples.append(0)
             self.saveDuration.append(0.0)
 
     def GetDTNDuration(self):
-        return self.trainDuration, self.saveDuration
+        # train duration in ms per 10k samples
+        trainDurationPer10K = [TrainDurationPer10K(self.trainDuration[i], self.trainNumSamples[i]) for i in range(len(self.allDTN))]
+        return trainDurationPer10K, self.saveDuration
 
     def SaveDTN(self):
         for i in range(len(self.allDTN)):
@@ -382,6 +379,45 @@ class Simulator:
             self.saveDuration[i] += self.allDTN[i].LastSaveDuration()
 
 
+def DTNInputEquivalence(numSamples = 256, seed = 1, stateSize = 10, numActions = 5):
+    # one train step of DTN on the same batch from the same weights: tf.data pipeline with in-graph one-hot actions vs. fed csc_matrix one-hot actions
+    np.random.seed(seed)
+    s = np.random.randint(0, 2, (numSamples, stateSize)).astype(float)
+    a = np.random.randint(0, numActions, numSamples)
+    s_ = np.random.dirichlet(np.ones(stateSize), numSamples)
+
+    with tf.Graph().as_default():
+        tf.set_random_seed(seed)
+        dtnParams = DTN_PARAMS(stateSize, numActions, 0, stateSize, nn_Func=dtn_2LayersFunc)
+        dtn = DTN(dtnParams, "dtn_equivalence", directory = './test2/', loadNN = False)
+        allVars = tf.global_variables()
+        initVals = dtn.sess.run(allVars)
+
+        # pipeline path (batch taken by the train step is fetched with it)
+        dtn.trainInput.Init(dtn.sess, [s, a.astype(np.int32), s_])
+        batch, outPipeline, lossPipeline, _ = dtn.sess.run([dtn.trainInput.next, dtn.outputLayer, dtn.loss_op, dtn.train_op])
+        varsPipeline = dtn.sess.run(allVars)
+
+        # csc_matrix path from the same weights
+        for var, val in zip(allVars, initVals):
+            var.load(val, dtn.sess)
+
+        sBatch, aBatch, s_Batch = batch
+        size = len(aBatch)
+        actionInput = sparse.csc_matrix((np.ones(size, dtype = int), (np.arange(size), aBatch)), shape=(size, numActions)).toarray()
+        feedDict = {dtn.inputLayerState: sBatch, dtn.inputLayerActions: actionInput, dtn.outputTensor: s_Batch}
+        outSparse, lossSparse, _ = dtn.sess.run([dtn.outputLayer, dtn.loss_op, dtn.train_op], feed_dict=feedDict)
+        varsSparse = dtn.sess.run(allVars)
+
+        dtn.sess.close()
+
+    equalOut = np.allclose(outPipeline, outSparse)
+    equalLoss = np.allclose(lossPipeline, lossSparse)
+    equalVars = all(np.allclose(v1, v2) for v1, v2 in zip(varsPipeline, varsSparse))
+    print("dtn input equivalence: batch =", size, "outputs equal =", equalOut, "loss equal =", equalLoss, "(", "%.6f" % np.mean(lossPipeline), "vs", "%.6f" % np.mean(lossSparse), ") weights after train step equal =", equalVars)
+    return equalOut and equalLoss and equalVars
+
+
 def plot_mean_and_CI(mean, lb, ub, color_mean=None):
     # plot the shaded range of the confidence intervals
     plt.fill_between(range(mean.shape[0]), ub, lb, color=color_mean, alpha=.5)
@@ -393,6 +429,8 @@ if __name__ == "__main__":
     dtnParams = DTN_PARAMS(10, 5, 0, 10, outputGraph=True, nn_Func=dtn_2LayersFuncEmbedding)
     dtn = DTN(dtnParams, "dtn_2Layers", directory = './test2/maze_dtn_2Layers/')
 
+    DTNInputEquivalence()
+
     print("\n\nfinished\n\n")
     exit()
     dirName = "maze_game"
@@ -492,6 +530,7 @@ if __name__ == "__main__":
             fig.savefig(fMsePlotName)
 
         # sim.SaveDTN()   
+        # train duration is in ms per 10k samples, save duration is in ms
         # sumTrainDur, currSaveDur = sim.GetDTNDuration()
         
         # print(sumTrainDur)
@@ -515,7 +554,7 @@ if __name__ == "__main__":
         #     plt.plot(allRuns, trainDurationNP)
         #     plt.title("train duration")
         #     plt.legend(leg, loc='best')
-        #     plt.ylabel('[ms]')
+        #     plt.ylabel('[ms per 10k samples]')
         #     plt.xlabel('#runs')
         #     plt.subplot(2,1,2)
         #     plt.plot(allRuns, saveDurationNP)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+sparse = pytest.importorskip("scipy.sparse")
+
+from algo_dtn import DTN_PARAMS, DTN
+
+# train steps of the tf.data pipeline (in-graph one-hot actions) replayed with feed dicts (csc_matrix one-hot actions) from the same weights
+NUM_SAMPLES = 256
+NUM_EPOCHS = 2
+STATE_SIZE = 10
+NUM_ACTIONS = 5
+
+
+def OneHot(a, numActions):
+    size = len(a)
+    return sparse.csc_matrix((np.ones(size, dtype=int), (np.arange(size), a)), shape=(size, numActions)).toarray()
+
+
+def test_dtn_pipeline_matches_feed_dict(tmp_path):
+    np.random.seed(1)
+    s = np.random.randint(0, 2, (NUM_SAMPLES, STATE_SIZE)).astype(float)
+    a = np.random.randint(0, NUM_ACTIONS, NUM_SAMPLES)
+    s_ = np.random.dirichlet(np.ones(STATE_SIZE), NUM_SAMPLES)
+
+    sTest = np.random.randint(0, 2, (64, STATE_SIZE)).astype(float)
+    aTest = np.random.randint(0, NUM_ACTIONS, 64)
+
+    with tf.Graph().as_default():
+        tf.set_random_seed(1)
+        dtn = DTN(DTN_PARAMS(STATE_SIZE, NUM_ACTIONS, 0, STATE_SIZE), "dtn_input", str(tmp_path) + "/", loadNN=False)
+        allVars = tf.global_variables()
+        initVals = dtn.sess.run(allVars)
+
+        # pipeline path: batches taken by each train step are fetched with it
+        dtn.trainInput.Init(dtn.sess, [s, a.astype(np.int32), s_], NUM_EPOCHS)
+        batches, lossPipeline = [], []
+        while True:
+            try:
+                batch, loss, _ = dtn.sess.run([dtn.trainInput.next, dtn.loss_op, dtn.train_op])
+            except tf.errors.OutOfRangeError:
+                break
+            batches.append(batch)
+            lossPipeline.append(loss)
+        predictPipeline = dtn.sess.run(dtn.outputLayer, {dtn.inputLayerState: sTest, dtn.inputActions: aTest})
+
+        # feed dict path on the same batches from the same weights
+        for var, val in zip(allVars, initVals):
+            var.load(val, dtn.sess)
+
+        lossFeed = []
+        for sBatch, aBatch, s_Batch in batches:
+            feedDict = {dtn.inputLayerState: sBatch, dtn.inputLayerActions: OneHot(aBatch, NUM_ACTIONS), dtn.outputTensor: s_Batch}
+            loss, _ = dtn.sess.run([dtn.loss_op, dtn.train_op], feed_dict=feedDict)
+            lossFeed.append(loss)
+        predictFeed = dtn.sess.run(dtn.outputLayer, {dtn.inputLayerState: sTest, dtn.inputLayerActions: OneHot(aTest, NUM_ACTIONS)})
+
+        dtn.sess.close()
+
+    assert sum(len(batch[1]) for batch in batches) == NUM_SAMPLES * NUM_EPOCHS
+    for loss1, loss2 in zip(lossPipeline, lossFeed):
+        np.testing.assert_allclose(loss1, loss2, rtol=1e-5, atol=1e-7)
+    np.testing.assert_allclose(predictPipeline, predictFeed, rtol=1e-5, atol=1e-7)
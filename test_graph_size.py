@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from algo_dqn import DQN_PARAMS, DQN_WithTarget
+from algo_a3c import A3C_PARAMS, A3C
+
+# graph size should not change with repeated syncs and runs
+NUM_SYNCS = 10000
+
+
+def test_dqn_sync_and_end_run_graph_size(tmp_path):
+    graph = tf.Graph()
+    with graph.as_default():
+        params = DQN_PARAMS(4, 3, numTrials2CmpResults=5, outputGraph=False)
+        dqn = DQN_WithTarget(params, "dqn", str(tmp_path) + "/")
+        dqn.InitModel(tf.Session(graph=graph), resetModel=True)
+
+        values, _ = dqn.GetAllNNVars()
+        numOps = len(graph.get_operations())
+        for i in range(NUM_SYNCS):
+            dqn.CopyDqn2Target(i)
+            if i % 1000 == 0:
+                # saves a checkpoint
+                dqn.CopyTarget2Model(i)
+            dqn.AssignAllNNVars(values)
+            dqn.end_run(1.0)
+            dqn.CalcValueDqn()
+
+        assert len(graph.get_operations()) == numOps
+        assert dqn.ValueDqn() == 1.0
+        dqn.Close()
+
+
+def test_a3c_sync_and_end_run_graph_size(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    graph = tf.Graph()
+    with graph.as_default():
+        params = A3C_PARAMS(4, 3, outputGraph=False)
+        a3c = A3C(params, "a3c", str(tmp_path) + "/")
+        workerName = threading.current_thread().getName()
+        a3c.AddWorker(workerName)
+        a3c.InitModel(tf.Session(graph=graph), resetModel=True)
+
+        numOps = len(graph.get_operations())
+        for i in range(NUM_SYNCS):
+            a3c.CopyParams2AC("global_network", workerName)
+            a3c.CopyParams2AC("global_network", workerName, 0.01)
+            a3c.end_run(1.0)
+
+        assert len(graph.get_operations()) == numOps
+        assert a3c.NumRunsAgent(workerName) == NUM_SYNCS
+        a3c.sess.close()
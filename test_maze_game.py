@@ -0,0 +1,11 @@
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+pytest.importorskip("matplotlib")
+
+from maze_game import BatchMazeGameEquals
+
+
+def test_batch_maze_game_equals_maze_game():
+    assert BatchMazeGameEquals(numGames=32, numSteps=300, gridSize=5, maxSteps=100)
+    assert BatchMazeGameEquals(numGames=8, numSteps=200, gridSize=10, maxSteps=50, seed=1)
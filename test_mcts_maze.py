@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from algo_mcts import MCTS_PARAMS, MCTS
+
+# deterministic maze: actions chosen by search over a fully known model should be optimal by value iteration
+MAZE = ["....",
+        ".##.",
+        ".#..",
+        "...G"]
+MOVES = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+DISCOUNT = 0.95
+
+
+def MazeModel():
+    # all transitions of maze (moves into walls or out of maze stay in place), reward 1 for reaching goal
+    numRows, numCols = len(MAZE), len(MAZE[0])
+    free = [(row, col) for row in range(numRows) for col in range(numCols) if MAZE[row][col] != "#"]
+    s, a, r, s_, terminal = [], [], [], [], []
+    for row, col in free:
+        if MAZE[row][col] == "G":
+            continue
+        for action, (dRow, dCol) in enumerate(MOVES):
+            nextRow, nextCol = row + dRow, col + dCol
+            if (nextRow, nextCol) not in free:
+                nextRow, nextCol = row, col
+            isGoal = MAZE[nextRow][nextCol] == "G"
+            s.append([row, col])
+            a.append(action)
+            r.append(1.0 if isGoal else 0.0)
+            s_.append([nextRow, nextCol])
+            terminal.append(isGoal)
+
+    return np.array(s), np.array(a), np.array(r), np.array(s_), np.array(terminal)
+
+
+def ValueIteration(s, a, r, s_, terminal, numIterations = 200):
+    states = sorted(set(map(tuple, s)))
+    values = {state: 0.0 for state in states}
+    for i in range(numIterations):
+        q = {}
+        for state, action, reward, nextState, isTerminal in zip(map(tuple, s), a, r, map(tuple, s_), terminal):
+            q[(state, action)] = reward + (0.0 if isTerminal else DISCOUNT * values.get(nextState, 0.0))
+        values = {state: max(q[(state, action)] for action in range(len(MOVES))) for state in states}
+
+    return q, values
+
+
+def test_mcts_maze_action_matches_value_iteration(tmp_path):
+    np.random.seed(1)
+    s, a, r, s_, terminal = MazeModel()
+    q, values = ValueIteration(s, a, r, s_, terminal)
+
+    with tf.Graph().as_default():
+        params = MCTS_PARAMS(2, len(MOVES), discountFactor=DISCOUNT, numSimulations=2000, explorationConst=0.5, maxDepth=20)
+        params.outputGraph = False
+        mcts = MCTS(params, "mcts_maze", str(tmp_path) + "/")
+        # leaves are valued 0 (untrained dqn), actions are always chosen by search
+        mcts.LeafValues = lambda states, targetValues = False: np.zeros((len(states), len(MOVES)))
+        mcts.ExploreProb = lambda: 0.0
+
+        allActions = list(range(len(MOVES)))
+        # empty model: dqn values are used without search
+        action, actionValues = mcts.choose_action(np.array([0, 0]), allActions)
+        assert mcts.numSearches == 0 and np.all(actionValues == 0)
+
+        mcts.Observe(s, a, r, s_, terminal)
+        for state in values:
+            action, actionValues = mcts.choose_action(np.array(state), allActions)
+            bestValue = values[state]
+            assert np.isclose(q[(state, action)], bestValue), (state, action, [q[(state, i)] for i in allActions])
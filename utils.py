@@ -9,6 +9,17 @@ from pysc2.lib.units import Terran
 
 import numpy as np
 
+# groups of connected pixels (vectorized labeling)
+from utils_components import CenterPoints
+from utils_components import Grouping
+from utils_components import ScreenUnits
+from utils_components import UnitTypesLut
+
+# vectorized search of buildings locations
+from utils_placement import BuildingLocation
+from utils_placement import MiniMapBuildingLocation
+from utils_placement import TypesLut
+
 #base class for all shared data classes
 class EmptySharedData:
     def __init__(self):
@@ -105,7 +116,7 @@ class BaseAgent(base_agent.BaseAgent):
 # params base
 class ParamsBase:
     def __init__(self, stateSize, numActions, discountFactor = 0.95, accumulateHistory=True, maxReplaySize=500000, minReplaySize=1000, 
-                numTrials2Learn=None, numTrials2Save=100, saveOldHist=False):
+                numTrials2Learn=None, numTrials2Save=100, saveOldHist=False, syntheticRatio=0.0):
         self.stateSize = stateSize
         self.numActions = numActions
         self.discountFactor = discountFactor
@@ -119,7 +130,14 @@ class ParamsBase:
 
         self.normalizeRewards = False
         self.normalizeState = False
+        self.zScoreNormalization = False
         self.numRepeatsTerminalLearning = 0
+        # None = train on full replay sweep, else num of random minibatches drawn for each training round
+        self.numBatches2Train = None
+        self.prioritizedReplay = False
+        self.numCheckpoints2Keep = 3
+        # num of synthetic transitions (sampled from transitions model) inserted to replay for each real transition (0 = no planning)
+        self.syntheticRatio = syntheticRatio
 
 class SC2_Params:
     # minimap feature
@@ -276,6 +294,8 @@ class TerranUnit:
     for flying in FLYING_BUILDINGS:
         BLOCKING_TYPE[flying] = False     
 
+    BLOCKING_LUT = TypesLut(BLOCKING_TYPE)
+
     # building specific:
     class BuildingDetails:
         def __init__(self,name, screenPixels, screenPixels1Axis, char4Print, miniMapSize, sc2Action = None):
@@ -330,7 +350,56 @@ class TerranUnit:
         UNIT_CHAR[gas] = 'g'
     for army in ARMY[:]:
         UNIT_CHAR[army] = 'a'
-        
+
+    # unit types extracted from screen by ObservationFeatures.ScreenUnits
+    SCREEN_UNITS_LUT = UnitTypesLut(ARMY + BUILDINGS + list(ARMY_SPEC.keys()) + list(BUILDING_SPEC.keys()))
+
+
+class ObservationFeatures:
+    def __init__(self, obs):
+        # features derived from the observation of a single step (masks of feature layers, their nonzero indices and screen units).
+        # created once for each step by the super agent and shared by all sub agents through shared data.
+        # features are calculated on first request and should not be changed by agents
+        self.screen = obs.observation["feature_screen"]
+        self.minimap = obs.observation["feature_minimap"]
+        self.features = {}
+        # duration of features calculation
+        self.duration = 0.0
+
+    def Feature(self, key, Calc):
+        if key not in self.features:
+            start = time.time()
+            self.features[key] = Calc()
+            self.duration += time.time() - start
+
+        return self.features[key]
+
+    def ScreenMask(self, layer, value, equal = True):
+        return self.Feature(("screen", layer, value, equal), lambda: self.screen[layer] == value if equal else self.screen[layer] != value)
+
+    def MinimapMask(self, layer, value, equal = True):
+        return self.Feature(("minimap", layer, value, equal), lambda: self.minimap[layer] == value if equal else self.minimap[layer] != value)
+
+    def ScreenNonzero(self, layer, value):
+        mask = self.ScreenMask(layer, value)
+        return self.Feature(("screen_nonzero", layer, value), lambda: mask.nonzero())
+
+    def MinimapNonzero(self, layer, value):
+        mask = self.MinimapMask(layer, value)
+        return self.Feature(("minimap_nonzero", layer, value), lambda: mask.nonzero())
+
+    def UnitTypeCounts(self):
+        # num of screen pixels of each unit type
+        return self.Feature("unit_type_counts", lambda: np.bincount(self.screen[SC2_Params.UNIT_TYPE].ravel()))
+
+    def NumPixels(self, unitTypes):
+        counts = self.UnitTypeCounts()
+        return sum(int(counts[unit]) for unit in unitTypes if unit < len(counts))
+
+    def ScreenUnits(self):
+        # components of all (player, unit type) of screen
+        return self.Feature("screen_units", lambda: ScreenUnits(self.screen[SC2_Params.PLAYER_RELATIVE], self.screen[SC2_Params.UNIT_TYPE], TerranUnit.SCREEN_UNITS_LUT))
+
 
 def GetUnitId(name):
     for uId, unit in TerranUnit.ARMY_SPEC.items():
@@ -513,20 +582,6 @@ def BlockingType(unit):
     return TerranUnit.BLOCKING_TYPE[unit]
 
 
-def HaveSpaceMiniMap(occupyMat, heightsMap, yStart, xStart, neededSize):
-    height = heightsMap[yStart][xStart]
-    if height == 0:
-        return False
-
-    yEnd = min(yStart + neededSize, SC2_Params.MINIMAP_SIZE)
-    xEnd = min(xStart + neededSize, SC2_Params.MINIMAP_SIZE)
-    for y in range (yStart, yEnd):
-        for x in range (xStart, xEnd):
-            if occupyMat[y][x] or height != heightsMap[y][x]:
-                return False
-    
-    return True
-
 def PrintMiniMap(obs, cameraCornerNorthWest, cameraCornerSouthEast):
     selfPnt_y, selfPnt_x = (obs.observation['feature_minimap'][SC2_Params.PLAYER_RELATIVE] == SC2_Params.PLAYER_SELF).nonzero()
     enemyPnt_y, enemyPnt_x = (obs.observation['feature_minimap'][SC2_Params.PLAYER_RELATIVE] == SC2_Params.PLAYER_HOSTILE).nonzero()
@@ -601,34 +656,8 @@ def GetLocationForBuildingMiniMap(obs, commandCenterLoc, buildingType):
     occupyMat = obs.observation['feature_minimap'][SC2_Params.PLAYER_RELATIVE_MINIMAP] > 0
     neededSize = TerranUnit.BUILDING_SPEC[buildingType].miniMapSize
 
-    location = [-1, -1]
-    minDist = SC2_Params.MAX_MINIMAP_DIST
-    for y in range(0, SC2_Params.MINIMAP_SIZE - neededSize):
-        for x in range(0, SC2_Params.MINIMAP_SIZE - neededSize):
-            foundLoc = HaveSpaceMiniMap(occupyMat, height_map, y, x, neededSize)       
-            if foundLoc:
-                currLocation = [y + int(neededSize / 2), x + int(neededSize / 2)]
-                currDist = DistForCmp(currLocation, commandCenterLoc)
-                if currDist < minDist:
-                    location = currLocation
-                    minDist = currDist
-
-
-
-    return location
-
-def BlockingResourceGather(unitType, y, x, ccMat, nonAllowedDirections2CC, maxCC):
-    if x > maxCC[SC2_Params.X_IDX] or y > maxCC[SC2_Params.Y_IDX]:
-        return False
-
-    jump = 5
-    for direction in nonAllowedDirections2CC:
-        x2Check = x + direction[SC2_Params.X_IDX] * jump
-        y2Check = y + direction[SC2_Params.Y_IDX] * jump
-        if ccMat[y2Check][x2Check]:
-            return True
-    
-    return False
+    # all footprints are tested at once, nearest free and flat footprint to command center is returned
+    return MiniMapBuildingLocation(occupyMat, height_map, neededSize, commandCenterLoc, SC2_Params.MAX_MINIMAP_DIST)
 
 def GetLocationForBuilding(obs, buildingType, notAllowedDirections2CC = [], nonValidCoord = [], additionType = None):
     unitType = obs.observation['feature_screen'][SC2_Params.UNIT_TYPE]
@@ -636,9 +665,6 @@ def GetLocationForBuilding(obs, buildingType, notAllowedDirections2CC = [], nonV
         return GetLocationForOilRefinery(unitType)
 
     ccMat = unitType == Terran.CommandCenter
-    hasCC = ccMat.any()
-    if hasCC:
-        maxCC = np.max(ccMat.nonzero(), axis=1)
 
     neededSizeY = TerranUnit.BUILDING_SPEC[buildingType].screenPixels1Axis
     neededSizeX = neededSizeY
@@ -647,43 +673,8 @@ def GetLocationForBuilding(obs, buildingType, notAllowedDirections2CC = [], nonV
 
     cameraHeightMap = obs.observation['feature_screen'][SC2_Params.HEIGHT_MAP]
 
-    foundLoc = False
-    location = [-1, -1]
-    freeMat = np.zeros((SC2_Params.SCREEN_SIZE, SC2_Params.SCREEN_SIZE), int)
-    for y in range(SC2_Params.SCREEN_SIZE):
-        for x in range(SC2_Params.SCREEN_SIZE): 
-            if TerranUnit.BLOCKING_TYPE[unitType[y][x]] or InNonValidCoord(y, x, nonValidCoord):
-                freeMat[y,x] = -1
-            elif hasCC and BlockingResourceGather(unitType, y, x, ccMat, notAllowedDirections2CC, maxCC):
-                freeMat[y,x] = -1
-            else:
-
-                freeMat[y,x] = cameraHeightMap[y][x]
-
-            yStart = y - neededSizeY + 1
-            xStart = x - neededSizeX + 1
-            
-            if yStart >= 0 and xStart >= 0:
-                yEnd = yStart + neededSizeY
-                xEnd = xStart + neededSizeX
-                heightVal = cameraHeightMap[yStart][xStart]
-                if heightVal > 0:
-                    foundLoc = (freeMat[yStart:yEnd, xStart:xEnd] == heightVal).all()
-                    if foundLoc:
-                        location = [yStart + int(neededSizeY / 2), xStart + int(neededSizeX / 2)]
-                        break
-                        
-        if foundLoc:
-            break
-
-    return location
-
-def InNonValidCoord(y, x, nonValidCoord):
-    for c in nonValidCoord:
-        if c[SC2_Params.X_IDX] == x and c[SC2_Params.Y_IDX] == y:
-            return True
-
-    return False
+    # all footprints are tested at once, first free and flat footprint by scan order is returned
+    return BuildingLocation(unitType, cameraHeightMap, TerranUnit.BLOCKING_LUT, ccMat, neededSizeY, neededSizeX, notAllowedDirections2CC, nonValidCoord)
 
 def GetLocationForOilRefinery(unitType):
     refMat = unitType == Terran.Refinery
@@ -746,82 +737,6 @@ def FindBuildingRightEdge(unitType, buildingType, point):
 
     return y,x
 
-def CenterPoints(y, x, numPixels1Unit = 1):
-    groups = Grouping(y, x)
-    def Avg(group):
-        sumG = [0,0]
-        for p in group:
-            sumG[0] += p[0]
-            sumG[1] += p[1]
-
-        return [int(sumG[0] / len(group)), int(sumG[1] / len(group))]
-    
-    points= []
-    groupSizes = []
-    for g in groups:
-        pnt = Avg(g)
-        points.append(pnt)
-        groupSizes.append(math.ceil(len(g) / numPixels1Unit))
-
-    
-    return points, groupSizes
-
-def Grouping(y, x):
-
-    groups = []  
-    def inGroup(groups, pnt):
-        for g in groups:
-            if pnt in g:
-                return True
-        return False
-
-    def isNearGroup(g, pnt):
-        for p in g:
-            diff = abs(p[0] - pnt[0]) + abs(p[1] - pnt[1])
-            if diff == 1:
-                return True
-        return False
-
-    def nearGroup(groups, pnt):
-        for i in range(len(groups)):
-            if isNearGroup(groups[i],pnt):
-                return i
-        return -1
-        
-    for i in range(0, len(y)):
-        pnt = [y[i], x[i]]
-        if not inGroup(groups, pnt):
-            g = nearGroup(groups, pnt)
-            if g >= 0 :
-                groups[g].append(pnt)
-            else:
-                groups.append([pnt])
-
-    def toJoin(g1, g2):
-        for p in g1:
-            if isNearGroup(g2,p):
-                return True
-        return False
-
-    joinedGroup = True
-    while joinedGroup:
-        toRemove = []
-        for i in range(len(groups)):
-            for j in range(i + 1,len(groups)):
-                if toJoin(groups[i], groups[j]):
-                    groups[i] += groups[j]
-                    toRemove.append(j)
-
-        
-        joinedGroup = len(toRemove) > 0
-        newGroups = []
-        for i in range(len(groups)):
-            if i not in toRemove:
-                newGroups.append(groups[i].copy())
-        groups = newGroups
-
-    return groups
-
 neighbors2CheckBuilding = []
 
 neighbors2CheckBuilding.append([-1,-2])
@@ -0,0 +1,118 @@
+import numpy as np
+import time
+
+from collections import OrderedDict
+
+from multiprocessing import Lock
+from utils import EmptyLock
+
+
+class ActionValuesCache():
+    def __init__(self, maxSize = 10000, isMultiThreaded = False):
+        # lru cache of network outputs keyed by bytes of input state.
+        # values are valid for the generation they were calculated in (generation is bumped when network changes)
+        self.maxSize = maxSize
+        self.lock = Lock() if isMultiThreaded else EmptyLock()
+
+        self.generation = 0
+        self.entries = OrderedDict()
+        self.entriesBytes = 0
+
+        self.numHits = 0
+        self.numMisses = 0
+
+    def Key(self, state):
+        state = np.ascontiguousarray(state)
+        return state.dtype.str.encode() + state.tobytes()
+
+    def Get(self, state):
+        key = self.Key(state)
+        self.lock.acquire()
+        entry = self.entries.get(key)
+        if entry != None and entry[0] == self.generation:
+            self.entries.move_to_end(key)
+            self.numHits += 1
+            self.lock.release()
+            return entry[1].copy()
+
+        self.numMisses += 1
+        self.lock.release()
+        return None
+
+    def Put(self, state, values, generation):
+        # values calculated in older generation are not inserted
+        key = self.Key(state)
+        values = np.array(values)
+        self.lock.acquire()
+        if generation == self.generation:
+            old = self.entries.pop(key, None)
+            if old != None:
+                self.entriesBytes -= len(key) + old[1].nbytes
+
+            self.entries[key] = (generation, values)
+            self.entriesBytes += len(key) + values.nbytes
+            while len(self.entries) > self.maxSize:
+                oldKey, oldEntry = self.entries.popitem(last=False)
+                self.entriesBytes -= len(oldKey) + oldEntry[1].nbytes
+
+        self.lock.release()
+
+    def Generation(self):
+        return self.generation
+
+    def Invalidate(self):
+        self.lock.acquire()
+        self.generation += 1
+        self.entries.clear()
+        self.entriesBytes = 0
+        self.lock.release()
+
+    def Stats(self):
+        # hit rate, num of lookups, num of entries and memory of entries (bytes)
+        self.lock.acquire()
+        numLookups = self.numHits + self.numMisses
+        hitRate = self.numHits / numLookups if numLookups > 0 else 0.0
+        stats = {"hitRate": hitRate, "numLookups": numLookups, "numEntries": len(self.entries), "memoryBytes": self.entriesBytes, "generation": self.generation}
+        self.lock.release()
+        return stats
+
+    def ResetStats(self):
+        self.lock.acquire()
+        self.numHits = 0
+        self.numMisses = 0
+        self.lock.release()
+
+
+def BenchmarkActionValuesCache(numSteps = 100000, numDistinctStates = 2000, stateSize = 51, numActions = 5, evalDuration = 0.0002, cacheSize = 10000):
+    # steps on repeating states (as army attack grids) with simulated target evaluation
+    weights = np.random.uniform(size=(stateSize, numActions))
+    states = np.random.randint(0, 4, size=(numDistinctStates, stateSize)).astype(float)
+    # repeating states are drawn with zipf like frequency
+    freq = 1.0 / np.arange(1, numDistinctStates + 1)
+    stepStates = np.random.choice(numDistinctStates, numSteps, p=freq / freq.sum())
+
+    def Eval(state):
+        time.sleep(evalDuration)
+        return np.matmul(state.reshape(1, stateSize), weights)[0]
+
+    start = time.time()
+    for i in stepStates[:numSteps // 10]:
+        Eval(states[i])
+    noCacheDuration = (time.time() - start) * 10
+
+    cache = ActionValuesCache(cacheSize)
+    start = time.time()
+    for i in stepStates:
+        vals = cache.Get(states[i])
+        if vals is None:
+            generation = cache.Generation()
+            cache.Put(states[i], Eval(states[i]), generation)
+    cacheDuration = time.time() - start
+
+    stats = cache.Stats()
+    print("steps =", numSteps, "no cache =", "%.2f" % noCacheDuration, "sec (estimated), cache =", "%.2f" % cacheDuration, "sec, hit rate =", "%.3f" % stats["hitRate"],
+            "entries =", stats["numEntries"], "memory =", int(stats["memoryBytes"] / 1024), "KB")
+
+
+if __name__ == "__main__":
+    BenchmarkActionValuesCache()
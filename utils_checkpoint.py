@@ -0,0 +1,123 @@
+import os
+import atexit
+import threading
+
+import tensorflow as tf
+
+
+class CheckpointWriter():
+    def __init__(self, variables, savePath, numCheckpoints2Keep = 3, counterVar = None):
+        # checkpoints are written from in-memory snapshot of variables by a background thread.
+        # training session is used only for reading the snapshot
+        self.variables = variables
+        self.savePath = savePath
+        self.directory, self.name = os.path.split(savePath)
+        self.latestFileName = self.name + "_checkpoint"
+
+        varNames = [var.name for var in variables]
+        self.counterIdx = varNames.index(counterVar.name) if counterVar != None else None
+
+        # shadow variables with the same names in separate graph (checkpoints are restored to original variables)
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.placeholders = []
+            assignOps = []
+            shadowVars = {}
+            for var in variables:
+                dtype = var.dtype.base_dtype
+                shadow = tf.Variable(tf.zeros(var.get_shape(), dtype=dtype), name=var.op.name, trainable=False)
+                placeholder = tf.placeholder(dtype, var.get_shape())
+                assignOps.append(shadow.assign(placeholder))
+                self.placeholders.append(placeholder)
+                shadowVars[var.op.name] = shadow
+
+            self.assignOp = tf.group(*assignOps)
+            self.saver = tf.train.Saver(var_list=shadowVars, max_to_keep=numCheckpoints2Keep)
+            initOp = tf.global_variables_initializer()
+
+        self.sess = tf.Session(graph=self.graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+        self.sess.run(initOp)
+
+        # single pending snapshot: newer snapshot replaces snapshot not written yet
+        self.pending = None
+        self.pendingLock = threading.Lock()
+        self.pendingEvent = threading.Event()
+        self.idleEvent = threading.Event()
+        self.idleEvent.set()
+        self.stop = False
+
+        self.thread = threading.Thread(target=self.WriteLoop, name=self.name + "_checkpointWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+        atexit.register(self.Flush)
+
+    def Snapshot(self, sess, counterVal = None):
+        values = sess.run(self.variables)
+        if self.counterIdx != None:
+            if counterVal != None:
+                values[self.counterIdx] = counterVal
+            else:
+                counterVal = values[self.counterIdx]
+
+        self.pendingLock.acquire()
+        self.pending = (values, counterVal)
+        self.idleEvent.clear()
+        self.pendingEvent.set()
+        self.pendingLock.release()
+
+        return counterVal
+
+    def WriteLoop(self):
+        while True:
+            self.pendingEvent.wait()
+
+            self.pendingLock.acquire()
+            if self.pending == None:
+                # woken by Close with no snapshot left
+                self.pendingLock.release()
+                return
+
+            values, counterVal = self.pending
+            self.pending = None
+            if not self.stop:
+                self.pendingEvent.clear()
+            self.pendingLock.release()
+
+            try:
+                self.sess.run(self.assignOp, dict(zip(self.placeholders, values)))
+                self.saver.save(self.sess, self.savePath, global_step=counterVal, latest_filename=self.latestFileName, write_meta_graph=False)
+            except Exception as e:
+                print("\n\nError in writing checkpoint", self.savePath, ":", e, "\n\n")
+
+            self.pendingLock.acquire()
+            if self.pending == None:
+                self.idleEvent.set()
+            self.pendingLock.release()
+
+    def Flush(self):
+        # wait until last snapshot is written
+        self.idleEvent.wait()
+
+    def Close(self):
+        # pending snapshot is written, then thread is stopped and session is closed
+        if self.thread == None:
+            return
+
+        self.pendingLock.acquire()
+        self.stop = True
+        self.pendingEvent.set()
+        self.pendingLock.release()
+
+        self.thread.join()
+        self.thread = None
+        self.sess.close()
+        atexit.unregister(self.Flush)
+
+    def LatestCheckpoint(self):
+        checkpoint = tf.train.latest_checkpoint(self.directory if self.directory != "" else ".", self.latestFileName)
+        if checkpoint == None and os.path.isfile(self.savePath + ".meta"):
+            # checkpoint saved by synchronous saver
+            checkpoint = self.savePath
+
+        return checkpoint
@@ -0,0 +1,307 @@
+import math
+import time
+
+import numpy as np
+
+from scipy import ndimage
+
+
+def LabelMask(y, x):
+    # 4 neighbours labeling of points mask (mask covers bounding box of points). returns labels image, offset of image,
+    # rank of each label by its first point and num of components
+    minY, minX = y.min(), x.min()
+    mask = np.zeros((y.max() - minY + 1, x.max() - minX + 1), dtype=bool)
+    mask[y - minY, x - minX] = True
+    labels, numComponents = ndimage.label(mask)
+
+    _, firstIdx = np.unique(labels[y - minY, x - minX], return_index=True)
+    rank = np.zeros(numComponents + 1, dtype=int)
+    rank[1:] = np.argsort(np.argsort(firstIdx))
+    return labels, (minY, minX), rank, numComponents
+
+
+def LabelComponents(y, x):
+    # 4 neighbours connected components of points. returns component of each point (components are numbered by order of their first point)
+    # and num of components
+    y = np.asarray(y, dtype=int)
+    x = np.asarray(x, dtype=int)
+    if len(y) == 0:
+        return np.zeros(0, dtype=int), 0
+
+    labels, (minY, minX), rank, numComponents = LabelMask(y, x)
+    return rank[labels[y - minY, x - minX]], numComponents
+
+
+def ComponentsStats(y, x):
+    # centers (int average of y and x) and num of pixels of each component in a single pass (repeating points are counted once)
+    y = np.asarray(y, dtype=int)
+    x = np.asarray(x, dtype=int)
+    if len(y) == 0:
+        return np.zeros((0, 2), dtype=int), np.zeros(0, dtype=int)
+
+    labels, (minY, minX), rank, numComponents = LabelMask(y, x)
+    pixelsY, pixelsX = labels.nonzero()
+    components = rank[labels[pixelsY, pixelsX]]
+    counts = np.bincount(components, minlength=numComponents)
+    sumY = np.bincount(components, weights=pixelsY, minlength=numComponents).astype(int) + minY * counts
+    sumX = np.bincount(components, weights=pixelsX, minlength=numComponents).astype(int) + minX * counts
+
+    centers = np.stack((sumY, sumX), axis=1) // counts[:, None]
+    return centers, counts
+
+
+def CenterPoints(y, x, numPixels1Unit = 1):
+    # center of each group of connected pixels and num of units in group (by num of pixels of single unit)
+    centers, counts = ComponentsStats(y, x)
+    sizes = np.ceil(counts / numPixels1Unit).astype(int)
+    return centers.tolist(), sizes.tolist()
+
+
+def Grouping(y, x):
+    # points of each group of connected pixels
+    y = np.asarray(y, dtype=int)
+    x = np.asarray(x, dtype=int)
+    labels, numComponents = LabelComponents(y, x)
+    groups = [[] for i in range(numComponents)]
+    if numComponents == 0:
+        return groups
+
+    _, unique = np.unique(np.stack((y, x)), axis=1, return_index=True)
+    unique.sort()
+    for label, pntY, pntX in zip(labels[unique].tolist(), y[unique].tolist(), x[unique].tolist()):
+        groups[label].append([pntY, pntX])
+
+    return groups
+
+
+def UnitTypesLut(unitTypes):
+    # lut of unit type -> class index of unit (0 for untracked types, types above the tracked are mapped to the last untracked entry)
+    lut = np.zeros(max(unitTypes) + 2, dtype=int)
+    for i, unit in enumerate(unitTypes):
+        if lut[unit] == 0:
+            lut[unit] = i + 1
+
+    return lut
+
+
+class ScreenUnits():
+    def __init__(self, playerType, unitType, unitTypesLut, numPlayers = 5):
+        # 4 neighbours connected components of all (player, unit type) classes of screen by a single labeling.
+        # pixels are labeled on a grid of double resolution where neighbours are linked only if they are of the same class
+        self.lut = unitTypesLut
+        self.numPlayers = numPlayers
+
+        unitIdx = self.lut[np.minimum(unitType, len(self.lut) - 1)]
+        classMap = np.where(unitIdx > 0, unitIdx * numPlayers + playerType, 0)
+        tracked = classMap > 0
+
+        height, width = classMap.shape
+        grid = np.zeros((2 * height - 1, 2 * width - 1), dtype=bool)
+        grid[::2, ::2] = tracked
+        grid[::2, 1::2] = tracked[:, :-1] & (classMap[:, :-1] == classMap[:, 1:])
+        grid[1::2, ::2] = tracked[:-1, :] & (classMap[:-1, :] == classMap[1:, :])
+        labels, numComponents = ndimage.label(grid)
+
+        # components of each class are ordered by their first pixel (as in CenterPoints of the class pixels)
+        y, x = tracked.nonzero()
+        pixelLabels = labels[2 * y, 2 * x]
+        _, firstIdx = np.unique(pixelLabels, return_index=True)
+        componentClass = classMap[y[firstIdx], x[firstIdx]]
+        order = np.lexsort((firstIdx, componentClass))
+        rank = np.zeros(numComponents + 1, dtype=int)
+        rank[order + 1] = np.arange(numComponents)
+
+        components = rank[pixelLabels]
+        self.componentClass = componentClass[order]
+        self.counts = np.bincount(components, minlength=numComponents)
+        self.sumY = np.bincount(components, weights=y, minlength=numComponents).astype(int)
+        self.sumX = np.bincount(components, weights=x, minlength=numComponents).astype(int)
+
+    def Class(self, player, unit):
+        unitIdx = self.lut[unit] if unit < len(self.lut) else 0
+        return unitIdx * self.numPlayers + player if unitIdx > 0 else -1
+
+    def Range(self, player, unit):
+        cls = self.Class(player, unit)
+        if cls < 0:
+            return 0, 0
+
+        return np.searchsorted(self.componentClass, cls, side='left'), np.searchsorted(self.componentClass, cls, side='right')
+
+    def Components(self, player, unit):
+        # centers and num of pixels of components of (player, unit)
+        start, end = self.Range(player, unit)
+        counts = self.counts[start:end]
+        centers = np.stack((self.sumY[start:end], self.sumX[start:end]), axis=1) // np.maximum(counts, 1)[:, None]
+        return centers, counts
+
+    def CenterPoints(self, player, unit, numPixels1Unit = 1):
+        centers, counts = self.Components(player, unit)
+        sizes = np.ceil(counts / numPixels1Unit).astype(int)
+        return centers.tolist(), sizes.tolist()
+
+    def NumPixels(self, player, unit):
+        start, end = self.Range(player, unit)
+        return int(self.counts[start:end].sum())
+
+    def UnitsCenter(self, player, units):
+        # int average of all pixels of (player, unit) for units (None if there are no pixels)
+        numPixels, sumY, sumX = 0, 0, 0
+        for unit in units:
+            start, end = self.Range(player, unit)
+            numPixels += int(self.counts[start:end].sum())
+            sumY += int(self.sumY[start:end].sum())
+            sumX += int(self.sumX[start:end].sum())
+
+        return [int(sumY / numPixels), int(sumX / numPixels)] if numPixels > 0 else None
+
+
+def GroupingLoops(y, x):
+    # reference grouping by pixels scans (previous implementation of utils.Grouping)
+    groups = []
+    def inGroup(groups, pnt):
+        for g in groups:
+            if pnt in g:
+                return True
+        return False
+
+    def isNearGroup(g, pnt):
+        for p in g:
+            diff = abs(p[0] - pnt[0]) + abs(p[1] - pnt[1])
+            if diff == 1:
+                return True
+        return False
+
+    def nearGroup(groups, pnt):
+        for i in range(len(groups)):
+            if isNearGroup(groups[i],pnt):
+                return i
+        return -1
+
+    for i in range(0, len(y)):
+        pnt = [y[i], x[i]]
+        if not inGroup(groups, pnt):
+            g = nearGroup(groups, pnt)
+            if g >= 0 :
+                groups[g].append(pnt)
+            else:
+                groups.append([pnt])
+
+    def toJoin(g1, g2):
+        for p in g1:
+            if isNearGroup(g2,p):
+                return True
+        return False
+
+    joinedGroup = True
+    while joinedGroup:
+        toRemove = []
+        for i in range(len(groups)):
+            for j in range(i + 1,len(groups)):
+                if toJoin(groups[i], groups[j]):
+                    groups[i] += groups[j]
+                    toRemove.append(j)
+
+
+        joinedGroup = len(toRemove) > 0
+        newGroups = []
+        for i in range(len(groups)):
+            if i not in toRemove:
+                newGroups.append(groups[i].copy())
+        groups = newGroups
+
+    return groups
+
+
+def CenterPointsLoops(y, x, numPixels1Unit = 1):
+    groups = GroupingLoops(y, x)
+    points = []
+    groupSizes = []
+    for g in groups:
+        points.append([int(sum(p[0] for p in g) / len(g)), int(sum(p[1] for p in g) / len(g))])
+        groupSizes.append(math.ceil(len(g) / numPixels1Unit))
+
+    return points, groupSizes
+
+
+def CrowdedScreen(numUnits, screenSize = 84, maxRadius = 3):
+    # screen of units as discs of random radius
+    screen = np.zeros((screenSize, screenSize), dtype=bool)
+    yy, xx = np.mgrid[:screenSize, :screenSize]
+    for i in range(numUnits):
+        cy, cx = np.random.randint(0, screenSize, 2)
+        radius = np.random.randint(1, maxRadius + 1)
+        screen |= (yy - cy) ** 2 + (xx - cx) ** 2 <= radius * radius
+
+    return screen
+
+
+def BenchmarkCenterPoints(numUnitsList = [10, 40, 100], numScreens = 5, screenSize = 84):
+    # groups are compared as pixels sets (loops merge can insert pixels of a group absorbed twice in the same pass more than once)
+    for numUnits in numUnitsList:
+        loopsDuration = 0.0
+        labelDuration = 0.0
+        equalGroups = True
+        equalCenters = 0
+        for i in range(numScreens):
+            y, x = CrowdedScreen(numUnits, screenSize).nonzero()
+
+            start = time.time()
+            loopsResult = CenterPointsLoops(y, x, 5)
+            loopsDuration += time.time() - start
+
+            start = time.time()
+            labelResult = CenterPoints(y, x, 5)
+            labelDuration += time.time() - start
+
+            equalGroups &= [set(map(tuple, g)) for g in GroupingLoops(y, x)] == [set(map(tuple, g)) for g in Grouping(y, x)]
+            equalCenters += loopsResult == labelResult
+
+        print("units =", numUnits, "pixels =", len(y), "loops =", "%.2f" % (loopsDuration * 1000 / numScreens), "ms, labeling =",
+                "%.3f" % (labelDuration * 1000 / numScreens), "ms, equal groups:", equalGroups, ", equal centers in", equalCenters, "/", numScreens, "screens")
+
+
+def UnitsScreen(numUnitsList, numTypes, screenSize = 84, players = [1, 3, 4]):
+    # screen of discs of random (player, unit type), later discs overwrite earlier
+    playerType = np.zeros((screenSize, screenSize), dtype=int)
+    unitType = np.zeros((screenSize, screenSize), dtype=int)
+    for unit in range(1, numTypes + 1):
+        mask = CrowdedScreen(np.random.choice(numUnitsList), screenSize)
+        playerType[mask] = np.random.choice(players, size=mask.sum())
+        unitType[mask] = unit
+
+    return playerType, unitType
+
+
+def BenchmarkScreenUnits(numSteps = 50, numTypes = 30, numUnitsList = [0, 2, 5], screenSize = 84, players = [1, 4]):
+    # state creation of an agent (components of each tracked (player, unit type)) by masks of each class vs. single extraction
+    unitTypes = list(range(1, numTypes + 1))
+    lut = UnitTypesLut(unitTypes)
+    masksDuration = 0.0
+    extractorDuration = 0.0
+    equal = 0
+    for i in range(numSteps):
+        playerType, unitType = UnitsScreen(numUnitsList, numTypes, screenSize)
+
+        start = time.time()
+        masksResult = []
+        for player in players:
+            for unit in unitTypes:
+                y, x = ((playerType == player) & (unitType == unit)).nonzero()
+                masksResult.append(CenterPoints(y, x, 9))
+        masksDuration += time.time() - start
+
+        start = time.time()
+        screenUnits = ScreenUnits(playerType, unitType, lut)
+        extractorResult = [screenUnits.CenterPoints(player, unit, 9) for player in players for unit in unitTypes]
+        extractorDuration += time.time() - start
+
+        equal += masksResult == extractorResult
+
+    print("types =", numTypes, "players =", len(players), "state creation: masks =", "%.3f" % (masksDuration * 1000 / numSteps), "ms, extractor =",
+            "%.3f" % (extractorDuration * 1000 / numSteps), "ms, equal in", equal, "/", numSteps, "steps")
+
+
+if __name__ == "__main__":
+    BenchmarkCenterPoints()
+    BenchmarkScreenUnits()
@@ -0,0 +1,172 @@
+import numpy as np
+import threading
+import time
+
+from collections import deque
+
+from utils_ttable import RewardTransitionTable
+
+
+def SampleModelTransitions(entryS, counts, numSamples, seed):
+    # (s, a) pairs with known transitions are drawn uniformly and entry (s, s_) of the pair is drawn by its count.
+    # runs on planning thread, returns entries and actions of samples
+    rng = np.random.RandomState(seed)
+    numActions = counts.shape[1]
+    entries, actions = np.nonzero(counts)
+    if len(entries) == 0:
+        return entries, actions
+
+    pairKey = entryS[entries] * numActions + actions
+    order = np.argsort(pairKey, kind='stable')
+    entries, actions, pairKey = entries[order], actions[order], pairKey[order]
+
+    cumCounts = np.cumsum(counts[entries, actions])
+    pairStart = np.flatnonzero(np.r_[True, pairKey[1:] != pairKey[:-1]])
+    pairEnd = np.r_[pairStart[1:], len(pairKey)]
+    pairBase = np.r_[0.0, cumCounts][pairStart]
+    pairTotal = cumCounts[pairEnd - 1] - pairBase
+
+    pairs = rng.randint(0, len(pairStart), numSamples)
+    idx = np.searchsorted(cumCounts, pairBase[pairs] + rng.uniform(size=numSamples) * pairTotal[pairs], side='right')
+    return entries[idx], actions[idx]
+
+
+class DynaPlanner():
+    def __init__(self, numActions, syntheticRatio, minJobSize = 1024):
+        # real transitions are queued by the inserting thread (under history lock). learning them to model, sampling from model
+        # and decoding of sampled states run on planning thread. synthetic transitions are requested by syntheticRatio for each real transition
+        self.numActions = numActions
+        self.syntheticRatio = syntheticRatio
+        self.minJobSize = minJobSize
+
+        # model is touched only with plan lock (by planning thread and Reset)
+        self.planLock = threading.Lock()
+        self.pending = deque()
+        # synthetic transitions ready to be inserted to replay
+        self.ready = deque()
+        self.numSampled = 0
+        self.Reset()
+
+        self.wakeEvent = threading.Event()
+        self.stop = False
+        self.thread = threading.Thread(target=self.PlanLoop, name="dynaPlanner")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Reset(self):
+        # queued transitions and samples of old model are dropped (their entries are not valid)
+        self.planLock.acquire()
+        self.pending.clear()
+        self.ready.clear()
+        self.ttable = RewardTransitionTable(self.numActions, "", newTable=True)
+        self.numRequested = 0.0
+        self.numSynthetic = 0
+        self.planLock.release()
+
+    def Observe(self, s, a, r, s_, terminal):
+        # called on the real data path: only queues the transitions and wakes planning thread
+        if len(a) > 0:
+            self.pending.append((s, a, r, s_, terminal))
+            self.wakeEvent.set()
+
+    def Plan(self):
+        # synthetic transitions sampled by planning thread since last call (never waits for planning thread)
+        transitions = []
+        while len(self.ready) > 0:
+            transitions.append(self.ready.popleft())
+
+        return transitions
+
+    def PlanLoop(self):
+        while True:
+            self.wakeEvent.wait()
+            self.wakeEvent.clear()
+            if self.stop:
+                return
+
+            self.planLock.acquire()
+            while len(self.pending) > 0:
+                s, a, r, s_, terminal = self.pending.popleft()
+                self.ttable.learnTransitions(s, a, r, s_, terminal)
+                self.numRequested += len(a) * self.syntheticRatio
+
+            self.Sample()
+            self.planLock.release()
+
+    def Sample(self):
+        # called with plan lock. samples are drawn only when enough samples are requested
+        numSamples = int(self.numRequested)
+        if numSamples < self.minJobSize:
+            return
+
+        numEntries = self.ttable.numEntries
+        entries, a = SampleModelTransitions(self.ttable.entryS[:numEntries], self.ttable.counts[:numEntries], numSamples, self.numSampled)
+        self.numRequested -= numSamples
+        self.numSampled += 1
+        if len(a) > 0:
+            self.ready.append(self.ModelTransitions(entries, a))
+
+    def ModelTransitions(self, entries, a):
+        # states of entries with observed average reward and terminal drawn by its frequency
+        s = self.ttable.registry.DecodeBatch(self.ttable.entryS[entries])
+        s_ = self.ttable.registry.DecodeBatch(self.ttable.entryS_[entries])
+        r = self.ttable.RewardMean(entries, a)
+        terminal = np.random.uniform(size=len(a)) < self.ttable.TerminalProb(entries, a)
+
+        self.numSynthetic += len(a)
+        return s, a, r, s_, terminal
+
+    def NumPending(self):
+        return len(self.pending)
+
+    def Close(self):
+        if self.thread != None:
+            self.stop = True
+            self.wakeEvent.set()
+            self.thread.join()
+            self.thread = None
+
+
+def BenchmarkDynaPlanner(numTransitions = 200000, stepSize = 50, stateSize = 16, numStateVals = 6, numActions = 8, syntheticRatio = 2.0):
+    # duration of real inserts (batches of stepSize transitions) with and without planning
+    states = np.random.randint(0, numStateVals, size=(numTransitions + 1, stateSize))
+    actions = np.random.randint(0, numActions, size=numTransitions)
+    rewards = np.random.uniform(-1, 1, size=numTransitions)
+    terminal = np.random.uniform(size=numTransitions) < 0.01
+
+    for ratio in [0.0, syntheticRatio]:
+        planner = DynaPlanner(numActions, ratio) if ratio > 0 else None
+        insertDurations = []
+        numSynthetic = 0
+        modelTable = RewardTransitionTable(numActions, "", newTable=True)
+        start = time.time()
+        for i in range(0, numTransitions, stepSize):
+            chosen = np.arange(i, min(i + stepSize, numTransitions))
+            insertStart = time.time()
+            if planner != None:
+                planner.Observe(states[chosen], actions[chosen], rewards[chosen], states[chosen + 1], terminal[chosen])
+                for s, a, r, s_, t in planner.Plan():
+                    numSynthetic += len(a)
+            else:
+                modelTable.learnTransitions(states[chosen], actions[chosen], rewards[chosen], states[chosen + 1], terminal[chosen])
+            insertDurations.append(time.time() - insertStart)
+
+        duration = time.time() - start
+        if planner != None:
+            # wait for planning thread to learn and sample all queued transitions
+            while planner.NumPending() > 0:
+                time.sleep(0.01)
+            planner.planLock.acquire()
+            planner.planLock.release()
+            for s, a, r, s_, t in planner.Plan():
+                numSynthetic += len(a)
+
+        planDuration = time.time() - start
+        p50, p99 = np.percentile(insertDurations, [50, 99]) * 1000
+        print("synthetic ratio =", ratio, "real =", numTransitions, "synthetic =", numSynthetic, "duration =", "%.2f" % duration, "sec (with planning", "%.2f" % planDuration, "sec), insert p50 =", "%.3f" % p50, "ms, p99 =", "%.3f" % p99, "ms")
+        if planner != None:
+            planner.Close()
+
+
+if __name__ == "__main__":
+    BenchmarkDynaPlanner()
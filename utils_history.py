@@ -1,16 +1,30 @@
 import numpy as np
 import pandas as pd
 import pickle
+import json
 import os.path
 import datetime
+import uuid
 import sys
 
 from multiprocessing import Lock
 from utils import EmptyLock
 
+from utils_dyna import DynaPlanner
+
+CHUNKED_HIST_SUFFIX = "_chunks"
+
+def HistoryFileExist(name):
+    return os.path.isfile(os.path.join(name + CHUNKED_HIST_SUFFIX, "manifest.json")) or os.path.isfile(name + '.gz')
+
 def GetHistoryFromFile(name):
     transitions = None
-    if os.path.isfile(name + '.gz') and os.path.getsize(name + '.gz') > 0:
+    if os.path.isfile(os.path.join(name + CHUNKED_HIST_SUFFIX, "manifest.json")):
+        store = ChunkedHistoryStore(name + CHUNKED_HIST_SUFFIX)
+        transitions = store.LoadMeta()
+        for key, vals in zip(store.columns, store.Read()):
+            transitions[key] = vals
+    elif os.path.isfile(name + '.gz') and os.path.getsize(name + '.gz') > 0:
         transitions = pd.read_pickle(name + '.gz', compression='gzip')
 
     return transitions
@@ -20,7 +34,7 @@ def JoinTransitions(target, toJoin):
     for k in keyTransitions:
         if k in toJoin.keys():
             if k in target.keys():
-                target[k] += toJoin[k]
+                target[k] = np.concatenate((np.asarray(target[k]), np.asarray(toJoin[k])))
             else:
                 target[k] = toJoin [k]
 
@@ -42,14 +56,76 @@ def JoinTransitions(target, toJoin):
         else:
             target["rewardMin"] = toJoin["rewardMin"]
 
+def IterEpisodes(transitions):
+    # split (s, a, r, s_, terminal) arrays to complete episodes views
+    start = 0
+    for end in np.flatnonzero(transitions[-1]) + 1:
+        yield tuple(col[start:end] for col in transitions)
+        start = end
+
+class RunningStats():
+    def __init__(self, size):
+        # running max, min, mean and variance (welford) of state values
+        self.size = size
+        self.Reset()
+
+    def Reset(self):
+        self.count = 0
+        self.mean = np.zeros(self.size, dtype=np.float64)
+        self.m2 = np.zeros(self.size, dtype=np.float64)
+        self.max = np.full(self.size, -np.inf)
+        self.min = np.full(self.size, np.inf)
+
+    def Add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        np.maximum(self.max, x, out=self.max)
+        np.minimum(self.min, x, out=self.min)
+
+    def AddBatch(self, x):
+        if len(x) == 0:
+            return
+
+        batchStats = RunningStats(self.size)
+        batchStats.count = len(x)
+        batchStats.mean = np.mean(x, axis=0, dtype=np.float64)
+        batchStats.m2 = np.sum(np.square(x - batchStats.mean), axis=0)
+        batchStats.max = np.max(x, axis=0)
+        batchStats.min = np.min(x, axis=0)
+        self.Merge(batchStats)
+
+    def Merge(self, other):
+        # parallel combination of mean and variance (chan et al.)
+        if other.count == 0:
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + np.square(delta) * self.count * other.count / count
+        self.count = count
+        self.max = np.maximum(self.max, other.max)
+        self.min = np.minimum(self.min, other.min)
+
+    def Var(self):
+        return self.m2 / max(self.count, 1)
+
+    def Std(self):
+        return np.sqrt(self.Var())
+
 class History():
     def __init__(self, isMultiThreaded = False):
 
-        self.transitions = {}
         self.transitionKeys = ["s", "a", "r", "s_", "terminal"]
 
-        for key in self.transitionKeys:
-            self.transitions[key] = []
+        # single producer buffer: only the owner thread appends (without lock), 
+        # drain swaps it with a new buffer (swap and removal of non terminal history are done under history lock)
+        self.buffer = []
+        # buffer taken in last drain and its size in drain (append racing the swap ends in it)
+        self.retired = []
+        self.retiredSize = 0
 
         if isMultiThreaded:
             self.histLock = Lock()
@@ -58,40 +134,51 @@ class History():
 
 
     def learn(self, s, a, r, s_, terminal = False):
-        self.histLock.acquire()
-        
-        self.transitions["s"].append(s.copy())
-        self.transitions["a"].append(a)
-        self.transitions["r"].append(r)
-        self.transitions["s_"].append(s_.copy())
-        self.transitions["terminal"].append(terminal)
-
-        self.histLock.release()
+        # append of single tuple is atomic
+        self.buffer.append((s.copy(), a, r, s_.copy(), terminal))
         
     def GetHistory(self, reset = True):
+        # should be called by a single drainer at a time
         self.histLock.acquire()
-        transitions = self.transitions.copy()
         if reset:
-            for key in self.transitionKeys:
-                self.transitions[key] = []
+            buffer = self.buffer
+            self.buffer = []
+            items = self.retired[self.retiredSize:]
+            self.retired = buffer
+            self.retiredSize = len(buffer)
+            items += buffer[:self.retiredSize]
+        else:
+            items = self.retired[self.retiredSize:] + self.buffer[:]
         self.histLock.release()
 
+        transitions = {}
+        if len(items) == 0:
+            for key in self.transitionKeys:
+                transitions[key] = []
+        else:
+            for key, vals in zip(self.transitionKeys, zip(*items)):
+                transitions[key] = np.array(vals)
+
         return transitions
 
 
     def Reset(self):
         self.histLock.acquire()
-        for key in self.transitionKeys:
-            self.transitions[key] = []
+        self.buffer = []
+        self.retired = []
+        self.retiredSize = 0
         self.histLock.release()
     
     def RemoveNonTerminalHistory(self):
+        # called by owner thread. non terminal tail is removed from buffer and then from transitions of retired buffer that were not drained 
+        # (appended to retired buffer after swap, before transitions of buffer)
         self.histLock.acquire()
-        idx = len(self.transitions["terminal"]) - 1
-        while self.transitions["terminal"][idx] != True and idx >= 0:
-            for key in self.transitionKeys:
-                self.transitions[key].pop(-1)
-            idx -= 1
+        for buffer, start in [(self.buffer, 0), (self.retired, self.retiredSize)]:
+            while len(buffer) > start and buffer[-1][-1] != True:
+                buffer.pop(-1)
+
+            if len(buffer) > start:
+                break
         self.histLock.release()
 
     def ExtractHistory(self, transitions):                    
@@ -103,6 +190,497 @@ class History():
 
         return s, a, r, s_, terminal
 
+class ReplayBuffer():
+    def __init__(self, stateSize, capacity, stateDtype = np.float32):
+        # fixed capacity columns with circular write head
+        self.stateSize = stateSize
+        self.capacity = capacity
+        self.stateDtype = stateDtype
+
+        self.s = np.zeros((capacity, stateSize), dtype=stateDtype)
+        self.a = np.zeros(capacity, dtype=np.int32)
+        self.r = np.zeros(capacity, dtype=np.float32)
+        self.s_ = np.zeros((capacity, stateSize), dtype=stateDtype)
+        self.terminal = np.zeros(capacity, dtype=bool)
+        # num of Add call that wrote each slot (never reset, sampled slots overwritten since sampling have a newer generation)
+        self.generation = np.zeros(capacity, dtype=np.int64)
+        self.numAdds = 0
+
+        # next idx to write and num of valid transitions
+        self.head = 0
+        self.size = 0
+
+    def Size(self):
+        return self.size
+
+    def Reset(self):
+        self.head = 0
+        self.size = 0
+
+    def Add(self, s, a, r, s_, terminal):
+        size = len(a)
+        if size == 0:
+            return
+        
+        if size > self.capacity:
+            s, a, r, s_, terminal = s[-self.capacity:], a[-self.capacity:], r[-self.capacity:], s_[-self.capacity:], terminal[-self.capacity:]
+            size = self.capacity
+
+        idx = (self.head + np.arange(size)) % self.capacity
+        self.s[idx] = s
+        self.a[idx] = a
+        self.r[idx] = r
+        self.s_[idx] = s_
+        self.terminal[idx] = terminal
+        self.numAdds += 1
+        self.generation[idx] = self.numAdds
+
+        self.head = (self.head + size) % self.capacity
+        self.size = min(self.size + size, self.capacity)
+
+    def OrderedIdx(self):
+        # idx of transitions from oldest to newest
+        start = (self.head - self.size) % self.capacity
+        return (start + np.arange(self.size)) % self.capacity
+
+    def IsContiguous(self):
+        return self.size < self.capacity or self.head == 0
+
+    def Gather(self, idx):
+        return self.s[idx], self.a[idx], self.r[idx], self.s_[idx], self.terminal[idx]
+
+    def Generation(self, idx):
+        return self.generation[idx]
+
+    def IsUnchanged(self, idx, generation):
+        # slots still holding the transitions sampled with generation
+        return (idx < self.size) & (self.generation[idx] == generation)
+
+    def GetAll(self, copy = False):
+        if self.IsContiguous() and not copy:
+            # views on the valid part of the buffer
+            size = self.size
+            return self.s[:size], self.a[:size], self.r[:size], self.s_[:size], self.terminal[:size]
+
+        return self.Gather(self.OrderedIdx())
+    
+    def Sample(self, batchSize):
+        idx, _ = self.SampleIdx(batchSize)
+        return self.Gather(idx)
+
+    def SampleIdx(self, batchSize):
+        # uniform sampling, all importance sampling weights are 1
+        idx = np.random.randint(0, self.size, batchSize)
+        return idx, np.ones(batchSize, dtype=np.float32)
+
+    def DrawState(self):
+        if self.size == 0:
+            return np.array([])
+        
+        idx = np.random.randint(0, self.size)
+        return self.s[idx].copy()
+
+    def ToDict(self):
+        s, a, r, s_, terminal = self.GetAll(copy=True)
+        return {"s": s, "a": a, "r": r, "s_": s_, "terminal": terminal}
+
+    def Load(self, transitions):
+        self.Reset()
+        if len(transitions["a"]) == 0:
+            return
+
+        s = np.array(transitions["s"], dtype=self.stateDtype).reshape(-1, self.stateSize)
+        a = np.array(transitions["a"], dtype=np.int32)
+        r = np.array(transitions["r"], dtype=np.float32)
+        s_ = np.array(transitions["s_"], dtype=self.stateDtype).reshape(-1, self.stateSize)
+        terminal = np.array(transitions["terminal"], dtype=bool)
+        self.Add(s, a, r, s_, terminal)
+
+class SumTree():
+    def __init__(self, capacity):
+        # array-backed binary tree: root in idx 1, leaves in [treeSize, 2 * treeSize)
+        self.treeSize = 1
+        while self.treeSize < capacity:
+            self.treeSize *= 2
+
+        self.tree = np.zeros(2 * self.treeSize, dtype=np.float64)
+
+    def Total(self):
+        return self.tree[1]
+
+    def Get(self, idx):
+        return self.tree[np.asarray(idx) + self.treeSize]
+
+    def Reset(self):
+        self.tree.fill(0.0)
+
+    def Update(self, idx, priorities):
+        nodes = np.asarray(idx) + self.treeSize
+        self.tree[nodes] = priorities
+
+        # propagate sums to root level by level (all leaves share the same depth)
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+            if nodes[0] == 0:
+                break
+
+    def Find(self, vals):
+        # descend from root for each value, O(log n) per value
+        vals = np.minimum(np.asarray(vals, dtype=np.float64), np.nextafter(self.Total(), 0))
+        nodes = np.ones(len(vals), dtype=np.int64)
+        while nodes[0] < self.treeSize:
+            left = 2 * nodes
+            leftVals = self.tree[left]
+            goRight = vals >= leftVals
+            vals = np.where(goRight, vals - leftVals, vals)
+            nodes = np.where(goRight, left + 1, left)
+
+        return nodes - self.treeSize
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    def __init__(self, stateSize, capacity, alpha, beta, epsilon, betaSteps = None, stateDtype = np.float32):
+        super(PrioritizedReplayBuffer, self).__init__(stateSize, capacity, stateDtype)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        # importance sampling beta is annealed linearly from beta to 1 over betaSteps minibatches (None = constant beta)
+        self.betaSteps = betaSteps
+        self.numBetaSteps = 0
+
+        self.sumTree = SumTree(capacity)
+        self.maxPriority = 1.0
+
+    def Reset(self):
+        super(PrioritizedReplayBuffer, self).Reset()
+        self.sumTree.Reset()
+        self.maxPriority = 1.0
+
+    def Add(self, s, a, r, s_, terminal):
+        size = min(len(a), self.capacity)
+        idx = (self.head + np.arange(size)) % self.capacity
+        
+        super(PrioritizedReplayBuffer, self).Add(s, a, r, s_, terminal)
+        # new transitions are inserted with max priority so they are sampled at least once
+        if size > 0:
+            self.sumTree.Update(idx, self.maxPriority)
+
+    def SampleIdx(self, batchSize):
+        # stratified proportional sampling
+        total = self.sumTree.Total()
+        segment = total / batchSize
+        vals = (np.arange(batchSize) + np.random.uniform(size=batchSize)) * segment
+        idx = self.sumTree.Find(vals)
+
+        prob = self.sumTree.Get(idx) / total
+        isWeights = np.power(self.size * prob, -self.Beta())
+        isWeights /= isWeights.max()
+
+        return idx, isWeights.astype(np.float32)
+
+    def Beta(self):
+        if self.betaSteps == None:
+            return self.beta
+
+        return min(1.0, self.beta + (1.0 - self.beta) * self.numBetaSteps / self.betaSteps)
+
+    def AnnealBeta(self, numSteps):
+        self.numBetaSteps += numSteps
+
+    def UpdatePriorities(self, idx, tdErrors, generation):
+        # priorities of slots overwritten since sampling (generation of sampling) are not updated
+        unchanged = self.IsUnchanged(idx, generation)
+        idx, tdErrors = idx[unchanged], np.asarray(tdErrors)[unchanged]
+        if len(idx) == 0:
+            return
+
+        priorities = np.power(np.abs(tdErrors) + self.epsilon, self.alpha)
+        self.maxPriority = max(self.maxPriority, priorities.max())
+        self.sumTree.Update(idx, priorities)
+
+class ChunkedHistoryStore():
+    def __init__(self, directory, chunkSize = 8192):
+        # append-only columnar store: each column is kept in .npy segments of chunkSize transitions.
+        # full segments are never rewritten, manifest holds segments sizes and start of replay.
+        # firstIdx and replayStart are idxs in all transitions ever logged (dropped segments included)
+        self.directory = directory
+        self.chunkSize = chunkSize
+        self.columns = ["s", "a", "r", "s_", "terminal"]
+
+        self.manifestName = os.path.join(directory, "manifest.json")
+        self.metaName = os.path.join(directory, "meta.gz")
+
+        # temp files are named <file>.<pid>-<writer id>.tmp so a writer only removes temps it owns
+        self.tmpSuffix = ".%d-%s.tmp" % (os.getpid(), uuid.uuid4().hex)
+
+        # list of [segment id, segment size]
+        self.segments = []
+        self.nextSegmentId = 0
+        self.firstIdx = 0
+        self.replayStart = 0
+
+        if os.path.isfile(self.manifestName):
+            self.LoadManifest()
+
+        self.RemoveUnfinishedWrites()
+
+    def RemoveUnfinishedWrites(self):
+        # .tmp files are left only by writes interrupted before their rename (manifest and segments are still valid without them).
+        # remove only temps of this writer or of writers whose process is gone, temps of live writers may be in the middle of a write
+        if os.path.isdir(self.directory):
+            for fName in os.listdir(self.directory):
+                if fName.endswith(self.tmpSuffix) or self.IsOrphanTmp(fName):
+                    try:
+                        os.remove(os.path.join(self.directory, fName))
+                    except OSError:
+                        pass
+
+    def IsOrphanTmp(self, fName):
+        if not fName.endswith(".tmp"):
+            return False
+
+        owner = fName[:-len(".tmp")].rsplit(".", 1)[-1]
+        pid = owner.split("-", 1)[0]
+        if not pid.isdigit():
+            return False
+
+        pid = int(pid)
+        if pid == os.getpid():
+            return False
+
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            return False
+
+        return False
+
+    def TmpName(self, fName):
+        return fName + self.tmpSuffix
+
+    def ReplaceFromTmp(self, fName, write):
+        tmpName = self.TmpName(fName)
+        try:
+            write(tmpName)
+            os.replace(tmpName, fName)
+        except BaseException:
+            if os.path.isfile(tmpName):
+                os.remove(tmpName)
+            raise
+
+    def LoadManifest(self):
+        with open(self.manifestName, "r") as f:
+            manifest = json.load(f)
+
+        self.chunkSize = manifest["chunkSize"]
+        self.segments = manifest["segments"]
+        self.nextSegmentId = manifest["nextSegmentId"]
+        self.firstIdx = manifest["firstIdx"]
+        self.replayStart = manifest["replayStart"]
+
+    def SaveManifest(self):
+        manifest = {"chunkSize": self.chunkSize, "segments": self.segments, "nextSegmentId": self.nextSegmentId, "firstIdx": self.firstIdx, "replayStart": self.replayStart}
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        def write(tmpName):
+            with open(tmpName, "w") as f:
+                json.dump(manifest, f)
+
+        self.ReplaceFromTmp(self.manifestName, write)
+
+    def SegmentFileName(self, segmentId, key):
+        return os.path.join(self.directory, "%06d_%s.npy" % (segmentId, key))
+
+    def WriteSegment(self, segmentId, columns):
+        for key, vals in zip(self.columns, columns):
+            def write(tmpName):
+                with open(tmpName, "wb") as f:
+                    np.save(f, vals)
+
+            self.ReplaceFromTmp(self.SegmentFileName(segmentId, key), write)
+
+    def ReadSegment(self, segmentId, start, end):
+        # memory mapped columns of segment range
+        return [np.load(self.SegmentFileName(segmentId, key), mmap_mode='r')[start:end] for key in self.columns]
+
+    def RemoveSegment(self, segmentId):
+        for key in self.columns:
+            fName = self.SegmentFileName(segmentId, key)
+            if os.path.isfile(fName):
+                os.remove(fName)
+
+    def Size(self):
+        return sum(segSize for _, segSize in self.segments)
+
+    def EndIdx(self):
+        return self.firstIdx + self.Size()
+
+    def Append(self, s, a, r, s_, terminal, saveManifest = True):
+        columns = [s, a, r, s_, terminal]
+        size = len(a)
+        if size == 0:
+            return
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        start = 0
+        if len(self.segments) > 0 and self.segments[-1][1] < self.chunkSize:
+            # fill last (open) segment
+            segmentId, segSize = self.segments[-1]
+            start = min(self.chunkSize - segSize, size)
+            oldCols = self.ReadSegment(segmentId, 0, segSize)
+            self.WriteSegment(segmentId, [np.concatenate((old, new[:start])) for old, new in zip(oldCols, columns)])
+            self.segments[-1][1] = segSize + start
+
+        while start < size:
+            end = min(start + self.chunkSize, size)
+            self.WriteSegment(self.nextSegmentId, [col[start:end] for col in columns])
+            self.segments.append([self.nextSegmentId, end - start])
+            self.nextSegmentId += 1
+            start = end
+
+        if saveManifest:
+            self.SaveManifest()
+
+    def Read(self, start = 0, end = None):
+        # transitions in [start, end). range inside a single segment is returned as memory mapped views
+        end = self.Size() if end == None else end
+        parts = []
+        segStart = 0
+        for segmentId, segSize in self.segments:
+            segEnd = segStart + segSize
+            if segEnd > start and segStart < end:
+                parts.append(self.ReadSegment(segmentId, max(start, segStart) - segStart, min(end, segEnd) - segStart))
+            segStart = segEnd
+
+        if len(parts) == 0:
+            emptyM = np.array([])
+            return emptyM, emptyM, emptyM, emptyM, emptyM
+        elif len(parts) == 1:
+            return tuple(parts[0])
+
+        return tuple(np.concatenate(cols) for cols in zip(*parts))
+
+    def EpisodesRanges(self):
+        terminal = np.concatenate([self.ReadSegment(segmentId, 0, segSize)[-1] for segmentId, segSize in self.segments]) if len(self.segments) > 0 else np.array([], bool)
+        ends = np.flatnonzero(terminal) + 1
+        starts = np.concatenate(([0], ends[:-1])).astype(int)
+        return starts, ends
+
+    def ReadEpisodes(self, firstEpisode, lastEpisode):
+        # transitions of episodes [firstEpisode, lastEpisode)
+        starts, ends = self.EpisodesRanges()
+        lastEpisode = min(lastEpisode, len(ends))
+        if firstEpisode >= lastEpisode:
+            return self.Read(0, 0)
+
+        return self.Read(starts[firstEpisode], ends[lastEpisode - 1])
+
+    def IterEpisodes(self):
+        # yield complete episodes as memory mapped views (episodes crossing segments are copied)
+        carry = []
+        for segmentId, segSize in self.segments:
+            cols = self.ReadSegment(segmentId, 0, segSize)
+            start = 0
+            for end in np.flatnonzero(cols[-1]) + 1:
+                episode = [col[start:end] for col in cols]
+                if len(carry) > 0:
+                    episode = [np.concatenate(parts) for parts in zip(*(carry + [episode]))]
+                    carry = []
+                yield tuple(episode)
+                start = end
+
+            if start < segSize:
+                carry.append([col[start:] for col in cols])
+
+    def Truncate(self, size):
+        # remove all transitions from idx size
+        toRemove = []
+        segments = []
+        segStart = 0
+        for segmentId, segSize in self.segments:
+            if segStart >= size:
+                toRemove.append(segmentId)
+            elif segStart + segSize > size:
+                cols = self.ReadSegment(segmentId, 0, size - segStart)
+                self.WriteSegment(segmentId, [np.array(col) for col in cols])
+                segments.append([segmentId, size - segStart])
+            else:
+                segments.append([segmentId, segSize])
+            segStart += segSize
+        
+        self.segments = segments
+        self.replayStart = min(self.replayStart, self.EndIdx())
+        self.SaveManifest()
+
+        for segmentId in toRemove:
+            self.RemoveSegment(segmentId)
+
+    def DropBefore(self, idx):
+        # remove full segments ending before idx (idxs of remaining transitions are shifted)
+        toRemove = []
+        numDropped = 0
+        while len(self.segments) > 1 and numDropped + self.segments[0][1] <= idx:
+            segmentId, segSize = self.segments.pop(0)
+            toRemove.append(segmentId)
+            numDropped += segSize
+        
+        if numDropped == 0:
+            return
+
+        self.firstIdx += numDropped
+        self.SaveManifest()
+
+        for segmentId in toRemove:
+            self.RemoveSegment(segmentId)
+
+    def SaveMeta(self, meta):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.ReplaceFromTmp(self.metaName, lambda tmpName: pd.to_pickle(meta, tmpName, 'gzip'))
+
+    def LoadMeta(self):
+        if os.path.isfile(self.metaName):
+            return pd.read_pickle(self.metaName, compression='gzip')
+        
+        return {}
+
+def ConvertGzHistory(histFileName, chunkSize = 8192):
+    # convert history saved as gzip pickles (history{N}.gz, history_last.gz and history.gz) to chunked store
+    store = ChunkedHistoryStore(histFileName + CHUNKED_HIST_SUFFIX, chunkSize)
+    if store.Size() > 0:
+        return store
+
+    oldParts = []
+    i = 0
+    while os.path.isfile(histFileName + str(i) + '.gz'):
+        oldParts.append(histFileName + str(i) + '.gz')
+        i += 1
+    if os.path.isfile(histFileName + "_last.gz"):
+        oldParts.append(histFileName + "_last.gz")
+
+    for fName in oldParts:
+        transitions = pd.read_pickle(fName, compression='gzip')
+        if len(transitions["a"]) > 0:
+            store.Append(*[np.asarray(transitions[key]) for key in store.columns], saveManifest=False)
+
+    store.replayStart = store.Size()
+
+    if os.path.isfile(histFileName + '.gz') and os.path.getsize(histFileName + '.gz') > 0:
+        transitions = pd.read_pickle(histFileName + '.gz', compression='gzip')
+        if len(transitions["a"]) > 0:
+            store.Append(*[np.asarray(transitions[key]) for key in store.columns], saveManifest=False)
+        store.SaveMeta({key: val for key, val in transitions.items() if key not in store.columns})
+
+    store.SaveManifest()
+    print("converted history", histFileName, "to chunked store with", store.Size(), "transitions")
+    return store
+
 class HistoryMngr(History):
     def __init__(self, params, historyFileName = '', directory = '', isMultiThreaded = False):
         super(HistoryMngr, self).__init__(isMultiThreaded)
@@ -111,120 +689,329 @@ class HistoryMngr(History):
 
         self.isMultiThreaded = isMultiThreaded
 
-        self.metaDataFields = ["maxStateVals", "rewardMax", "rewardMin"]
+        self.metaDataFields = ["maxStateVals", "rewardMax", "rewardMin", "minStateVals", "stateMean", "stateVar", "stateCount"]
+
+        # transitions are kept in replay buffer, transitions dict holds only meta data
+        if params.prioritizedReplay:
+            self.replay = PrioritizedReplayBuffer(params.stateSize, params.maxReplaySize, params.priorityAlpha, params.priorityBeta, params.priorityEpsilon, params.priorityBetaSteps)
+        else:
+            self.replay = ReplayBuffer(params.stateSize, params.maxReplaySize)
+        self.transitions = {}
 
         self.transitions["maxStateVals"] = np.ones(params.stateSize, int)
         self.transitions["rewardMax"] = 0.01
         self.transitions["rewardMin"] = 0.0
 
-
-        if self.params.saveOldHist:
-            self.oldTransitions = {}
-            for key in self.transitionKeys:
-                self.oldTransitions[key] = []
+        # statistics of all states inserted to history (updated incrementally)
+        self.stateStats = RunningStats(params.stateSize)
+        self.UpdateStateStatsFields()
 
         self.historyData = []
 
         self.trimmingHistory = False
 
+        # synthetic transitions sampled from model of real transitions (dyna) are kept in their own replay (they never evict real transitions).
+        # its capacity keeps syntheticRatio synthetic transitions for each real transition of a full replay
+        if params.syntheticRatio > 0:
+            self.planner = DynaPlanner(params.numActions, params.syntheticRatio)
+            self.syntheticReplay = ReplayBuffer(params.stateSize, max(1, int(params.maxReplaySize * params.syntheticRatio)))
+        else:
+            self.planner = None
+            self.syntheticReplay = None
+
+        # transitions joined since last save (only they are written to the store)
+        self.pendingTransitions = []
+        # num of transitions ever inserted and idx of first transition in current replay
+        self.numLogged = 0
+        self.replayStart = 0
+        # replay was reset without dumping to old: transitions from this idx are removed from store on next save
+        self.discardFrom = None
+
+        if isMultiThreaded:
+            self.saveLock = Lock()
+            self.drainLock = Lock()
+        else:
+            self.saveLock = EmptyLock()
+            self.drainLock = EmptyLock()
+
         if historyFileName != '':
             self.histFileName = directory + historyFileName
-            if self.params.saveOldHist:
-                self.lastHistFileAdd = "_last"
-                self.numOldHistFiles = 0
+            self.store = ChunkedHistoryStore(self.histFileName + CHUNKED_HIST_SUFFIX)
         else:
             self.histFileName = historyFileName
+            self.store = None
         
     def Load(self):
-        if os.path.isfile(self.histFileName + '.gz') and os.path.getsize(self.histFileName + '.gz') > 0:
-            self.transitions = pd.read_pickle(self.histFileName + '.gz', compression='gzip')
-
-        if self.params.saveOldHist:
-            if os.path.isfile(self.histFileName + self.lastHistFileAdd + '.gz'):
-                self.oldTransitions = pd.read_pickle(self.histFileName + self.lastHistFileAdd + '.gz', compression='gzip')
+        if self.store == None:
+            return
+
+        if self.store.Size() == 0 and os.path.isfile(self.histFileName + '.gz'):
+            self.store = ConvertGzHistory(self.histFileName)
+
+        self.numLogged = self.store.EndIdx()
+        self.replayStart = self.store.replayStart
+        if self.store.Size() > 0:
+            size = self.store.Size()
+            s, a, r, s_, terminal = self.store.Read(max(self.replayStart - self.store.firstIdx, size - self.params.maxReplaySize), size)
+            self.replay.Load({"s": s, "a": a, "r": r, "s_": s_, "terminal": terminal})
+            if self.planner != None:
+                self.planner.Observe(s, a, r, s_, terminal)
+            
+            transitions = self.store.LoadMeta()
+            for key in self.metaDataFields:
+                if key in transitions:
+                    self.transitions[key] = transitions[key]
+            
+            if "stateMean" in transitions:
+                self.stateStats.count = transitions["stateCount"]
+                self.stateStats.mean = np.array(transitions["stateMean"], dtype=np.float64)
+                self.stateStats.m2 = np.array(transitions["stateVar"], dtype=np.float64) * transitions["stateCount"]
+                self.stateStats.max = np.array(transitions["maxStateVals"], dtype=np.float64)
+                self.stateStats.min = np.array(transitions["minStateVals"], dtype=np.float64)
+            else:
+                # history saved without statistics: calculate once from loaded transitions
+                s, _, _, s_, _ = self.replay.GetAll()
+                self.stateStats.AddBatch(s)
+                self.stateStats.AddBatch(s_)
+                self.UpdateStateStatsFields()
 
-            while os.path.isfile(self.histFileName + str(self.numOldHistFiles) +'.gz'):
-                self.numOldHistFiles += 1
+    def learn(self, s, a, r, s_, terminal = False):
+        self.histLock.acquire()
+        self.stateStats.Add(s)
+        self.stateStats.Add(s_)
+        self.UpdateStateStatsFields()
+        self.AddToReplay(s.reshape(1, -1), np.array([a]), np.array([r]), s_.reshape(1, -1), np.array([terminal]))
+        self.histLock.release()
+        self.PlanSynthetic()
 
     def AddHistory(self):
         history = History(self.isMultiThreaded)
         self.historyData.append(history)
         return history
 
-    def JoinHistoryFromSons(self):
+    def AddTransitions(self, transitions):
+        size = len(transitions["a"])
+        if size == 0:
+            return 0
+
+        s, a, r, s_, terminal = self.ExtractHistory(transitions)
+
+        self.stateStats.AddBatch(s)
+        self.stateStats.AddBatch(s_)
+        self.UpdateStateStatsFields()
+
+        self.AddToReplay(s, a, r, s_, terminal)
+        
+        return size
+
+    def learnBatch(self, s, a, r, s_, terminal):
+        # insert transitions arrays directly to replay (without passing through son history)
+        self.histLock.acquire()
+        self.stateStats.AddBatch(s)
+        self.stateStats.AddBatch(s_)
+        self.UpdateStateStatsFields()
+        self.AddToReplay(s, a, r, s_, terminal)
+        self.histLock.release()
+        self.PlanSynthetic()
+
+    def AddToReplay(self, s, a, r, s_, terminal):
+        self.replay.Add(s, a, r, s_, terminal)
+        self.numLogged += len(a)
+        if self.store != None:
+            self.pendingTransitions.append((s, a, r, s_, terminal))
+
+        if self.planner != None:
+            self.AddSynthetic(s, a, r, s_, terminal)
+
+    def SetPlanner(self, planner):
+        self.planner = planner
+
+    def AddSynthetic(self, s, a, r, s_, terminal):
+        # real transitions are queued to planner (model is learned by planning thread)
+        self.planner.Observe(s, a, r, s_, terminal)
+
+    def PlanSynthetic(self):
+        # called outside of history lock: synthetic transitions already sampled by planning thread are inserted to synthetic replay
+        # (and not logged to store). never waits for planning thread
+        if self.planner == None:
+            return
+
+        syntheticTransitions = self.planner.Plan()
+        if len(syntheticTransitions) > 0:
+            self.histLock.acquire()
+            for s, a, r, s_, terminal in syntheticTransitions:
+                self.syntheticReplay.Add(s, a, r, s_, terminal)
+            self.histLock.release()
+
+    def Close(self):
+        # planning thread is stopped
+        if self.planner != None:
+            self.planner.Close()
+
+    def NumSynthetic(self):
+        return self.syntheticReplay.Size() if self.syntheticReplay != None else 0
+
+    def DrainSons(self, singleHist = None):
+        # sons are drained outside of history lock. drain lock keeps single drainer and order of insertion:
+        # it is released by caller only after history lock is taken (drained transitions are added in drain order)
+        self.drainLock.acquire()
+        if singleHist == None:
+            return [hist.GetHistory() for hist in self.historyData]
+        else:
+            return [singleHist.GetHistory(reset=True)]
+
+    def AddDrained(self, sonsTransitions):
+        # called with history lock
+        self.drainLock.release()
         size = 0
-        for hist in self.historyData:
-            transitions = hist.GetHistory()
-            size += len(transitions["a"])
-            for key in self.transitionKeys:
-                self.transitions[key] += transitions[key]
+        for transitions in sonsTransitions:
+            size += self.AddTransitions(transitions)
+        return size
 
+    def JoinHistoryFromSons(self):
+        sonsTransitions = self.DrainSons()
+        self.histLock.acquire()
+        size = self.AddDrained(sonsTransitions)
+        self.histLock.release()
+        self.PlanSynthetic()
         return size
 
     
     def Size(self):
-        return len(self.transitions["a"])       
+        return self.replay.Size()
 
-    def PopHist2ReplaySize(self):
-        toCut = len(self.transitions["a"]) - self.params.maxReplaySize
-        if self.params.saveOldHist:
-            for key in self.transitionKeys:
-                self.oldTransitions[key] += self.transitions[key][:toCut]
- 
-        for key in self.transitionKeys:
-            del self.transitions[key][:toCut]
+    def TransitionsSince(self, idx):
+        # raw transitions logged from idx that are still in replay, and idx of next transition to log
+        self.histLock.acquire()
+        size = min(self.numLogged - idx, self.replay.Size())
+        if size > 0:
+            s, a, r, s_, terminal = self.replay.Gather(self.replay.OrderedIdx()[-size:])
+        else:
+            s, a, r, s_, terminal = np.zeros((0, self.params.stateSize)), np.zeros(0, int), np.zeros(0), np.zeros((0, self.params.stateSize)), np.zeros(0, bool)
+        numLogged = self.numLogged
+        self.histLock.release()
+
+        return s, a, r, s_, terminal, numLogged
     
     def GetSingleHistory(self, history):
-        transitions = history.GetHistory(reset=True)
-        for key in self.transitionKeys:
-            self.transitions[key] += transitions[key]
+        sonsTransitions = self.DrainSons(history)
+        self.histLock.acquire()
+        self.AddDrained(sonsTransitions)
+        self.histLock.release()
+        self.PlanSynthetic()
 
     def CleanHistory(self):
-        for key in self.transitionKeys:
-            self.transitions[key] = []
+        self.replay.Reset()
+        if self.syntheticReplay != None:
+            self.syntheticReplay.Reset()
+        self.replayStart = self.numLogged
 
     def GetHistory(self, singleHist=None, shuffle=True):   
+        # transitions of sons are added, copied and cleaned in a single history lock section
+        # (with no accumulation each caller gets only transitions drained before its copy)
+        sonsTransitions = self.DrainSons(singleHist)
         self.histLock.acquire()
-
-        if singleHist == None:
-            self.JoinHistoryFromSons()
-        else:
-            self.GetSingleHistory(singleHist)
-
-
-        self.PopHist2ReplaySize()
-        allTransitions = self.transitions.copy()
+        self.AddDrained(sonsTransitions)
+        s, a, r, s_, terminal = self.replay.GetAll(copy=True)
+        if self.NumSynthetic() > 0:
+            synthetic = self.syntheticReplay.GetAll()
+            s, a, r, s_, terminal = [np.concatenate((real, vals)) for real, vals in zip((s, a, r, s_, terminal), synthetic)]
         
         if not self.params.accumulateHistory:
             self.CleanHistory()
 
         self.histLock.release()
+        self.PlanSynthetic()
 
+        self.SaveHistFile()
         
-        if len(allTransitions["r"]) == 0:
+        if len(r) == 0:
             emptyM = np.array([]) 
             return emptyM, emptyM, emptyM, emptyM, emptyM
-
-        s, a, r, s_, terminal = self.ExtractHistory(allTransitions)
         
         # normalization of transition values
-        s, s_ = self.NormalizeStateVals(s, s_, allTransitions)
+        s, s_ = self.NormalizeStateVals(s, s_)
         if self.params.normalizeRewards:
             r = self.NormalizeRewards(r)
 
         if self.params.numRepeatsTerminalLearning > 0:
             s, a, r, s_, terminal = self.AddTerminalStates(s, a, r, s_, terminal)            
-        
-        self.SaveHistFile(allTransitions)    
 
-        size = len(a)
-        idx4Shuffle = np.arange(size)
-        
-        if shuffle:
-            np.random.shuffle(idx4Shuffle)
+        if not shuffle:
+            return s, a, r, s_, terminal
+
+        idx4Shuffle = np.arange(len(a))
+        np.random.shuffle(idx4Shuffle)
 
         return s[idx4Shuffle], a[idx4Shuffle], r[idx4Shuffle], s_[idx4Shuffle], terminal[idx4Shuffle]
     
+    def GetMinibatches(self, numBatches, batchSize):
+        # draw random minibatches directly from replay buffer (without materializing the whole replay).
+        # returns minibatches and size of replay they were drawn from. history is cleaned as in GetHistory,
+        # store is written by Save (every numTrials2Save trials) and not on every training round
+        sonsTransitions = self.DrainSons()
+        self.histLock.acquire()
+        self.AddDrained(sonsTransitions)
+        histSize = self.Size()
+        if histSize == 0:
+            self.histLock.release()
+            self.PlanSynthetic()
+            return [], 0
+        
+        numSynthetic = self.NumSynthetic()
+        if numBatches == None:
+            numBatches = max(1, int((self.Size() + numSynthetic) / batchSize))
+
+        # synthetic transitions are drawn by their share in replays (uniformly, with no priority, at least one real transition is drawn). their idx is -1.
+        # write generation of sampled slots is kept with their idx (priorities of slots overwritten until UpdatePriorities are not updated)
+        numSamples = numBatches * batchSize
+        numSyntheticSamples = min(np.random.binomial(numSamples, numSynthetic / (self.Size() + numSynthetic)), numSamples - 1) if numSynthetic > 0 else 0
+        idx, isWeights = self.replay.SampleIdx(numSamples - numSyntheticSamples)
+        generation = self.replay.Generation(idx)
+        s, a, r, s_, terminal = self.replay.Gather(idx)
+        if numSyntheticSamples > 0:
+            syntheticIdx, syntheticWeights = self.syntheticReplay.SampleIdx(numSyntheticSamples)
+            synthetic = self.syntheticReplay.Gather(syntheticIdx)
+            s, a, r, s_, terminal = [np.concatenate((real, vals)) for real, vals in zip((s, a, r, s_, terminal), synthetic)]
+            idx = np.concatenate((idx, np.full(numSyntheticSamples, -1, dtype=idx.dtype)))
+            generation = np.concatenate((generation, np.full(numSyntheticSamples, -1, dtype=generation.dtype)))
+            isWeights = np.concatenate((isWeights, syntheticWeights))
+
+            shuffle = np.random.permutation(numSamples)
+            s, a, r, s_, terminal, idx, isWeights, generation = s[shuffle], a[shuffle], r[shuffle], s_[shuffle], terminal[shuffle], idx[shuffle], isWeights[shuffle], generation[shuffle]
+
+        if self.params.prioritizedReplay:
+            self.replay.AnnealBeta(numBatches)
+
+        if not self.params.accumulateHistory:
+            self.CleanHistory()
+
+        self.histLock.release()
+        self.PlanSynthetic()
+
+        s, s_ = self.NormalizeStateVals(s, s_)
+        if self.params.normalizeRewards:
+            r = self.NormalizeRewards(r)
+
+        batches = []
+        for i in range(numBatches):
+            chosen = np.arange(i * batchSize, (i + 1) * batchSize)
+            batches.append((s[chosen], a[chosen], r[chosen], s_[chosen], terminal[chosen], idx[chosen], isWeights[chosen], generation[chosen]))
+
+        return batches, histSize
+
+    def UpdatePriorities(self, batches, tdErrors):
+        if not self.params.prioritizedReplay:
+            return
+
+        self.histLock.acquire()
+        for batch, tdError in zip(batches, tdErrors):
+            # synthetic transitions (idx -1) have no priority
+            real = batch[5] >= 0
+            if np.any(real):
+                self.replay.UpdatePriorities(batch[5][real], np.asarray(tdError)[real], batch[7][real])
+        self.histLock.release()
+
     def AddMetaDataFields2Dict(self, transitions):
         for key in self.metaDataFields:
             transitions[key] = self.transitions[key]
@@ -233,38 +1020,43 @@ class HistoryMngr(History):
         self.histLock.acquire()
         if not self.trimmingHistory:
             self.trimmingHistory = True
+            self.histLock.release()
             
             self.JoinHistoryFromSons()
-            self.PopHist2ReplaySize()
-            
-            transitions = self.transitions.copy()
-            self.histLock.release()
-
-            if len(transitions["a"]) > 0:
-                s = np.array(transitions["s"])
-                s_ = np.array(transitions["s_"])
-                self.FindMaxStateVals(s, s_, transitions)
 
-            self.SaveHistFile(transitions) 
+            self.SaveHistFile() 
             self.trimmingHistory = False
         else:
             self.histLock.release()
 
     def NormalizeState(self, state):
-        return (state * 2) / self.transitions["maxStateVals"] - 1.0
-
-    def FindMaxStateVals(self, s, s_, transitions):
-        maxAll = np.column_stack((transitions["maxStateVals"], np.max(s, axis = 0), np.max(s_, axis = 0)))
-
-        transitions["maxStateVals"] = np.max(maxAll, axis = 1)
-        self.transitions["maxStateVals"] = transitions["maxStateVals"].copy()
+        if self.params.zScoreNormalization:
+            return (state - self.transitions["stateMean"]) / self.StateStd()
 
-    def NormalizeStateVals(self, s, s_, transitions):
-        
-        self.FindMaxStateVals(s, s_, transitions)
+        return (state * 2) / self.transitions["maxStateVals"] - 1.0
 
-        s = s / transitions["maxStateVals"] 
-        s_ = s_ / transitions["maxStateVals"] 
+    def UpdateStateStatsFields(self):
+        # max vals are never lower than 1 (initial value of maxStateVals)
+        self.transitions["maxStateVals"] = np.maximum(self.transitions["maxStateVals"], self.stateStats.max)
+        self.transitions["minStateVals"] = self.stateStats.min.copy()
+        self.transitions["stateMean"] = self.stateStats.mean.copy()
+        self.transitions["stateVar"] = self.stateStats.Var()
+        self.transitions["stateCount"] = self.stateStats.count
+
+    def StateStd(self):
+        std = np.sqrt(self.transitions["stateVar"])
+        # constant state values are only centered
+        std[std == 0] = 1.0
+        return std
+
+    def NormalizeStateVals(self, s, s_):
+        if self.params.zScoreNormalization:
+            mean = self.transitions["stateMean"]
+            std = self.StateStd()
+            return (s - mean) / std, (s_ - mean) / std
+
+        s = s / self.transitions["maxStateVals"] 
+        s_ = s_ / self.transitions["maxStateVals"] 
 
         return s , s_
     
@@ -277,7 +1069,6 @@ class HistoryMngr(History):
     def AddTerminalStates(self, s, a, r, s_, terminal):
         terminalIdx = terminal.nonzero()
         np.set_printoptions(threshold=np.nan)
-        
 
         sT = np.repeat(np.squeeze(s[terminalIdx, :]), self.params.numRepeatsTerminalLearning, axis=0)
         aT = np.repeat(np.squeeze(a[terminalIdx]), self.params.numRepeatsTerminalLearning)
@@ -307,36 +1098,46 @@ class HistoryMngr(History):
     
 
     def Save(self):
-        self.histLock.acquire()
         self.JoinHistoryFromSons()
-        pd.to_pickle(self.transitions, self.histFileName + '.gz', 'gzip') 
+        self.SaveHistFile()
+
+    def SaveHistFile(self):
+        # append transitions joined since last save to store (save lock keeps appends in order)
+        if self.store == None:
+            return
+
+        self.saveLock.acquire()
+
+        self.histLock.acquire()
+        pending = self.pendingTransitions
+        self.pendingTransitions = []
+        discardFrom = self.discardFrom
+        self.discardFrom = None
+        replayStart = self.ReplayStartIdx()
+        meta = {}
+        self.AddMetaDataFields2Dict(meta)
         self.histLock.release()
 
-    def SaveHistFile(self, transitions):
-        if self.histFileName != '':
-            pd.to_pickle(transitions, self.histFileName + '.gz', 'gzip') 
-            if os.path.getsize(self.histFileName + '.gz') == 0:
-                print("\n\n\n\nError save 0 bytes\n\n\n")
-            
-            if self.params.saveOldHist:
-                if len(self.oldTransitions["a"]) >= self.params.maxReplaySize:
-                    pd.to_pickle(self.oldTransitions, self.histFileName + str(self.numOldHistFiles) + '.gz', 'gzip') 
-                    
-                    self.numOldHistFiles += 1
-                    
-                    for key in self.transitionKeys:
-                        self.oldTransitions[key] = []
-                elif len(self.oldTransitions["a"]) > 0:
-                    pd.to_pickle(self.oldTransitions, self.histFileName + self.lastHistFileAdd + '.gz', 'gzip') 
+        if discardFrom != None:
+            self.store.Truncate(max(0, discardFrom - self.store.firstIdx))
+
+        if len(pending) > 0:
+            columns = [np.concatenate(cols) for cols in zip(*pending)]
+            self.store.Append(*columns, saveManifest=False)
+        
+        self.store.replayStart = replayStart
+        if not self.params.saveOldHist:
+            # only transitions of current replay are kept
+            self.store.DropBefore(max(replayStart - self.store.firstIdx, self.store.Size() - self.params.maxReplaySize))
+
+        self.store.SaveMeta(meta)
+        self.store.SaveManifest()
+
+        self.saveLock.release()
 
     def DrawState(self, realState):
         if realState:
-            sizeHist = len(self.transitions["a"])
-            if sizeHist > 0:
-                idx = np.random.randint(0,sizeHist)
-                s = self.transitions["s"][idx].copy()
-            else:
-                s = np.array([])
+            s = self.replay.DrawState()
         else:
             s = self.transitions["maxStateVals"].copy()
             if max(s) == 1:
@@ -349,50 +1150,117 @@ class HistoryMngr(History):
 
 
     def GetAllHist(self):
+        if self.store == None:
+            return self.replay.ToDict()
+
+        self.SaveHistFile()
+
+        self.saveLock.acquire()
         transitions = {}
-        for key in self.transitionKeys:
-            transitions[key] = []
-
-        if self.params.saveOldHist:
-            for i in range(self.numOldHistFiles):
-                currTransitions = pd.read_pickle(self.histFileName + str(i) + '.gz', compression='gzip')
-                for key in self.transitionKeys:
-                    transitions[key] += currTransitions[key]
-            
-            for key in self.transitionKeys:
-                transitions[key] += self.oldTransitions[key] 
-        
-        for key in self.transitionKeys:
-            transitions[key] += self.transitions[key]   
+        for key, vals in zip(self.transitionKeys, self.store.Read()):
+            transitions[key] = vals
+        self.saveLock.release()
 
         return transitions
 
+    def ReplayStartIdx(self):
+        # idx of oldest transition in replay (older transitions were evicted or dumped to old)
+        return max(self.replayStart, self.numLogged - self.replay.Size())
+
+    def IterEpisodes(self):
+        # iterator over all complete episodes in history (old history included)
+        if self.store == None:
+            return IterEpisodes(self.replay.GetAll(copy=True))
+
+        self.SaveHistFile()
+        return self.store.IterEpisodes()
+
+    def OldHistSize(self):
+        if self.store == None or not self.params.saveOldHist:
+            return 0
+
+        return self.ReplayStartIdx() - self.store.firstIdx
+
     def Reset(self, dump2Old=True, save=False):
+        # save lock: no append to store while replay start changes
+        self.saveLock.acquire()
         self.histLock.acquire()
-        if dump2Old:
-            while (len(self.transitions["a"]) > 0):
-                for key in self.transitionKeys:
-                    self.oldTransitions[key].append(self.transitions[key].pop(0))
-        else:
-            for key in self.transitionKeys:
-                self.transitions[key] = []
+        if not (dump2Old and self.params.saveOldHist):
+            # transitions of replay are removed from store on next save
+            replayStart = self.ReplayStartIdx()
+            self.pendingTransitions = []
+            self.discardFrom = replayStart if self.discardFrom == None else min(self.discardFrom, replayStart)
+            self.numLogged = replayStart
         
-        if save:
-            self.SaveHistFile(self.transitions)
-
+        self.replayStart = self.numLogged
+        self.replay.Reset()
+        if self.planner != None:
+            self.syntheticReplay.Reset()
+            self.planner.Reset()
         self.histLock.release()
+        self.saveLock.release()
+
+        if save:
+            self.SaveHistFile()
 
     def GetTransitionsSortedByIdx(self, idx):
         self.histLock.acquire()
-        s = np.array(self.transitions["s"])
-        a = np.array(self.transitions["a"])
-        r = np.array(self.transitions["r"])
-        s_ = np.array(self.transitions["s_"])
-        terminal = np.array(self.transitions["terminal"])
+        s, a, r, s_, terminal = self.replay.GetAll(copy=True)
         self.histLock.release()
 
         sortedIdx = s[:, idx].argsort()
 
 
 
-        return s[sortedIdx,:], a[sortedIdx], r[sortedIdx], s_[sortedIdx,:], terminal[sortedIdx]
\ No newline at end of file
+        return s[sortedIdx,:], a[sortedIdx], r[sortedIdx], s_[sortedIdx,:], terminal[sortedIdx]
+
+
+def BenchmarkHistoryThreads(numThreadsList = [1, 4, 8], numTransitions = 50000, stateSize = 64, drainInterval = 0.01):
+    # game threads learn to their sons while a train thread drains them to replay
+    import threading
+    import time
+    from utils import ParamsBase
+
+    for numThreads in numThreadsList:
+        params = ParamsBase(stateSize=stateSize, numActions=4, maxReplaySize=numThreads * numTransitions)
+        mngr = HistoryMngr(params, isMultiThreaded=True)
+        sons = [mngr.AddHistory() for i in range(numThreads)]
+        state = np.random.uniform(size=stateSize)
+
+        def Produce(hist):
+            for i in range(numTransitions):
+                hist.learn(state, i % 4, 0.0, state, i % 100 == 99)
+
+        producing = threading.Event()
+        producing.set()
+        drainDurations = []
+        def Drain():
+            while producing.is_set():
+                start = time.time()
+                mngr.JoinHistoryFromSons()
+                drainDurations.append(time.time() - start)
+                time.sleep(drainInterval)
+
+        producers = [threading.Thread(target=Produce, args=(hist,)) for hist in sons]
+        drainer = threading.Thread(target=Drain)
+
+        start = time.time()
+        drainer.start()
+        for thread in producers:
+            thread.start()
+        for thread in producers:
+            thread.join()
+        learnDuration = time.time() - start
+        
+        producing.clear()
+        drainer.join()
+        mngr.JoinHistoryFromSons()
+
+        numLearned = numThreads * numTransitions
+        print("threads =", numThreads, "learn rate =", int(numLearned / learnDuration), "transitions/sec", 
+                "drain avg =", "%.2f" % (1000 * np.average(drainDurations)), "ms max =", "%.2f" % (1000 * np.max(drainDurations)), "ms",
+                "lost transitions =", numLearned - mngr.Size())
+
+
+if __name__ == "__main__":
+    BenchmarkHistoryThreads()
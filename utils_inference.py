@@ -0,0 +1,198 @@
+import numpy as np
+import threading
+import time
+import queue
+from collections import deque
+
+
+class BatchInferenceServer():
+    def __init__(self, evalFunc, stateSize, maxBatchSize = 64, batchWindow = 0.001, name = "", reportEvery = 10000):
+        # requests of all game threads gathered during batch window are evaluated in single call of evalFunc(states)
+        self.evalFunc = evalFunc
+        self.stateSize = stateSize
+        self.maxBatchSize = maxBatchSize
+        self.batchWindow = batchWindow
+        self.name = name
+        self.reportEvery = reportEvery
+
+        self.requests = queue.Queue()
+        self.threadData = threading.local()
+        # num of threads using server (batch is closed before window ends when all of them are waiting)
+        self.numClients = 0
+
+        # latency of last requests (seconds) and num of requests since last report
+        self.latencies = deque(maxlen=reportEvery)
+        self.statsLock = threading.Lock()
+        self.numRequests = 0
+        self.numBatches = 0
+        self.statsStart = time.time()
+
+        self.thread = threading.Thread(target=self.Serve, name=name + "_inferenceServer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Register(self):
+        # current thread becomes a client of server
+        self.threadData.event = threading.Event()
+        self.statsLock.acquire()
+        self.numClients += 1
+        self.statsLock.release()
+
+    def Unregister(self):
+        # current thread stops using server (batches do not wait for its requests)
+        if hasattr(self.threadData, "event"):
+            del self.threadData.event
+            self.statsLock.acquire()
+            self.numClients -= 1
+            self.statsLock.release()
+
+    def Close(self):
+        # requests already queued are served, then serving thread is stopped
+        if self.thread == None:
+            return
+
+        self.requests.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def Evaluate(self, state):
+        if not hasattr(self.threadData, "event"):
+            self.Register()
+
+        start = time.time()
+        event = self.threadData.event
+        event.clear()
+        # request = [state, event, result]
+        request = [state.reshape(self.stateSize), event, None]
+        self.requests.put(request)
+        event.wait()
+
+        self.AddLatency(time.time() - start)
+        if isinstance(request[2], Exception):
+            raise request[2]
+
+        return request[2]
+
+    def Serve(self):
+        # None request stops serving
+        toStop = False
+        while not toStop:
+            request = self.requests.get()
+            if request == None:
+                return
+
+            requests = [request]
+            deadline = time.time() + self.batchWindow
+            while len(requests) < min(self.maxBatchSize, self.numClients):
+                timeLeft = deadline - time.time()
+                if timeLeft <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeLeft)
+                except queue.Empty:
+                    break
+
+                if request == None:
+                    toStop = True
+                    break
+                requests.append(request)
+
+            try:
+                vals = self.evalFunc(np.stack([request[0] for request in requests]))
+                for i in range(len(requests)):
+                    requests[i][2] = vals[i]
+            except Exception as e:
+                for request in requests:
+                    request[2] = e
+
+            self.numBatches += 1
+            for request in requests:
+                request[1].set()
+
+    def AddLatency(self, latency):
+        self.statsLock.acquire()
+        self.latencies.append(latency)
+        self.numRequests += 1
+        toReport = self.numRequests >= self.reportEvery
+        self.statsLock.release()
+
+        if toReport:
+            self.Report()
+
+    def Stats(self):
+        # p50, p99 latency (ms), steps per second and avg batch size since last report
+        self.statsLock.acquire()
+        latencies = np.array(self.latencies)
+        duration = time.time() - self.statsStart
+        numRequests = self.numRequests
+        numBatches = self.numBatches
+        self.statsLock.release()
+
+        if len(latencies) == 0:
+            return 0.0, 0.0, 0.0, 0.0
+
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        return p50, p99, numRequests / duration, numRequests / max(numBatches, 1)
+
+    def Report(self):
+        p50, p99, stepsPerSec, avgBatch = self.Stats()
+        print("\t", self.name, "->inference latency p50 =", "%.3f" % p50, "ms, p99 =", "%.3f" % p99, "ms, steps/sec =", int(stepsPerSec), ", avg batch =", "%.1f" % avgBatch)
+
+        self.statsLock.acquire()
+        self.latencies.clear()
+        self.numRequests = 0
+        self.numBatches = 0
+        self.statsStart = time.time()
+        self.statsLock.release()
+
+
+def BenchmarkInferenceServer(numThreadsList = [1, 4, 8], numSteps = 2000, stateSize = 64, numActions = 8, evalDuration = 0.0005):
+    # forward pass is simulated with fixed overhead for each call (as session run) on a single device and matrix product
+    weights = np.random.uniform(size=(stateSize, numActions))
+    deviceLock = threading.Lock()
+    def EvalFunc(states):
+        deviceLock.acquire()
+        time.sleep(evalDuration)
+        deviceLock.release()
+        return np.matmul(states, weights)
+
+    for numThreads in numThreadsList:
+        for batched in [False, True]:
+            server = BatchInferenceServer(EvalFunc, stateSize, reportEvery=numThreads * numSteps + 1) if batched else None
+            latencies = []
+            latenciesLock = threading.Lock()
+
+            def Play():
+                state = np.random.uniform(size=stateSize)
+                threadLatencies = []
+                for i in range(numSteps):
+                    start = time.time()
+                    if server != None:
+                        server.Evaluate(state)
+                    else:
+                        EvalFunc(state.reshape(1, stateSize))[0]
+                    threadLatencies.append(time.time() - start)
+
+                if server != None:
+                    server.Unregister()
+
+                latenciesLock.acquire()
+                latencies.extend(threadLatencies)
+                latenciesLock.release()
+
+            threads = [threading.Thread(target=Play) for i in range(numThreads)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            duration = time.time() - start
+            if server != None:
+                server.Close()
+
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print("threads =", numThreads, "batched =", batched, "latency p50 =", "%.3f" % p50, "ms, p99 =", "%.3f" % p99, "ms, steps/sec =", int(numThreads * numSteps / duration))
+
+
+if __name__ == "__main__":
+    BenchmarkInferenceServer()
@@ -0,0 +1,257 @@
+import time
+
+import numpy as np
+
+
+def TypesLut(typesDict):
+    # lut of unit type -> value of type in typesDict (False for types not in dict, types above max are mapped to the last entry)
+    lut = np.zeros(max(typesDict.keys()) + 2, dtype=bool)
+    for unit, val in typesDict.items():
+        lut[unit] = val
+
+    return lut
+
+
+def WindowSums(mat, sizeY, sizeX):
+    # sums of all windows of (sizeY, sizeX) in mat by summed area table (sum of window with top left corner (y, x) is in [y, x])
+    sat = np.zeros((mat.shape[0] + 1, mat.shape[1] + 1), dtype=np.int64)
+    sat[1:, 1:] = mat.astype(np.int64).cumsum(axis=0).cumsum(axis=1)
+    return sat[sizeY:, sizeX:] - sat[:-sizeY, sizeX:] - sat[sizeY:, :-sizeX] + sat[:-sizeY, :-sizeX]
+
+
+def FlatFootprints(freeMat, heightMap, sizeY, sizeX):
+    # top left corners of footprints of (sizeY, sizeX) in which all values of freeMat are equal to the (positive) height of the corner.
+    # window of values equal to v <=> sum((val - v) ^ 2) = 0
+    if sizeY > freeMat.shape[0] or sizeX > freeMat.shape[1]:
+        return np.zeros((0, 0), dtype=bool)
+
+    sums = WindowSums(freeMat, sizeY, sizeX)
+    sqSums = WindowSums(freeMat.astype(np.int64) ** 2, sizeY, sizeX)
+    corner = heightMap[:sums.shape[0], :sums.shape[1]].astype(np.int64)
+    return (corner > 0) & (sqSums - 2 * corner * sums + sizeY * sizeX * corner * corner == 0)
+
+
+def ScreenFreeMat(unitType, heightMap, blockingLut, ccMat, notAllowedDirections2CC = [], nonValidCoord = [], jump = 5):
+    # height of free pixels and -1 for blocked pixels (blocking units, non valid coords and pixels blocking resource gathering of command center)
+    height, width = unitType.shape
+    blocked = blockingLut[np.minimum(unitType, len(blockingLut) - 1)]
+
+    for c in nonValidCoord:
+        if 0 <= c[0] < height and 0 <= c[1] < width:
+            blocked[c[0], c[1]] = True
+
+    if ccMat.any():
+        # pixels above and left of the bottom right of command center are blocking when command center is in a non allowed direction
+        maxCC = np.max(ccMat.nonzero(), axis=1)
+        nearCC = np.zeros((maxCC[0] + 1, maxCC[1] + 1), dtype=bool)
+        for direction in notAllowedDirections2CC:
+            dy, dx = direction[0] * jump, direction[1] * jump
+            shifted = np.zeros((height, width), dtype=bool)
+            shifted[max(-dy, 0):height - max(dy, 0), max(-dx, 0):width - max(dx, 0)] = ccMat[max(dy, 0):height - max(-dy, 0), max(dx, 0):width - max(-dx, 0)]
+            nearCC |= shifted[:maxCC[0] + 1, :maxCC[1] + 1]
+
+        blocked[:maxCC[0] + 1, :maxCC[1] + 1] |= nearCC
+
+    return np.where(blocked, -1, heightMap.astype(np.int64))
+
+
+def BuildingLocation(unitType, heightMap, blockingLut, ccMat, neededSizeY, neededSizeX, notAllowedDirections2CC = [], nonValidCoord = []):
+    # middle of the first (by raster order of corners) flat free footprint of building ([-1, -1] if none)
+    freeMat = ScreenFreeMat(unitType, heightMap, blockingLut, ccMat, notAllowedDirections2CC, nonValidCoord)
+    valid = FlatFootprints(freeMat, heightMap, neededSizeY, neededSizeX)
+    if not valid.any():
+        return [-1, -1]
+
+    yStart, xStart = np.unravel_index(np.argmax(valid), valid.shape)
+    return [int(yStart) + int(neededSizeY / 2), int(xStart) + int(neededSizeX / 2)]
+
+
+def BuildingLocationLoops(unitType, heightMap, blockingLut, ccMat, neededSizeY, neededSizeX, notAllowedDirections2CC = [], nonValidCoord = [], jump = 5):
+    # reference pixels scan (previous implementation of utils.GetLocationForBuilding)
+    screenSize = unitType.shape[0]
+    hasCC = ccMat.any()
+    if hasCC:
+        maxCC = np.max(ccMat.nonzero(), axis=1)
+
+    def BlockingResourceGather(y, x):
+        if x > maxCC[1] or y > maxCC[0]:
+            return False
+        for direction in notAllowedDirections2CC:
+            if ccMat[y + direction[0] * jump][x + direction[1] * jump]:
+                return True
+        return False
+
+    def InNonValidCoord(y, x):
+        for c in nonValidCoord:
+            if c[1] == x and c[0] == y:
+                return True
+        return False
+
+    foundLoc = False
+    location = [-1, -1]
+    freeMat = np.zeros((screenSize, screenSize), int)
+    for y in range(screenSize):
+        for x in range(screenSize):
+            if blockingLut[unitType[y][x]] or InNonValidCoord(y, x):
+                freeMat[y,x] = -1
+            elif hasCC and BlockingResourceGather(y, x):
+                freeMat[y,x] = -1
+            else:
+                freeMat[y,x] = heightMap[y][x]
+
+            yStart = y - neededSizeY + 1
+            xStart = x - neededSizeX + 1
+
+            if yStart >= 0 and xStart >= 0:
+                yEnd = yStart + neededSizeY
+                xEnd = xStart + neededSizeX
+                heightVal = heightMap[yStart][xStart]
+                if heightVal > 0:
+                    foundLoc = (freeMat[yStart:yEnd, xStart:xEnd] == heightVal).all()
+                    if foundLoc:
+                        location = [yStart + int(neededSizeY / 2), xStart + int(neededSizeX / 2)]
+                        break
+
+        if foundLoc:
+            break
+
+    return location
+
+
+def MiniMapBuildingLocation(occupyMat, heightMap, neededSize, commandCenterLoc, maxDist):
+    # middle of the free flat footprint (corners until size - neededSize) nearest to command center ([-1, -1] if none).
+    # ties are resolved by raster order of corners
+    numCorners = heightMap.shape[0] - neededSize
+    if numCorners <= 0:
+        return [-1, -1]
+
+    freeMat = np.where(occupyMat, -1, heightMap.astype(np.int64))
+    valid = FlatFootprints(freeMat, heightMap, neededSize, neededSize)[:numCorners, :numCorners]
+
+    # distance field of footprints middles from command center
+    middles = np.arange(numCorners) + int(neededSize / 2)
+    diffY = middles - commandCenterLoc[0]
+    diffX = middles - commandCenterLoc[1]
+    dist = diffY[:, None] * diffY[:, None] + diffX[None, :] * diffX[None, :]
+
+    dist = np.where(valid & (dist < maxDist), dist, np.inf)
+    idx = np.argmin(dist)
+    if dist.flat[idx] == np.inf:
+        return [-1, -1]
+
+    yStart, xStart = np.unravel_index(idx, dist.shape)
+    return [int(yStart) + int(neededSize / 2), int(xStart) + int(neededSize / 2)]
+
+
+def MiniMapBuildingLocationLoops(occupyMat, heightMap, neededSize, commandCenterLoc, maxDist):
+    # reference footprints scan (previous implementation of utils.GetLocationForBuildingMiniMap)
+    miniMapSize = heightMap.shape[0]
+
+    def HaveSpace(yStart, xStart):
+        height = heightMap[yStart][xStart]
+        if height == 0:
+            return False
+        yEnd = min(yStart + neededSize, miniMapSize)
+        xEnd = min(xStart + neededSize, miniMapSize)
+        for y in range (yStart, yEnd):
+            for x in range (xStart, xEnd):
+                if occupyMat[y][x] or height != heightMap[y][x]:
+                    return False
+        return True
+
+    location = [-1, -1]
+    minDist = maxDist
+    for y in range(0, miniMapSize - neededSize):
+        for x in range(0, miniMapSize - neededSize):
+            if HaveSpace(y, x):
+                currLocation = [y + int(neededSize / 2), x + int(neededSize / 2)]
+                diffY = currLocation[0] - commandCenterLoc[0]
+                diffX = currLocation[1] - commandCenterLoc[1]
+                currDist = diffX * diffX + diffY * diffY
+                if currDist < minDist:
+                    location = currLocation
+                    minDist = currDist
+
+    return location
+
+
+def BaseScreen(numBuildings, screenSize = 84, numTypes = 10, ccType = 1, numHeights = 3):
+    # screen of rectangles of random blocking types over a few height levels and a command center far from the screen edges
+    unitType = np.zeros((screenSize, screenSize), dtype=int)
+    heightMap = np.zeros((screenSize, screenSize), dtype=int)
+    levels = np.sort(np.random.randint(0, screenSize, numHeights - 1))
+    for i, level in enumerate(levels):
+        heightMap[:, level:] = (i + 1) * 40
+    heightMap[:, :levels[0]] = 0 if np.random.uniform() < 0.5 else 20
+
+    for i in range(numBuildings):
+        size = np.random.randint(2, 14)
+        y, x = np.random.randint(0, screenSize - size, 2)
+        unitType[y:y + size, x:x + size] = np.random.randint(2, numTypes)
+
+    cy, cx = np.random.randint(10, screenSize - 30, 2)
+    unitType[cy:cy + 18, cx:cx + 18] = ccType
+    return unitType, heightMap
+
+
+def BenchmarkBuildingLocation(numScreens = 20, numBuildingsList = [5, 20, 60], sizes = [(9, 9), (12, 12), (12, 15), (18, 18)]):
+    ccType = 1
+    blockingLut = TypesLut({unit: unit % 3 > 0 for unit in range(1, 10)})
+    directions = [[1, 0], [1, 1], [0, 1]]
+    for numBuildings in numBuildingsList:
+        loopsDuration = 0.0
+        vectorDuration = 0.0
+        numCalls = 0
+        equal = 0
+        for i in range(numScreens):
+            unitType, heightMap = BaseScreen(numBuildings, ccType=ccType)
+            ccMat = unitType == ccType
+            nonValidCoord = np.random.randint(0, unitType.shape[0], (5, 2)).tolist()
+            for neededSizeY, neededSizeX in sizes:
+                start = time.time()
+                loopsLoc = BuildingLocationLoops(unitType, heightMap, blockingLut, ccMat, neededSizeY, neededSizeX, directions, nonValidCoord)
+                loopsDuration += time.time() - start
+
+                start = time.time()
+                vectorLoc = BuildingLocation(unitType, heightMap, blockingLut, ccMat, neededSizeY, neededSizeX, directions, nonValidCoord)
+                vectorDuration += time.time() - start
+
+                numCalls += 1
+                equal += loopsLoc == vectorLoc
+
+        print("buildings =", numBuildings, "loops =", "%.2f" % (loopsDuration * 1000 / numCalls), "ms, vectorized =", "%.3f" % (vectorDuration * 1000 / numCalls),
+                "ms, equal in", equal, "/", numCalls, "calls")
+
+
+def BenchmarkMiniMapBuildingLocation(numMiniMaps = 20, occupiedRatios = [0.02, 0.1, 0.3], sizes = [2, 4, 5], miniMapSize = 64):
+    # minimaps of height levels with occupied pixels in blobs
+    maxDist = 2 * miniMapSize * miniMapSize
+    for ratio in occupiedRatios:
+        loopsDuration = 0.0
+        vectorDuration = 0.0
+        numCalls = 0
+        equal = 0
+        for i in range(numMiniMaps):
+            _, heightMap = BaseScreen(0, miniMapSize)
+            occupyMat = np.random.uniform(size=(miniMapSize, miniMapSize)) < ratio
+            occupyMat |= np.roll(occupyMat, 1, axis=0) & (np.random.uniform(size=(miniMapSize, miniMapSize)) < 0.5)
+            ccLoc = np.random.randint(0, miniMapSize, 2).tolist()
+            for neededSize in sizes:
+                start = time.time()
+                loopsLoc = MiniMapBuildingLocationLoops(occupyMat, heightMap, neededSize, ccLoc, maxDist)
+                loopsDuration += time.time() - start
+
+                start = time.time()
+                vectorLoc = MiniMapBuildingLocation(occupyMat, heightMap, neededSize, ccLoc, maxDist)
+                vectorDuration += time.time() - start
+
+                numCalls += 1
+                equal += loopsLoc == vectorLoc
+
+        print("occupied ratio =", ratio, "loops =", "%.2f" % (loopsDuration * 1000 / numCalls), "ms, vectorized =", "%.3f" % (vectorDuration * 1000 / numCalls),
+                "ms, equal in", equal, "/", numCalls, "calls")
+
+
+if __name__ == "__main__":
+    BenchmarkBuildingLocation()
+    BenchmarkMiniMapBuildingLocation()
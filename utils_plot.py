@@ -45,7 +45,7 @@ def create_nnGraphs(superAgent, agent2Check, statesIdx, actions2Check, plotTarge
     for a in actions2Check:
         actionsPoints[a] = [[], [], [], []]
 
-    sizeHist = len(dm.historyMngr.transitions["a"])
+    sizeHist = dm.historyMngr.Size()
     size2Plot = min(sizeHist, maxSize2Plot)
     for i in range(size2Plot):
         s = dm.DrawStateFromHist(realState=False)
@@ -0,0 +1,146 @@
+import numpy as np
+
+from threading import Lock
+
+
+class StateRegistry:
+    def __init__(self, initialCapacity = 1024):
+        # state vectors are interned to dense ids: vector of id is row of vectors array, id of vector is found by its bytes.
+        # all states are kept in the dtype of the registry (upcasted only when state values are lost in cast)
+        self.initialCapacity = initialCapacity
+        self.lock = Lock()
+        self.Reset()
+
+    def Reset(self):
+        self.vectors = None
+        self.shape = None
+        self.size = 0
+        self.idOfKey = {}
+
+    def NumStates(self):
+        return self.size
+
+    def Canonical(self, states, batch = False):
+        # states as contiguous rows in registry dtype
+        states = np.asarray(states)
+        shape = states.shape[1:] if batch else states.shape
+        if self.vectors is None:
+            self.shape = shape
+            self.vectors = np.zeros((self.initialCapacity, int(np.prod(shape))), dtype=states.dtype)
+        elif int(np.prod(shape)) != self.vectors.shape[1]:
+            raise ValueError("state of size " + str(int(np.prod(shape))) + " does not match registry state size " + str(self.vectors.shape[1]))
+
+        if states.dtype != self.vectors.dtype:
+            casted = states.astype(self.vectors.dtype)
+            if not np.can_cast(states.dtype, self.vectors.dtype) and not np.array_equal(casted, states):
+                self.Upcast(np.result_type(states.dtype, self.vectors.dtype))
+                casted = states.astype(self.vectors.dtype)
+            states = casted
+
+        return np.ascontiguousarray(states.reshape(-1, self.vectors.shape[1]))
+
+    def Upcast(self, dtype):
+        self.vectors = self.vectors.astype(dtype)
+        self.idOfKey = {self.vectors[i].tobytes(): i for i in range(self.size)}
+
+    def KnownId(self, state):
+        # lookup without lock for state in registry dtype
+        if isinstance(state, np.ndarray) and self.vectors is not None and state.dtype == self.vectors.dtype and state.size == self.vectors.shape[1]:
+            return self.idOfKey.get(state.tobytes())
+
+        return None
+
+    def Id(self, state):
+        # id of state (None if state not registered)
+        if self.vectors is None:
+            return None
+
+        sId = self.KnownId(state)
+        if sId != None:
+            return sId
+
+        with self.lock:
+            return self.idOfKey.get(self.Canonical(state)[0].tobytes())
+
+    def Encode(self, state):
+        # id of state (state is registered if not exist)
+        sId = self.KnownId(state)
+        if sId != None:
+            return sId
+
+        with self.lock:
+            vector = self.Canonical(state)[0]
+            sId = self.idOfKey.get(vector.tobytes())
+            if sId == None:
+                sId = self.Add(vector)
+
+        return sId
+
+    def EncodeBatch(self, states):
+        # ids of states vec. each distinct state is looked up once (distinct rows are found by sorting 64 bit hash of rows)
+        if len(states) == 0:
+            return np.zeros(0, dtype=int)
+
+        with self.lock:
+            vectors = self.Canonical(states, batch=True)
+            rowsBytes = vectors.view(np.uint8).reshape(len(vectors), -1)
+
+            _, firstIdx, inverse = np.unique(RowsHash(rowsBytes), return_index=True, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            if not np.array_equal(rowsBytes, rowsBytes[firstIdx[inverse]]):
+                rowsView = rowsBytes.view(np.dtype((np.void, rowsBytes.shape[1]))).reshape(-1)
+                _, firstIdx, inverse = np.unique(rowsView, return_index=True, return_inverse=True)
+                inverse = inverse.reshape(-1)
+
+            # new states are registered by order of appearance
+            uniqueIds = np.zeros(len(firstIdx), dtype=int)
+            for i in np.argsort(firstIdx):
+                vector = vectors[firstIdx[i]]
+                sId = self.idOfKey.get(vector.tobytes())
+                uniqueIds[i] = sId if sId != None else self.Add(vector)
+
+        return uniqueIds[inverse]
+
+    def Add(self, vector):
+        if self.size == len(self.vectors):
+            vectors = np.zeros((2 * len(self.vectors), self.vectors.shape[1]), dtype=self.vectors.dtype)
+            vectors[:self.size] = self.vectors[:self.size]
+            self.vectors = vectors
+
+        sId = self.size
+        self.vectors[sId] = vector
+        self.idOfKey[vector.tobytes()] = sId
+        self.size += 1
+        return sId
+
+    def Decode(self, sId):
+        return self.vectors[sId].reshape(self.shape).copy()
+
+    def DecodeBatch(self, ids):
+        ids = np.asarray(ids, dtype=int)
+        if self.vectors is None:
+            return np.zeros((len(ids), 0))
+
+        return self.vectors[ids].reshape((len(ids),) + self.shape)
+
+
+def RowsHash(rowsBytes):
+    # 64 bit hash of each row of uint8 matrix
+    numPad = -rowsBytes.shape[1] % 8
+    if numPad > 0:
+        rowsBytes = np.hstack((rowsBytes, np.zeros((len(rowsBytes), numPad), dtype=np.uint8)))
+
+    words = np.ascontiguousarray(rowsBytes).view(np.uint64)
+    h = np.full(len(words), 14695981039346656037, dtype=np.uint64)
+    for i in range(words.shape[1]):
+        h ^= words[:, i]
+        h *= np.uint64(1099511628211)
+        h ^= h >> np.uint64(29)
+
+    return h
+
+
+def ParseStateName(name):
+    # state saved as str(np.array) by older tables
+    state = np.fromstring(name.replace("[", "").replace("]", ""), sep=' ')
+    return state.astype(int) if np.array_equal(state, np.round(state)) else state
@@ -0,0 +1,70 @@
+import numpy as np
+import tensorflow as tf
+
+
+class NNSyncOps():
+    def __init__(self, fromVars, toVars, name = "sync"):
+        # assign ops are built once: hard copy, and soft (polyak) update with tau fed on run
+        with tf.name_scope(name):
+            self.tau = tf.placeholder(tf.float32, shape=(), name="tau")
+
+            hardOps = []
+            softOps = []
+            for fromVar, toVar in zip(fromVars, toVars):
+                hardOps.append(toVar.assign(fromVar))
+                tau = tf.cast(self.tau, toVar.dtype.base_dtype)
+                softOps.append(toVar.assign(tau * fromVar + (1 - tau) * toVar))
+
+            self.hardOp = tf.group(*hardOps, name="hard")
+            self.softOp = tf.group(*softOps, name="soft")
+
+    def Run(self, sess, tau = None):
+        if tau == None or tau >= 1.0:
+            sess.run(self.hardOp)
+        else:
+            sess.run(self.softOp, {self.tau: tau})
+
+
+class NNAssignOps():
+    def __init__(self, variables, name = "assign"):
+        # assign of external values through placeholders (built once)
+        with tf.name_scope(name):
+            self.placeholders = [tf.placeholder(var.dtype.base_dtype, var.get_shape()) for var in variables]
+            self.assignOp = tf.group(*[var.assign(placeholder) for var, placeholder in zip(variables, self.placeholders)])
+
+    def Run(self, sess, values):
+        sess.run(self.assignOp, dict(zip(self.placeholders, values)))
+
+
+def CheckSyncGraphSize(numSyncs = 10000):
+    # graph size should not change with repeated syncs
+    graph = tf.Graph()
+    with graph.as_default():
+        with tf.variable_scope("from"):
+            fromVars = [tf.get_variable("w", shape=(8, 8)), tf.get_variable("b", shape=(8,))]
+        with tf.variable_scope("to"):
+            toVars = [tf.get_variable("w", shape=(8, 8)), tf.get_variable("b", shape=(8,))]
+
+        syncOps = NNSyncOps(fromVars, toVars)
+        assignOps = NNAssignOps(toVars)
+        initOp = tf.global_variables_initializer()
+
+    with tf.Session(graph=graph) as sess:
+        sess.run(initOp)
+        numNodes = len(graph.get_operations())
+        values = [np.ones((8, 8)), np.ones(8)]
+        for i in range(numSyncs):
+            syncOps.Run(sess, 0.01 if i % 2 == 0 else None)
+            assignOps.Run(sess, values)
+
+        numNodesEnd = len(graph.get_operations())
+        print("graph nodes before =", numNodes, "after", numSyncs, "syncs =", numNodesEnd)
+        assert numNodes == numNodesEnd
+
+        syncOps.Run(sess)
+        fromVals, toVals = sess.run([fromVars, toVars])
+        assert all(np.array_equal(f, t) for f, t in zip(fromVals, toVals))
+
+
+if __name__ == "__main__":
+    CheckSyncGraphSize()
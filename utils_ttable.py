@@ -6,101 +6,395 @@ import os.path
 import time
 import datetime
 import sys
+import itertools
+
+from scipy import sparse
+
+from utils_states import StateRegistry, ParseStateName
 
 class TransitionTable:
-    def __init__(self, numActions, tableName, newTable = False):
+    def __init__(self, numActions, tableName, newTable = False, stateRegistry = None):
         self.tableName = tableName
+        # ids of states vectors (registry can be shared with other tables)
+        self.registry = stateRegistry if stateRegistry != None else StateRegistry()
         self.actions = list(range(numActions))  # a list
+        self.numActions = numActions
 
-        self.table = {}
-        
         self.TrialsData = "TrialsData"
         self.NumRunsTotalSlot = 0
-        
-        self.tableIdx = 0
-        self.actionSumIdx = 1
+
+        self.initialCapacity = 1024
+        self.Reset()
 
         if os.path.isfile(tableName + '.gz') and not newTable:
-            self.table = pd.read_pickle(tableName + '.gz', compression='gzip')
-        else:
-            self.table[self.TrialsData] = [0]
+            self.ReadTable()
+
+    def Reset(self):
+        # transitions counts are sparse coo entries (s, s_) of registry ids with count for each action,
+        # entry of (s, s_) is found by entryIdx, entries of s by stateEntries. csr views of entries are created when queried
+        self.numStates = 0
+
+        self.entryIdx = {}
+        self.stateEntries = {}
+        self.entryS = np.zeros(self.initialCapacity, dtype=int)
+        self.entryS_ = np.zeros(self.initialCapacity, dtype=int)
+        self.counts = np.zeros((self.initialCapacity, self.numActions), dtype=float)
+        self.numEntries = 0
+
+        self.actionCount = np.zeros((self.initialCapacity, self.numActions), dtype=float)
+        self.views = {}
+
+        self.numTotRuns = 0
+
+    def NumStates(self):
+        # ids of table are smaller than num states (ids of shared registry not in table have no transitions)
+        return self.numStates
 
-        self.numTotRuns = self.table[self.TrialsData][self.NumRunsTotalSlot]
+    def StateId(self, state):
+        # id of state (state is added if not exist)
+        return self.AddIds(self.registry.Encode(state))
 
-    def check_item_exist(self, item):
-        if item not in self.table:
-            # append new state to q table
-            self.table[item] = [None, None]
-            self.table[item][self.tableIdx] = pd.DataFrame(columns=self.actions, dtype=np.float)
-            self.table[item][self.actionSumIdx] = []
-            for a in range(0, len(self.actions)):
-                self.table[item][self.actionSumIdx].append(0)
+    def AddIds(self, maxId):
+        self.numStates = max(self.numStates, maxId + 1)
+        while self.numStates > len(self.actionCount):
+            self.actionCount = self.Grow(self.actionCount)
+
+        return maxId
+
+    def Id(self, state):
+        # id of state (None if state not exist)
+        sId = self.registry.Id(state)
+        return sId if sId != None and sId < self.numStates else None
+
+    def Grow(self, arr):
+        grown = np.zeros((2 * len(arr),) + arr.shape[1:], dtype=arr.dtype)
+        grown[:len(arr)] = arr
+        return grown
 
     def check_state_exist(self, s, s_):
-        self.check_item_exist(s)
-        if s_ not in self.table[s][self.tableIdx].index:
-            # append new state to q table
-            self.table[s][self.tableIdx] = self.table[s][self.tableIdx].append(pd.Series([0] * len(self.actions), index=self.table[s][self.tableIdx].columns, name=s_))   
+        return self.Entry(self.StateId(s), self.StateId(s_))
+
+    def Entry(self, sId, s_Id):
+        entry = self.entryIdx.get((sId, s_Id))
+        if entry == None:
+            entry = self.numEntries
+            if entry >= len(self.entryS):
+                self.entryS = self.Grow(self.entryS)
+                self.entryS_ = self.Grow(self.entryS_)
+                self.counts = self.Grow(self.counts)
+
+            self.entryS[entry] = sId
+            self.entryS_[entry] = s_Id
+            self.entryIdx[(sId, s_Id)] = entry
+            self.stateEntries.setdefault(sId, []).append(entry)
+            self.numEntries += 1
+
+        return sId, s_Id, entry
 
     def learn(self, s, a, s_):
-        self.check_state_exist(s, s_)  
+        sId, s_Id, entry = self.check_state_exist(s, s_)
 
         # update transition
-        self.table[s][self.tableIdx].ix[s_, a] += 1
-        self.table[s][self.actionSumIdx][a] += 1
+        self.counts[entry, a] += 1
+        self.actionCount[sId, a] += 1
+        if len(self.views) > 0:
+            self.views = {}
+
+    def learnBatch(self, s, a, s_):
+        # learn transitions vec (states are encoded in bulk). returns ids of s and s_
+        sIds, s_Ids, entries = self.learnEntries(s, a, s_)
+        return sIds, s_Ids
+
+    def learnEntries(self, s, a, s_):
+        # learn transitions vec. returns ids of s and s_ and entry of each transition
+        sIds = self.registry.EncodeBatch(s)
+        s_Ids = self.registry.EncodeBatch(s_)
+        if len(sIds) == 0:
+            return sIds, s_Ids, np.zeros(0, dtype=int)
+
+        self.AddIds(max(sIds.max(), s_Ids.max()))
+        a = np.asarray(a, dtype=int)
+        entries = np.array([self.Entry(sId, s_Id)[2] for sId, s_Id in zip(sIds.tolist(), s_Ids.tolist())], dtype=int)
+        np.add.at(self.counts, (entries, a), 1)
+        np.add.at(self.actionCount, (sIds, a), 1)
+        self.views = {}
+        return sIds, s_Ids, entries
+
+    def StatesEntries(self, sIds):
+        # entries of all states in sIds vec and idx in vec of the state of each entry
+        entries = [self.stateEntries.get(sId, []) for sId in sIds]
+        numEntries = [len(stateEntries) for stateEntries in entries]
+        return np.fromiter(itertools.chain.from_iterable(entries), dtype=int, count=sum(numEntries)), np.repeat(np.arange(len(entries)), numEntries)
+
+    def ActionCount(self, s):
+        # num of transitions from state s for each action
+        sId = self.Id(s)
+        return self.actionCount[sId].copy() if sId != None else np.zeros(self.numActions, dtype=float)
+
+    def TransitionMatrix(self, a, reverse = False):
+        # csr matrix of counts for action a (row = s, col = s_). reverse view is built from the same entries (row = s_, col = s)
+        key = (a, reverse)
+        if key not in self.views:
+            rows = self.entryS[:self.numEntries]
+            cols = self.entryS_[:self.numEntries]
+            if reverse:
+                rows, cols = cols, rows
+
+            numStates = self.NumStates()
+            self.views[key] = sparse.csr_matrix((self.counts[:self.numEntries, a], (rows, cols)), shape=(numStates, numStates))
+
+        return self.views[key]
+
+    def TransitionProbs(self, sIds, a):
+        # P(s_|s,a) for states ids vec as csr matrix (rows of states without transitions for a are empty)
+        sIds = np.asarray(sIds, dtype=int)
+        actionCount = self.actionCount[sIds, a]
+        norm = np.divide(1.0, actionCount, out=np.zeros(len(sIds)), where=actionCount > 0)
+        return sparse.diags(norm).dot(self.TransitionMatrix(a)[sIds]).tocsr()
+
+    def TransitionProb(self, s, a):
+        # ids of next states and P(s_|s,a) (empty if no transition of s and a)
+        sId = self.Id(s)
+        if sId == None or self.actionCount[sId, a] == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=float)
+
+        row = self.TransitionMatrix(a).getrow(sId)
+        nonZero = row.data > 0
+        return row.indices[nonZero], row.data[nonZero] / self.actionCount[sId, a]
+
+    def NextStates(self, sId, a):
+        # entries, ids of next states and counts of transitions of state id with action a (without building csr views)
+        entries = np.array(self.stateEntries.get(sId, []), dtype=int)
+        counts = self.counts[entries, a]
+        entries = entries[counts > 0]
+        return entries, self.entryS_[entries], counts[counts > 0]
 
     def end_run(self, saveTable):
-        self.numTotRuns += 1      
+        self.numTotRuns += 1
         if saveTable:
-            self.table[self.TrialsData][self.NumRunsTotalSlot] = self.numTotRuns
-            pd.to_pickle(self.table, self.tableName + '.gz', 'gzip') 
-    
+            self.SaveTable()
+
+    def TableDict(self):
+        numStates = self.NumStates()
+        return {self.TrialsData: [self.numTotRuns], "states": self.registry.DecodeBatch(np.arange(numStates)), "entryS": self.entryS[:self.numEntries].copy(),
+                "entryS_": self.entryS_[:self.numEntries].copy(), "counts": self.counts[:self.numEntries].copy(), "actionCount": self.actionCount[:numStates].copy()}
+
+    def SaveTable(self):
+        pd.to_pickle(self.TableDict(), self.tableName + '.gz', 'gzip')
+
+    def ReadTable(self):
+        table = pd.read_pickle(self.tableName + '.gz', compression='gzip')
+        self.Reset()
+        if "entryS" in table:
+            self.LoadTableDict(table)
+        else:
+            self.LoadOldTable(table)
+
+        self.numTotRuns = table[self.TrialsData][self.NumRunsTotalSlot]
+
+    def LoadTableDict(self, table):
+        # saved ids are mapped to registry ids
+        ids = self.EncodeSavedStates(table["states"])
+        for s, s_, counts in zip(ids[table["entryS"]].tolist(), ids[table["entryS_"]].tolist(), table["counts"]):
+            self.counts[self.Entry(s, s_)[2]] = counts
+
+        self.actionCount[ids] = table["actionCount"]
+        return ids
+
+    def EncodeSavedStates(self, states):
+        if len(states) == 0:
+            return np.zeros(0, dtype=int)
+
+        if isinstance(states[0], str):
+            states = [ParseStateName(name) for name in states]
+
+        ids = self.registry.EncodeBatch(np.array(states))
+        self.AddIds(ids.max())
+        return ids
+
+    def LoadOldTable(self, table):
+        # table saved as dict of state name -> [data frame of next states counts, action count]
+        for s, stateTable in table.items():
+            if s == self.TrialsData:
+                continue
+
+            self.AddOldStateTable(s, stateTable)
+
+    def AddOldStateTable(self, s, stateTable):
+        transitions = stateTable[0]
+        ids = self.EncodeSavedStates([s] + list(transitions.index))
+        for s_Id, s_ in zip(ids[1:].tolist(), transitions.index):
+            self.counts[self.Entry(ids[0], s_Id)[2]] = transitions.loc[s_].values.astype(float)
+
+        self.actionCount[ids[0]] = np.array(stateTable[1], dtype=float)
+
+
+class RewardTransitionTable(TransitionTable):
+    def __init__(self, numActions, tableName, newTable = False, stateRegistry = None):
+        super(RewardTransitionTable, self).__init__(numActions, tableName, newTable=newTable, stateRegistry=stateRegistry)
+
     def Reset(self):
-        self.table = {}
-        self.table[self.TrialsData] = [0]
+        super(RewardTransitionTable, self).Reset()
+        # sum of rewards and num of terminal transitions for each entry and action
+        self.rewardSum = np.zeros(self.counts.shape, dtype=float)
+        self.terminalCount = np.zeros(self.counts.shape, dtype=float)
+
+    def Entry(self, sId, s_Id):
+        sId, s_Id, entry = super(RewardTransitionTable, self).Entry(sId, s_Id)
+        if len(self.rewardSum) < len(self.counts):
+            self.rewardSum = self.Grow(self.rewardSum)
+            self.terminalCount = self.Grow(self.terminalCount)
+
+        return sId, s_Id, entry
+
+    def learnTransitions(self, s, a, r, s_, terminal):
+        # learn transitions vec with their rewards. returns ids of s and s_
+        sIds, s_Ids, entries = self.learnEntries(s, a, s_)
+        a = np.asarray(a, dtype=int)
+        np.add.at(self.rewardSum, (entries, a), r)
+        np.add.at(self.terminalCount, (entries, a), terminal)
+        return sIds, s_Ids
+
+    def RewardMean(self, entries, a):
+        return self.rewardSum[entries, a] / self.counts[entries, a]
+
+    def TerminalProb(self, entries, a):
+        return self.terminalCount[entries, a] / self.counts[entries, a]
+
+    def TableDict(self):
+        table = super(RewardTransitionTable, self).TableDict()
+        table["rewardSum"] = self.rewardSum[:self.numEntries].copy()
+        table["terminalCount"] = self.terminalCount[:self.numEntries].copy()
+        return table
+
+    def LoadTableDict(self, table):
+        ids = super(RewardTransitionTable, self).LoadTableDict(table)
+        if "rewardSum" in table:
+            entries = [self.entryIdx[(s, s_)] for s, s_ in zip(ids[table["entryS"]].tolist(), ids[table["entryS_"]].tolist())]
+            self.rewardSum[entries] = table["rewardSum"]
+            self.terminalCount[entries] = table["terminalCount"]
+
+        return ids
 
-        self.numTotRuns = self.table[self.TrialsData][self.NumRunsTotalSlot]
 
-        
 class BothWaysTransitionTable(TransitionTable):
-    def __init__(self, numActions, tableName):
-        super(BothWaysTransitionTable, self).__init__(numActions, tableName)
+    def __init__(self, numActions, tableName, stateRegistry = None):
         self.normalKey = 0
         self.reverseKey = 1
+        super(BothWaysTransitionTable, self).__init__(numActions, tableName, stateRegistry=stateRegistry)
 
-        if self.normalKey not in self.table:
-            self.table[self.normalKey] = {}
+    def Reset(self):
+        super(BothWaysTransitionTable, self).Reset()
+        # num of transitions to state for each action (forward and reverse views share entries)
+        self.reverseActionCount = np.zeros((self.initialCapacity, self.numActions), dtype=float)
+
+    def AddIds(self, maxId):
+        super(BothWaysTransitionTable, self).AddIds(maxId)
+        while self.numStates > len(self.reverseActionCount):
+            self.reverseActionCount = self.Grow(self.reverseActionCount)
 
-        if self.reverseKey not in self.table:
-            self.table[self.reverseKey] = {}
+        return maxId
+
+    def learn(self, s, a, s_):
+        super(BothWaysTransitionTable, self).learn(s, a, s_)
+        self.reverseActionCount[self.Id(s_), a] += 1
+
+    def learnBatch(self, s, a, s_):
+        sIds, s_Ids = super(BothWaysTransitionTable, self).learnBatch(s, a, s_)
+        np.add.at(self.reverseActionCount, (s_Ids, np.asarray(a, dtype=int)), 1)
+        return sIds, s_Ids
+
+    def ActionCount(self, s, tableType = 0):
+        if tableType == self.normalKey:
+            return super(BothWaysTransitionTable, self).ActionCount(s)
+
+        sId = self.Id(s)
+        return self.reverseActionCount[sId].copy() if sId != None else np.zeros(self.numActions, dtype=float)
+
+    def TableDict(self):
+        table = super(BothWaysTransitionTable, self).TableDict()
+        table["reverseActionCount"] = self.reverseActionCount[:self.NumStates()].copy()
+        return table
+
+    def LoadTableDict(self, table):
+        ids = super(BothWaysTransitionTable, self).LoadTableDict(table)
+        self.reverseActionCount[ids] = table["reverseActionCount"]
+        return ids
+
+    def LoadOldTable(self, table):
+        # normal table of old format holds all transitions (reverse table is recalculated from it)
+        for s, stateTable in table.get(self.normalKey, {}).items():
+            self.AddOldStateTable(s, stateTable)
+
+        self.reverseActionCount = np.zeros((len(self.actionCount), self.numActions), dtype=float)
+        np.add.at(self.reverseActionCount, self.entryS_[:self.numEntries], self.counts[:self.numEntries])
+
+
+class TransitionTargets:
+    def __init__(self, ttable, outputStart, outputEnd, thresholdNumTransitions = 1):
+        # normalized next state distribution (over output slice of state) of each (s, a) pair with more than threshold transitions.
+        # target of pair is regenerated only when pair is updated
+        self.ttable = ttable
+        self.outputStart = outputStart
+        self.outputEnd = outputEnd
+        self.thresholdNumTransitions = thresholdNumTransitions
+
+        self.initialCapacity = 1024
+        self.Reset()
+
+    def Reset(self):
+        self.pairIdx = {}
+        self.pairS = np.zeros(self.initialCapacity, dtype=int)
+        self.pairA = np.zeros(self.initialCapacity, dtype=int)
+        self.targets = np.zeros((self.initialCapacity, self.outputEnd - self.outputStart), dtype=float)
+        self.size = 0
+
+    def PairIdx(self, sId, a):
+        idx = self.pairIdx.get((sId, a))
+        if idx == None:
+            idx = self.size
+            if idx == len(self.pairS):
+                self.pairS = self.ttable.Grow(self.pairS)
+                self.pairA = self.ttable.Grow(self.pairA)
+                self.targets = self.ttable.Grow(self.targets)
             
-    def check_item_exist(self, item, tableType):
-        if item not in self.table[tableType]:
-            # append new state to q table
-            self.table[tableType][item] = [None, None]
-            self.table[tableType][item][self.tableIdx] = pd.DataFrame(columns=self.actions, dtype=np.float)
-            self.table[tableType][item][self.actionSumIdx] = [] #np.zeros(self.actions, dtype = int)
-            for a in range(0, len(self.actions)):
-                self.table[tableType][item][self.actionSumIdx].append(0)
+            self.pairS[idx] = sId
+            self.pairA[idx] = a
+            self.pairIdx[(sId, a)] = idx
+            self.size += 1
 
-    def check_state_exist(self, s, s_):
-        self.check_item_exist(s, self.normalKey)
-        self.check_item_exist(s_, self.reverseKey)
-        
-        if s_ not in self.table[self.normalKey][s][self.tableIdx].index:
-            self.table[self.normalKey][s][self.tableIdx] = self.table[self.normalKey][s][self.tableIdx].append(pd.Series([0] * len(self.actions), index=self.table[self.normalKey][s][self.tableIdx].columns, name=s_))   
+        return idx
 
-        if s not in self.table[self.reverseKey][s_][self.tableIdx].index:
-            self.table[self.reverseKey][s_][self.tableIdx] = self.table[self.reverseKey][s_][self.tableIdx].append(pd.Series([0] * len(self.actions), index=self.table[self.reverseKey][s_][self.tableIdx].columns, name=s))   
+    def Update(self, sIds, a):
+        # regenerate targets of pairs (sIds[i], a[i])
+        if len(sIds) == 0:
+            return
 
+        pairs = np.unique(np.stack((np.asarray(sIds, dtype=int), np.asarray(a, dtype=int)), axis=1), axis=0)
+        actionCount = self.ttable.actionCount[pairs[:, 0], pairs[:, 1]]
+        valid = actionCount > self.thresholdNumTransitions
+        pairs, actionCount = pairs[valid], actionCount[valid]
+        if len(pairs) == 0:
+            return
 
-    def learn(self, s, a, s_):
+        idx = np.array([self.PairIdx(sId, action) for sId, action in pairs.tolist()], dtype=int)
 
-        self.check_state_exist(s, s_)  
-        # update transition
+        entries, pairOfEntry = self.ttable.StatesEntries(pairs[:, 0].tolist())
+        counts = self.ttable.counts[entries, pairs[pairOfEntry, 1]]
+        nonZero = counts > 0
+        entries, pairOfEntry, counts = entries[nonZero], pairOfEntry[nonZero], counts[nonZero]
+
+        nextStates = self.ttable.registry.DecodeBatch(self.ttable.entryS_[entries]).reshape(len(entries), -1)
+        nextStates = nextStates[:, self.outputStart:self.outputEnd] > 0
+
+        dist = np.zeros((len(pairs), self.outputEnd - self.outputStart), dtype=float)
+        np.add.at(dist, pairOfEntry, counts[:, np.newaxis] * nextStates)
+        self.targets[idx] = dist / actionCount[:, np.newaxis]
 
-        self.table[self.reverseKey][s_][self.actionSumIdx][a] += 1
-        self.table[self.reverseKey][s_][self.tableIdx].ix[s, a] += 1
+    def UpdateAll(self):
+        sIds, a = np.nonzero(self.ttable.actionCount[:self.ttable.NumStates()] > self.thresholdNumTransitions)
+        self.Update(sIds, a)
 
-        self.table[self.normalKey][s][self.actionSumIdx][a] += 1
-        self.table[self.normalKey][s][self.tableIdx].ix[s_, a] += 1
\ No newline at end of file
+    def Targets(self):
+        # states ids, actions and next state distribution of all pairs
+        return self.pairS[:self.size], self.pairA[:self.size], self.targets[:self.size]